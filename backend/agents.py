@@ -9,6 +9,7 @@
 #
 # 每个智能体使用特定的 Prompt + LLM + 工具/记忆，实现其专业角色和决策行为。
 from langchain_core.messages import HumanMessage
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_community.chat_models import ChatTongyi
@@ -16,7 +17,11 @@ from langchain_deepseek import ChatDeepSeek
 from .config_user import load_user_config
 from .models import AgentState
 from .memory import FinancialSituationMemory
+from .tools import get_sector
+from .metrics import observe_llm
+from .tracing import KIND_CLIENT, tracer
 import os
+import time
 
 user_config = load_user_config()
 provider = user_config["llm_provider"].lower()
@@ -36,16 +41,79 @@ elif "doubao" in provider or "豆包" in provider:
 else:
     raise ValueError(f"不支持的 LLM 提供商: {provider}")
 
+class LLMMetricsCallback(BaseCallbackHandler):
+    """记录每次 LLM 调用的耗时、失败与 token 用量（/metrics）"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        observe_llm(self.model_name, time.perf_counter() - started if started else None,
+                    prompt_tokens=usage.get("prompt_tokens") or 0,
+                    completion_tokens=usage.get("completion_tokens") or 0)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        observe_llm(self.model_name, time.perf_counter() - started if started else None, error=True)
+
+
+class LLMTracingCallback(BaseCallbackHandler):
+    """每次 LLM 调用在当前 trace 中记录一个 span（挂在调用它的图节点 / 评估阶段下），附带 token 用量"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._spans = {}
+
+    def _start(self, run_id, **attributes):
+        span = tracer.start_span(f"llm {self.model_name}", span_type="llm", kind=KIND_CLIENT,
+                                 model=self.model_name, **attributes)
+        if span is not None:
+            self._spans[run_id] = span
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, prompt_chars=sum(len(p) for p in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, prompt_chars=sum(len(str(m.content)) for batch in messages for m in batch))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        span.set_attribute("prompt_tokens", usage.get("prompt_tokens"))
+        span.set_attribute("completion_tokens", usage.get("completion_tokens"))
+        span.end()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.record_error(error)
+            span.end()
+
+
 # 动态创建 LLM 实例
 def create_llm(model_name: str, temperature=0.1):
+    callbacks = [LLMMetricsCallback(model_name), LLMTracingCallback(model_name)]
     if "openai" in provider:
-        return ChatOpenAI(model=model_name, temperature=temperature, base_url=base_url)
+        return ChatOpenAI(model=model_name, temperature=temperature, base_url=base_url, callbacks=callbacks)
     elif "deepseek" in provider:
-        return ChatOpenAI(model=model_name, temperature=temperature, base_url=base_url, api_key=os.environ["DEEPSEEK_API_KEY"])
+        return ChatOpenAI(model=model_name, temperature=temperature, base_url=base_url, api_key=os.environ["DEEPSEEK_API_KEY"],
+                          callbacks=callbacks)
     elif "qwen" in provider:
-        return ChatTongyi(model=model_name, temperature=temperature, api_key=os.environ["QWEN_API_KEY"])
+        return ChatTongyi(model=model_name, temperature=temperature, api_key=os.environ["QWEN_API_KEY"], callbacks=callbacks)
     elif "doubao" in provider:
-        return ChatOpenAI(model=model_name, temperature=temperature, base_url=base_url, api_key=os.environ["DOUBAO_API_KEY"])
+        return ChatOpenAI(model=model_name, temperature=temperature, base_url=base_url, api_key=os.environ["DOUBAO_API_KEY"],
+                          callbacks=callbacks)
     else:
         raise ValueError(f"未知提供商: {provider}")
 
@@ -115,18 +183,38 @@ def create_analyst_node(llm, toolkit, system_message, tools, output_field):
     return analyst_node
 
 
-# 此函数是一个工厂，用于为研究者智能体（牛市或熊市）创建一个 LangGraph 节点。
-def create_researcher_node(llm, memory, role_prompt, agent_name):
-    def researcher_node(state):
-        # 首先，将所有分析师报告合并成一个摘要，以便提供上下文。
-        situation_summary = f"""
+# 将所有分析师报告合并成一个摘要，作为决策上下文与记忆检索的情境。
+def _situation_summary(state):
+    return f"""
         市场分析报告: {state['market_report']}
         社交媒体情绪分析报告: {state['sentiment_report']}
         新闻分析报告: {state['news_report']}
         基本面分析报告: {state['fundamentals_report']}
         """
-        past_memories = memory.get_memories(situation_summary)
-        past_memory_str = "\n".join([mem['recommendation'] for mem in past_memories])
+
+
+def _recall(memory, state, situation_summary, agent_name):
+    """检索该智能体记忆集合中类似情境的反思，返回拼接后的经验教训（无记忆时为空字符串）。"""
+    # 先按同一股票/行业、近期交易日过滤，再做向量检索；检索失败时按没有历史经验继续，不影响任务
+    try:
+        past_memories = memory.get_memories(
+            situation_summary,
+            ticker=state['company_of_interest'],
+            sector=get_sector(state['company_of_interest']),
+            trade_date=state['trade_date'],
+        )
+    except Exception as e:
+        print(f"[{agent_name}] 记忆检索失败，按无历史经验继续: {e}")
+        past_memories = []
+    return "\n".join([mem['recommendation'] for mem in past_memories])
+
+
+# 此函数是一个工厂，用于为研究者智能体（牛市或熊市）创建一个 LangGraph 节点。
+def create_researcher_node(llm, memory, role_prompt, agent_name):
+    def researcher_node(state):
+        # 首先，将所有分析师报告合并成一个摘要，以便提供上下文。
+        situation_summary = _situation_summary(state)
+        past_memory_str = _recall(memory, state, situation_summary, agent_name)
 
         prompt = f"""{role_prompt}
         以下是当前的分析状态：
@@ -166,10 +254,12 @@ def create_research_manager(llm, memory: FinancialSituationMemory):
     """创建研究员主管节点"""
 
     def research_manager_node(state: AgentState) -> dict:
+        past_memory_str = _recall(memory, state, _situation_summary(state), "Research Manager")
         prompt = f"""作为研究员主管，您的职责是批判性地评估多空分析师之间的辩论，并做出明确的决策。
             总结要点，然后给出明确的建议：买入、卖出或持有。为交易者制定详细的投资计划，包括您的投资逻辑和策略行动。
             辩论历史：
-            {state['investment_debate_state']['history']}"""
+            {state['investment_debate_state']['history']}
+            对类似过往情境的反思：{past_memory_str or '未找到过往记忆'}"""
         response = llm.invoke(prompt)
 
         # 输出是最终的投资计划，将传递给交易员。
@@ -183,10 +273,12 @@ def create_trader(llm, memory):
     def trader_node(state, name):
         # 提示很简单：根据计划创建交易建议。
         # 关键指令是必须的 final 标签。
+        past_memory_str = _recall(memory, state, _situation_summary(state), name)
         prompt = f"""您是一名交易代理。根据提供的投资计划，创建一个简洁的交易建议。
         您的回复必须以“最终交易建议：**BUY/HOLD/SELL**”结尾'.
 
-        建议的投资计划： {state['investment_plan']}"""
+        建议的投资计划： {state['investment_plan']}
+        对类似过往情境的反思：{past_memory_str or '未找到过往记忆'}"""
         result = llm.invoke(prompt)
 
         # 输出使用交易员的计划更新状态并标识发送者。
@@ -239,10 +331,12 @@ def create_risk_debator(llm, role_prompt, agent_name):
 # 此函数创建投资组合经理节点。
 def create_risk_manager(llm, memory):
     def risk_manager_node(state):
+        past_memory_str = _recall(memory, state, _situation_summary(state), "Portfolio Manager")
         prompt = f"""作为投资组合经理，您的决定是最终的。请查看交易员的计划和风险讨论。
         请提供最终的、具有约束力的决定：买入、卖出或持有，并简要说明理由。
         交易员计划：{state['trader_investment_plan']}
-        风险讨论：{state['risk_debate_state']['history']} """
+        风险讨论：{state['risk_debate_state']['history']}
+        对类似过往情境的反思：{past_memory_str or '未找到过往记忆'}"""
 
         response = llm.invoke(prompt).content
 
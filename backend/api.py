@@ -1,10 +1,26 @@
-from fastapi import FastAPI, BackgroundTasks, WebSocket, WebSocketDisconnect
-import asyncio
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
 from pydantic import BaseModel
-from .storage import create_task, get_task
+import json
+from .storage import (create_task, get_task, get_events, append_log, fail_task, cancel_task, request_cancel,
+                      list_tasks as list_stored_tasks, storage_stats, FINISHED_STATUSES, is_closed)
 from .tasks import run_analysis
 from .config_user import get_user_config
-from .storage import task_storage
+from .events import event_broker, stream_events, wait_for_events, read_store
+from .scheduler import scheduler, QueueFullError, SchedulerClosedError
+from .cancellation import signal_cancel
+from .tools import price_cache, get_sector
+from .metrics import REGISTRY, STREAM_CONNECTIONS
+from .batches import batch_registry, expand_items, plan_prefetch, prefetch_shared_data
+from .dedupe import submission_index, submission_key, config_fingerprint
+from .results import result_store
+from .reflection import reflection_queue
+from .progress import estimate_seconds, latency_model
+from .tracing import tracer, spans_from_otlp, critical_path, render_flamegraph
+from .memory import MEMORY_KEYS, get_persistent_memories, maintain_memories, schedule_memory_maintenance
+from typing import List, Optional
+import threading
+import time
 
 app = FastAPI(title="Deep Thinking Trading API")
 user_config = get_user_config()
@@ -12,44 +28,396 @@ user_config = get_user_config()
 class AnalysisRequest(BaseModel):
     ticker: str
     trade_date: str
+    priority: str = "interactive"  # interactive | batch
+    force: bool = False  # True 时不合并到相同的已有任务，强制重新分析
+    deadline_seconds: Optional[float] = None  # 截止时间（从提交起的秒数，含排队）：预计赶不上时逐级降级，按时给出信号
+
+
+def _rejected(lane, e):
+    # 队列满：429 + Retry-After；调度器关闭：503
+    if isinstance(e, SchedulerClosedError):
+        return HTTPException(status_code=503, detail=str(e))
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+
+def _enqueue(ticker, trade_date, lane, deadline_at=None):
+    # 创建任务并提交到作业队列；返回 (task_id, 前方排队数)，入队失败时任务标记为 error，第二项为该异常
+    task_id = create_task(ticker, trade_date)
+    try:
+        ahead = scheduler.submit(run_analysis, task_id, ticker, trade_date, deadline_at, lane=lane, job_id=task_id)
+    except (QueueFullError, SchedulerClosedError) as e:
+        fail_task(task_id, f"任务未能入队: {e}")
+        return task_id, e
+    if ahead:
+        append_log(task_id, f"⏳ 已进入 {lane} 队列，前方 {ahead} 个任务")
+    return task_id, ahead
+
+
+def _submit(ticker, trade_date, lane, force=False, deadline_at=None):
+    # 相同的提交（股票 + 交易日 + 分析配置）合并到执行中或刚完成的已有任务；
+    # 返回 (task_id, 前方排队数或入队异常, 是否合并到已有任务)
+    # 截止时间模式的任务可能降级执行，既不合并到已有任务，也不登记供后续提交复用
+    if deadline_at is not None or not user_config.get("task_dedupe", True):
+        return (*_enqueue(ticker, trade_date, lane, deadline_at), False)
+    result = {"ahead": None}
+
+    def start():
+        task_id, result["ahead"] = _enqueue(ticker, trade_date, lane)
+        return task_id
+
+    task_id, coalesced = submission_index.coalesce(submission_key(ticker, trade_date, user_config), start, force)
+    if coalesced:
+        append_log(task_id, f"🔁 相同的分析请求已合并到本任务（共 {submission_index.submitters(task_id)} 个提交方）")
+    return task_id, result["ahead"], coalesced
 
 
 @app.post("/start")
-def start_analysis(req: AnalysisRequest, background_tasks: BackgroundTasks):
-    task_id = create_task(req.ticker, req.trade_date)
-    background_tasks.add_task(run_analysis, task_id, req.ticker, req.trade_date)
-    return {"task_id": task_id, "status": "started"}
+def start_analysis(req: AnalysisRequest):
+    # 任务进入有界作业队列，由工作池按优先级执行；相同的提交直接附加到已有任务
+    try:
+        if not scheduler.can_accept(req.priority):
+            raise _rejected(req.priority, QueueFullError(f"{req.priority} 队列已满"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    deadline_at = None
+    if req.deadline_seconds is not None:
+        if req.deadline_seconds <= 0:
+            raise HTTPException(status_code=400, detail="deadline_seconds 必须大于 0")
+        deadline_at = time.time() + req.deadline_seconds
+    task_id, ahead, coalesced = _submit(req.ticker, req.trade_date, req.priority, req.force, deadline_at)
+    if isinstance(ahead, Exception):
+        raise _rejected(req.priority, ahead)
+    if coalesced:
+        task = get_task(task_id)
+        status = task["status"] if task else "not_found"
+        if status == "running" and task_id in scheduler.queued_ids():
+            status = "queued"
+        return {"task_id": task_id, "status": status, "deduplicated": True,
+                "eta_seconds": task.get("eta_seconds") if task else None}
+    response = {"task_id": task_id, "status": "queued", "queue_position": ahead, "deduplicated": False,
+                "estimated_seconds": round(estimate_seconds(user_config), 1)}
+    if deadline_at is not None:
+        response["deadline_at"] = deadline_at
+    return response
 
 
-@app.get("/status/{task_id}")
-def get_status(task_id: str):
+class BatchRequest(BaseModel):
+    tickers: List[str]
+    trade_dates: List[str]
+    priority: str = "batch"  # interactive | batch
+
+
+@app.post("/start_batch")
+def start_batch(req: BatchRequest):
+    # 股票 × 交易日的全部组合作为独立任务入队；后台按股票一次性预取共享行情数据
+    try:
+        items = expand_items(req.tickers, req.trade_dates)
+        free = scheduler.capacity(req.priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not items:
+        raise HTTPException(status_code=400, detail="tickers 与 trade_dates 不能为空")
+    max_items = int(user_config.get("batch_max_items", 100))
+    if len(items) > max_items:
+        raise HTTPException(status_code=400, detail=f"批次条目数 {len(items)} 超过上限 {max_items}")
+    if free is not None and len(items) > free:
+        raise _rejected(req.priority, QueueFullError(f"{req.priority} 队列剩余 {free}，不足 {len(items)} 个条目"))
+
+    # 容量检查之后队列仍可能被并发提交占满（或调度器关闭）：未能入队的条目任务已标记 error，
+    # 在批次中记为失败并随响应返回；全部条目都未能入队时与单个提交一样返回 429 / 503
+    task_ids = []
+    errors = {}
+    deduplicated = 0
+    for ticker, trade_date in items:
+        task_id, ahead, coalesced = _submit(ticker, trade_date, req.priority)
+        if isinstance(ahead, Exception):
+            errors[task_id] = ahead
+        deduplicated += coalesced
+        task_ids.append(task_id)
+    if len(errors) == len(items):
+        raise _rejected(req.priority, next(iter(errors.values())))
+    queued = [(t, d) for (t, d), tid in zip(items, task_ids) if tid not in errors]
+    batch_id = batch_registry.create(items, task_ids, req.priority,
+                                     errors={tid: f"任务未能入队: {e}" for tid, e in errors.items()})
+    # 共享数据在后台预取；各任务的后处理通过 price_cache 单飞去重，预取未完成时也不会重复下载
+    threading.Thread(target=prefetch_shared_data, args=(batch_id, plan_prefetch(queued)), daemon=True).start()
+    return {
+        "batch_id": batch_id,
+        "status": "partial" if errors else "queued",
+        "deduplicated": deduplicated,
+        "failed": len(errors),
+        "items": batch_registry.get(batch_id)["items"],
+    }
+
+
+@app.get("/batch/{batch_id}")
+def get_batch(batch_id: str, include_items: bool = True):
+    # 批次汇总：各状态计数、平均进度、吞吐（完成数 / 分钟）、预计剩余时间，及每个条目的状态
+    summary = batch_registry.summary(batch_id, scheduler.queued_ids(), task_seconds=estimate_seconds(user_config),
+                                     workers=scheduler.max_workers)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    if not include_items:
+        summary.pop("items")
+    return summary
+
+
+@app.post("/batch/{batch_id}/cancel")
+def cancel_batch(batch_id: str):
+    batch = batch_registry.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    results = {}
+    for item in batch["items"]:
+        results[item["task_id"]] = _cancel(item["task_id"])
+    return {"batch_id": batch_id, "items": results}
+
+
+def _cancel(task_id):
+    # 排队中的任务直接出队并标记 cancelled；执行中的任务在下一个检查点停止（状态先为 cancelling）。
+    # 多个提交方共享的任务：只解除本次附加（detached），最后一个提交方取消时才真正取消
     task = get_task(task_id)
+    if task and task["status"] == "running" and not submission_index.release(task_id):
+        append_log(task_id, f"一个提交方已取消，任务继续执行（剩余 {submission_index.submitters(task_id)} 个提交方）")
+        return "detached"
+    if not request_cancel(task_id):
+        task = get_task(task_id)
+        return task["status"] if task else "not_found"
+    if scheduler.cancel(task_id):
+        cancel_task(task_id, "排队中被取消")
+        return "cancelled"
+    signal_cancel(task_id)
+    append_log(task_id, "🛑 已收到取消请求，将在下一个检查点停止")
+    return "cancelling"
+
+
+@app.post("/cancel/{task_id}")
+def cancel_analysis(task_id: str):
+    if not get_task(task_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"task_id": task_id, "status": _cancel(task_id)}
+
+
+@app.get("/status/{task_id}")
+async def get_status(task_id: str, since: int = Query(None, ge=0), wait: float = Query(0, ge=0, le=60)):
+    # 不带 since：返回完整状态（全部日志）。
+    # 带 since：长轮询，只返回 seq > since 的事件；暂无新事件时最多阻塞 wait 秒，下次以 last_seq 作为 since。
+    # 任务完成后仍会等待后台评估的事件，closed 为 true 后不再有新事件
+    if since is not None:
+        batch = await wait_for_events(task_id, since=since, timeout=wait)
+        if batch is None:
+            return {"status": "not_found"}
+        final = next((e for e in batch["events"] if e["type"] == "status"), None)
+        return {**batch, "final_result": final.get("final_result") if final else None}
+    # SQLite / Redis 存储的读取会阻塞，不能直接在事件循环中执行
+    task = await read_store(get_task, task_id)
     if not task:
         return {"status": "not_found"}
     return {
         "status": task["status"],
         "logs": task["logs"],
-        "final_result": task.get("final_result")
+        "final_result": task.get("final_result"),
+        "progress": task.get("progress"),
+        "progress_status": task.get("progress_status"),
+        "eta_seconds": task.get("eta_seconds"),
+        "last_seq": task.get("last_seq", 0),
+        # 后处理结束方式（done / skipped），None 表示尚未结束；closed 后不会再有评估日志
+        "postprocess": task.get("postprocess"),
+        "closed": is_closed(task["status"], task.get("postprocess")),
     }
 
 
+@app.get("/events/{task_id}")
+async def get_task_events(task_id: str, since: int = Query(0, ge=0), limit: int = Query(None, ge=1, le=5000),
+                          wait: float = Query(0, ge=0, le=60)):
+    # 返回 seq > since 的任务事件（日志 / 进度 / 报告 / 状态），客户端以 last_seq 作为下次的 since；
+    # wait > 0 时为长轮询。gap 为 true 表示 since 之后、first_seq 之前的事件已被丢弃，需用 /status 重新同步
+    batch = await wait_for_events(task_id, since=since, timeout=wait, limit=limit)
+    if batch is None:
+        return {"status": "not_found"}
+    return batch
+
+
+def _sse(event):
+    # Server-Sent Events 帧：id 为 seq，浏览器断线重连时通过 Last-Event-ID 续传
+    data = json.dumps(event, ensure_ascii=False)
+    if event.get("seq") is None:
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+@app.get("/events/{task_id}/stream")
+async def stream_task_events(task_id: str, since: int = Query(0, ge=0),
+                             last_event_id: str = Header(None, alias="Last-Event-ID")):
+    # SSE：推送 seq > since 的事件直到任务关闭（完成的任务在后台评估结束的 postprocess 事件后）；Last-Event-ID 优先于 since
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    keepalive = float(get_user_config().get("event_keepalive_seconds", 15))
+
+    async def _frames():
+        STREAM_CONNECTIONS.inc(transport="sse")
+        try:
+            async for event in stream_events(task_id, since=since, keepalive=keepalive):
+                # 心跳为注释行，防止代理断开空闲连接
+                yield ": keepalive\n\n" if event is None else _sse(event)
+        finally:
+            STREAM_CONNECTIONS.dec(transport="sse")
+
+    return StreamingResponse(_frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/result/{ticker}/{trade_date}")
+def get_result(ticker: str, trade_date: str, any_config: bool = False, include_reports: bool = True,
+               run_on_miss: bool = False, priority: str = "batch"):
+    # 按股票和交易日查询已完成的分析结果（信号、最终决策、报告、评估），默认只匹配当前分析配置。
+    # 未命中：有相同的分析正在执行时返回 202 + task_id；run_on_miss=true 时提交新分析并返回 202；否则 404
+    ticker = ticker.strip().upper()
+    config_hash = None if any_config else config_fingerprint(user_config)
+    # 任务先写结果库再结束：先取在途任务、再读结果行，以结果行为准；只有没有结果行且该任务仍在执行时才返回 pending
+    pending = submission_index.lookup(submission_key(ticker, trade_date, user_config))
+    result = result_store.get(ticker, trade_date, config_hash, include_reports)
+    if result is not None:
+        return result
+    if pending is not None:
+        task = get_task(pending)
+        if task is not None and task["status"] not in FINISHED_STATUSES:
+            return JSONResponse(status_code=202, content={"status": "pending", "task_id": pending})
+    if not run_on_miss:
+        raise HTTPException(status_code=404, detail=f"没有 {ticker} 于 {trade_date} 的分析结果")
+    try:
+        if not scheduler.can_accept(priority):
+            raise _rejected(priority, QueueFullError(f"{priority} 队列已满"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    task_id, ahead, _ = _submit(ticker, trade_date, priority)
+    if isinstance(ahead, Exception):
+        raise _rejected(priority, ahead)
+    return JSONResponse(status_code=202, content={"status": "queued", "task_id": task_id})
+
+
 @app.get("/tasks")
-def list_tasks(status: str = None):
-    # 返回当前内存中的任务列表，可选按 status 过滤
-    items = []
-    for tid, t in task_storage.items():
-        if status and t.get("status") != status:
-            continue
-        created = t.get("created_at")
-        items.append({
-            "task_id": tid,
-            "ticker": t.get("ticker"),
-            "trade_date": t.get("trade_date"),
-            "status": t.get("status"),
-            "logs_count": len(t.get("logs", [])),
-            "created_at": created.isoformat() if created is not None else None,
-        })
-    return {"tasks": items}
+def list_tasks(status: str = None, ticker: str = None, date_from: str = None, date_to: str = None,
+               limit: int = Query(50, ge=1, le=500), cursor: str = None):
+    # 返回任务列表，可按 status / ticker / 交易日范围过滤；按创建时间倒序，使用 next_cursor 翻页
+    try:
+        items, next_cursor = list_stored_tasks(status=status, ticker=ticker, date_from=date_from,
+                                               date_to=date_to, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"tasks": items, "next_cursor": next_cursor}
+
+
+@app.get("/trace/{task_id}")
+def get_trace(task_id: str, critical: bool = False):
+    # 任务的 trace（OTLP/JSON）；critical=true 时只返回关键路径上的 span 摘要。trace 在任务及其评估全部结束后写入
+    document = tracer.load(task_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="trace 不存在（任务未结束、未开启追踪或已被清理）")
+    if not critical:
+        return document
+    spans = spans_from_otlp(document)
+    t0 = min((s["start"] for s in spans), default=0)
+    return {"task_id": task_id, "critical_path": [
+        {"name": s["name"], "type": s["attributes"].get("span.type"), "offset_seconds": round(s["start"] - t0, 3),
+         "seconds": round(s["end"] - s["start"], 3), "error": s["error"]}
+        for s in critical_path(spans)]}
+
+
+@app.get("/trace/{task_id}/flame")
+def get_trace_flamegraph(task_id: str, width: int = Query(1600, ge=400, le=8000)):
+    # 火焰图（SVG，浏览器直接打开）：横轴为时间，纵轴为调用深度，关键路径加粗描边，悬停查看 span 详情
+    document = tracer.load(task_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="trace 不存在（任务未结束、未开启追踪或已被清理）")
+    return Response(render_flamegraph(spans_from_otlp(document), width=width), media_type="image/svg+xml")
+
+
+@app.post("/memory/maintain")
+def maintain_memory(keys: Optional[List[str]] = Query(None)):
+    # 立即维护持久化记忆（去重 + 淘汰 + 紧凑重建），keys 指定集合（bull / bear / trader / invest_judge / risk_manager），默认全部
+    unknown = [k for k in keys or [] if k not in MEMORY_KEYS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知的记忆集合: {', '.join(unknown)}")
+    memories = get_persistent_memories()
+    if keys:
+        memories = {k: memories[k] for k in keys}
+    return {"reports": maintain_memories(memories)}
+
+
+@app.get("/stats/scheduler")
+def get_scheduler_stats():
+    # 作业队列指标：各通道排队数 / 上限 / 拒绝数 / 等待时间分位数，运行中任务数与执行时间，及提交去重命中
+    # estimated_task_seconds：按当前配置与历史节点耗时估算的单个任务总耗时，供批量调度排布
+    return {**scheduler.stats(), "dedupe": submission_index.stats(),
+            "estimated_task_seconds": round(estimate_seconds(user_config), 1), "node_latency": latency_model.stats()}
+
+
+@app.get("/stats/cache")
+def get_cache_stats():
+    # 行情缓存命中 / 下载次数（批量分析的共享数据）
+    return {"price_history": price_cache.stats()}
+
+
+def _collect_runtime():
+    # 抓取时读取的运行时状态：队列深度、缓存命中、推送订阅数、任务存储大小
+    sched = scheduler.stats()
+    lanes = sched["lanes"]
+    yield ("trading_queue_depth", "gauge", "调度队列中排队的作业数",
+           [({"lane": lane}, v["queued"]) for lane, v in lanes.items()])
+    yield ("trading_queue_rejected_total", "counter", "队列已满被拒绝的提交数",
+           [({"lane": lane}, v["rejected"]) for lane, v in lanes.items()])
+    yield ("trading_jobs_running", "gauge", "正在执行的作业数", [({}, sched["running"])])
+
+    prices = price_cache.stats()
+    dedupe = submission_index.stats()
+    sector = get_sector.cache_info()
+    yield ("trading_cache_requests_total", "counter", "缓存请求数（hit / miss）", [
+        ({"cache": "price_history", "result": "hit"}, prices["hits"]),
+        ({"cache": "price_history", "result": "miss"}, prices["misses"]),
+        ({"cache": "sector", "result": "hit"}, sector.hits),
+        ({"cache": "sector", "result": "miss"}, sector.misses),
+        ({"cache": "submission", "result": "hit"}, dedupe["coalesced"]),
+        ({"cache": "submission", "result": "miss"}, dedupe["started"]),
+    ])
+    yield ("trading_cache_entries", "gauge", "缓存条目数", [
+        ({"cache": "price_history"}, prices["symbols"]),
+        ({"cache": "sector"}, sector.currsize),
+        ({"cache": "submission"}, dedupe["keys"]),
+    ])
+    yield ("trading_event_subscribers", "gauge", "任务事件推送的订阅方数", [({}, event_broker.subscriber_count())])
+
+    store = storage_stats()
+    backend = store.pop("backend")
+    for key, value in store.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield (f"trading_task_store_{key}", "gauge", f"任务存储指标 {key}", [({"backend": backend}, value)])
+
+
+REGISTRY.add_collector(_collect_runtime)
+
+if user_config.get("memory_maintenance_interval_hours"):
+    schedule_memory_maintenance(user_config["memory_maintenance_interval_hours"])
+
+# 恢复上次运行时尚未完成的反思任务（等待实际收益的延迟任务）
+reflection_queue.restore()
+
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus 抓取端点：任务阶段耗时、节点 / LLM / 工具调用、队列、缓存、推送连接与任务存储
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("shutdown")
+def shutdown_scheduler():
+    scheduler.shutdown(wait=False)
+
+
+@app.get("/stats/storage")
+def get_storage_stats():
+    # 任务存储的内存占用指标（任务数、日志行数 / 字节、报告字节、淘汰数、进程 RSS）、推送订阅数及结果库条目数
+    return {**storage_stats(), "event_subscribers": event_broker.subscriber_count(), "results": result_store.stats()}
 
 
 print(
@@ -57,64 +425,33 @@ print(
 
 
 @app.websocket("/ws/status/{task_id}")
-async def websocket_status(websocket: WebSocket, task_id: str):
-    """WebSocket endpoint that streams task logs in real-time.
+async def websocket_status(websocket: WebSocket, task_id: str, since: int = 0):
+    """WebSocket endpoint that streams task events in real-time.
 
-    Clients should connect to `/ws/status/{task_id}` and will receive JSON
-    messages of the form: {"type": "log", "line": "..."} for each log
-    line, and a final message {"type":"status","status":"completed",...}
-    when the task finishes.
+    Clients connect to `/ws/status/{task_id}?since=<seq>` and receive every
+    event with seq > since, each carrying its `seq`:
+    {"type": "log", "line": ...},
+    {"type": "progress", "progress": ..., "status": ..., "eta_seconds": ...},
+    {"type": "report", "label": ..., "markdown": ...} and
+    {"type": "status", "status": "completed" | "error" | "cancelled" | "not_found", ...}.
+    Error, cancelled and not_found close the socket. A completed task keeps streaming its
+    background evaluation logs until {"type": "postprocess", "outcome": "done" | "skipped"}.
+    A reconnecting client passes the last seq it saw and only receives the delta; if some of
+    those events were already dropped from the in-memory ring buffer it first receives
+    {"type": "gap", "since": ..., "first_seq": ...} and should resync from /status.
+    Events are pushed as soon as they are written; idle connections just wait.
     """
     await websocket.accept()
+    STREAM_CONNECTIONS.inc(transport="websocket")
     try:
-        last_idx = 0
-        sent_report_keys = set()
-        last_progress = None
-        last_progress_status = None
-        while True:
-            task = get_task(task_id)
-            if not task:
-                await websocket.send_json({"type": "status", "status": "not_found"})
-                await asyncio.sleep(0.5)
-                continue
-
-            logs = task.get("logs", [])
-            # send any new logs
-            if last_idx < len(logs):
-                for line in logs[last_idx:]:
-                    await websocket.send_json({"type": "log", "line": line})
-                last_idx = len(logs)
-
-            # send any new structured reports
-            reports = task.get("reports", {}) or {}
-            for label, body in reports.items():
-                if label not in sent_report_keys:
-                    await websocket.send_json({"type": "report", "label": label, "markdown": body})
-                    sent_report_keys.add(label)
-
-            # send progress updates when changed
-            try:
-                prog = float(task.get("progress", 0.0) or 0.0)
-            except Exception:
-                prog = 0.0
-            prog_status = task.get("progress_status")
-            if last_progress is None or abs(prog - (last_progress or 0.0)) > 1e-6 or (prog_status != last_progress_status):
-                await websocket.send_json({"type": "progress", "progress": prog, "status": prog_status})
-                last_progress = prog
-                last_progress_status = prog_status
-
-            status = task.get("status")
-            if status == "completed":
-                await websocket.send_json({"type": "status", "status": "completed", "final_result": task.get("final_result")})
-                break
-            if status == "error":
-                await websocket.send_json({"type": "status", "status": "error", "error": task.get("error")})
-                break
-
-            await asyncio.sleep(0.5)
+        keepalive = float(get_user_config().get("event_keepalive_seconds", 15))
+        async for event in stream_events(task_id, since=since, keepalive=keepalive):
+            if event is not None:
+                await websocket.send_json(event)
     except WebSocketDisconnect:
         pass
     finally:
+        STREAM_CONNECTIONS.dec(transport="websocket")
         try:
             await websocket.close()
         except Exception:
@@ -0,0 +1,154 @@
+# backend/batches.py
+# 批量分析：一次提交多个股票 × 多个交易日。
+# - 条目按股票、日期排序后逐个进入调度器的 batch 通道（每个条目仍是独立任务，可单独查看 / 取消）
+# - 提交时在后台按股票合并日期区间，一次性预取行情（真实市场验证 + 事实一致性审计所需）与行业信息，
+#   之后各条目的后处理直接命中 tools.price_cache
+# - 汇总进度、各状态计数、吞吐（完成数 / 分钟）与预计剩余时间（按各条目的剩余工作量与并发数估算）
+
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from .storage import FINISHED_STATUSES, get_task_statuses
+from .tools import get_sector, price_cache
+
+# 预取区间：审计需要交易日前 60 天，真实市场验证需要交易日后 30 天
+AUDIT_LOOKBACK_DAYS = 60
+GROUND_TRUTH_LOOKAHEAD_DAYS = 31
+
+
+def expand_items(tickers: List[str], trade_dates: List[str]) -> List[Tuple[str, str]]:
+    """股票 × 交易日的全部组合，去重并按股票、日期排序（同一股票的条目相邻执行，缓存更易命中）。"""
+    tickers = sorted({t.strip().upper() for t in tickers if t and t.strip()})
+    dates = sorted({d.strip() for d in trade_dates if d and d.strip()})
+    for d in dates:
+        datetime.strptime(d, "%Y-%m-%d")  # 格式错误时抛出 ValueError
+    return [(t, d) for t in tickers for d in dates]
+
+
+def plan_prefetch(items: List[Tuple[str, str]]) -> Dict[str, Tuple[str, str]]:
+    """按股票合并所有条目所需的行情区间：{ticker: (start, end)}。"""
+    plan = {}
+    for ticker, trade_date in items:
+        day = datetime.strptime(trade_date, "%Y-%m-%d").date()
+        start = day - timedelta(days=AUDIT_LOOKBACK_DAYS)
+        end = day + timedelta(days=GROUND_TRUTH_LOOKAHEAD_DAYS)
+        if ticker in plan:
+            start, end = min(start, plan[ticker][0]), max(end, plan[ticker][1])
+        plan[ticker] = (start, end)
+    return {t: (s.isoformat(), e.isoformat()) for t, (s, e) in plan.items()}
+
+
+def prefetch_shared_data(batch_id: str, plan: Dict[str, Tuple[str, str]]) -> None:
+    started = time.time()
+    for ticker, (start, end) in plan.items():
+        try:
+            price_cache.prefetch(ticker, start, end)
+            get_sector(ticker)
+        except Exception as e:
+            print(f"[Batch] {batch_id} 预取 {ticker} 失败: {e}")
+    print(f"[Batch] {batch_id} 预取 {len(plan)} 个股票的共享数据，用时 {time.time() - started:.1f}s")
+
+
+class BatchRegistry:
+    """进程内批次登记（与调度器同进程）"""
+
+    def __init__(self, max_batches: int = 200):
+        self.max_batches = max_batches
+        self._batches: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def create(self, items: List[Tuple[str, str]], task_ids: List[str], priority: str,
+               errors: Optional[Dict[str, str]] = None) -> str:
+        """errors：未能入队的条目 {task_id: 原因}，这些条目记为 error 并附带原因。"""
+        errors = errors or {}
+        batch_id = str(uuid.uuid4())
+        batch = {
+            "batch_id": batch_id,
+            "priority": priority,
+            "created_at": time.time(),
+            "items": [
+                {"ticker": t, "trade_date": d, "task_id": tid, "status": "error", "error": errors[tid]}
+                if tid in errors else {"ticker": t, "trade_date": d, "task_id": tid, "status": "queued"}
+                for (t, d), tid in zip(items, task_ids)
+            ],
+        }
+        with self._lock:
+            self._batches[batch_id] = batch
+            # 只保留最近的批次
+            while len(self._batches) > self.max_batches:
+                self._batches.pop(next(iter(self._batches)))
+        return batch_id
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def summary(self, batch_id: str, queued_ids=frozenset(), task_seconds: Optional[float] = None,
+                workers: int = 1) -> Optional[dict]:
+        """
+        汇总进度：各状态计数、平均进度、吞吐与预计剩余时间。queued_ids 为调度器中仍在排队的任务。
+        task_seconds 为单个任务的预计总耗时（progress.estimate_seconds）：排队条目按它计，执行中条目按任务上报的
+        剩余时间计，总量除以 workers 即预计剩余时间；未提供时按已完成条目的吞吐估算。
+        """
+        batch = self.get(batch_id)
+        if batch is None:
+            return None
+        counts = {"queued": 0, "running": 0, "completed": 0, "error": 0, "cancelled": 0}
+        items = []
+        progress_sum = 0.0
+        remaining_work = 0.0
+        longest = 0.0
+        # 只读状态字段，轮询时不加载各任务的日志、报告与结果
+        statuses = get_task_statuses([item["task_id"] for item in batch["items"]])
+        for item in batch["items"]:
+            task = statuses.get(item["task_id"], {})
+            # 未能入队的条目始终计为 error（任务记录可能已过期清理）
+            status = "error" if item.get("error") else task.get("status", "not_found")
+            if status == "running" and item["task_id"] in queued_ids:
+                status = "queued"
+            progress = 1.0 if status in FINISHED_STATUSES else float(task.get("progress") or 0.0)
+            if status in FINISHED_STATUSES or status == "not_found":
+                eta = 0.0
+            elif status == "running" and task.get("eta_seconds") is not None:
+                eta = float(task["eta_seconds"])
+            else:
+                eta = task_seconds
+            counts[status] = counts.get(status, 0) + 1
+            progress_sum += progress
+            if eta is not None:
+                remaining_work += eta
+                longest = max(longest, eta)
+            items.append({**item, "status": status, "progress": progress, "eta_seconds": eta})
+
+        total = len(items)
+        finished = sum(counts[s] for s in FINISHED_STATUSES)
+        elapsed = time.time() - batch["created_at"]
+        throughput = finished / (elapsed / 60) if elapsed > 0 else 0.0
+        remaining = total - finished
+        if not remaining:
+            eta = 0.0
+        elif task_seconds is not None:
+            # 剩余工作量平摊到 workers 个并发槽位，但不会短于最慢的单个条目
+            eta = max(remaining_work / max(1, min(workers, remaining)), longest)
+        else:
+            eta = remaining / throughput * 60 if throughput > 0 else None
+        return {
+            "batch_id": batch_id,
+            "priority": batch["priority"],
+            "total": total,
+            "counts": counts,
+            "progress": progress_sum / total if total else 1.0,
+            "elapsed_seconds": elapsed,
+            "throughput_per_minute": throughput,
+            "eta_seconds": eta,
+            "remaining_work_seconds": remaining_work if task_seconds is not None else None,
+            "done": remaining == 0,
+            "items": items,
+        }
+
+
+# 全局批次登记
+batch_registry = BatchRegistry()
@@ -0,0 +1,97 @@
+# backend/cancellation.py
+# 协作式取消：/cancel 写入取消请求，执行中的任务在检查点（graph 每个 stream 分块之间、后处理各阶段之前、
+# 以及每次 LLM / 工具调用开始前）发现后抛出 TaskCancelled，任务标记为 cancelled。
+# - 同进程内通过 threading.Event 立即生效；跨进程（process 工作池 / 多 worker）依赖任务存储中的取消标记，
+#   按 check_interval 节流查询
+# - 已发出的 HTTP / LLM 请求无法从其他线程中断（同步客户端），会在该请求返回后的下一个检查点停止
+
+import threading
+import time
+from typing import Dict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .storage import is_cancel_requested
+
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+
+class CancellationToken:
+    """单个任务的取消令牌"""
+
+    def __init__(self, task_id: str, check_interval: float = 0.5):
+        self.task_id = task_id
+        self.check_interval = check_interval
+        self._event = threading.Event()
+        self._last_check = 0.0
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            try:
+                if is_cancel_requested(self.task_id):
+                    self._event.set()
+            except Exception as e:
+                print(f"[Cancellation] 查询取消标记失败: {e}")
+        return self._event.is_set()
+
+    def raise_if_cancelled(self, stage: str = "") -> None:
+        if self.cancelled:
+            raise TaskCancelled(stage or "用户取消")
+
+
+class CancellationCallback(BaseCallbackHandler):
+    """LangChain 回调：每次 LLM / 工具调用开始前（以及流式输出的每个 token）检查取消令牌"""
+
+    raise_error = True
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.token.raise_if_cancelled("LLM 调用前")
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.token.raise_if_cancelled("LLM 调用前")
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.token.raise_if_cancelled("LLM 流式输出中")
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.token.raise_if_cancelled("工具调用前")
+
+
+# 本进程内正在执行的任务的令牌
+_tokens: Dict[str, CancellationToken] = {}
+_lock = threading.Lock()
+
+
+def register_token(task_id: str) -> CancellationToken:
+    token = CancellationToken(task_id)
+    with _lock:
+        _tokens[task_id] = token
+    return token
+
+
+def release_token(task_id: str) -> None:
+    with _lock:
+        _tokens.pop(task_id, None)
+
+
+def signal_cancel(task_id: str) -> bool:
+    """同进程内立即通知正在执行的任务；返回该任务是否在本进程执行。"""
+    with _lock:
+        token = _tokens.get(task_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
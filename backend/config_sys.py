@@ -8,8 +8,10 @@ def _set_env(var: str):
     if not os.environ.get(var):
         os.environ[var] = getpass(f"请输入您的 {var}: ")
 
-os.environ["LANGSMITH_TRACING"] = "true"
-os.environ["LANGSMITH_PROJECT"] = "深度思考量化交易系统"
+# LangSmith 追踪需要联网服务：配置了 LANGSMITH_API_KEY 时默认开启，环境变量中已显式设置时保持不变。
+# 本地执行追踪（无需联网）见 backend/tracing.py
+os.environ.setdefault("LANGSMITH_TRACING", "true" if os.environ.get("LANGSMITH_API_KEY") else "false")
+os.environ.setdefault("LANGSMITH_PROJECT", "深度思考量化交易系统")
 
 CONFIG_SYS = {
     "results_dir": "./results",
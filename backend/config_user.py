@@ -12,6 +12,48 @@ DEFAULT_USER_CONFIG = {
     "max_risk_discuss_rounds": 1,  # 风险团队进行1轮辩论。
     "max_recur_limit": 100,  # 智能体循环的安全限制。
     "online_tools": True,  # 使用实时 API；设置为 False 可使用缓存数据以更快、更便宜地运行。
+    "embedding_batch_size": 64,  # 每次嵌入请求包含的文本条数。
+    "embedding_max_workers": 4,  # 并发提交的嵌入请求分块数。
+    "embedding_backend": "api",  # 记忆嵌入后端："api"（OpenAI 兼容接口）或 "local"（本地哈希向量，无需联网）。
+    "local_embedding_dim": 512,  # 本地嵌入向量维度。
+    "memory_store": "chroma",  # 记忆向量存储："chroma" 或 "numpy"（内存映射矩阵，启动快、占用小）。
+    "memory_vector_dtype": "float32",  # numpy 存储的向量精度："float32" 或 "float16"（体积减半）。
+    "memory_dir": "./memory_store",  # 持久化记忆的存储目录；集合按嵌入后端与维度分开存放，切换嵌入配置后从空集合开始积累。
+    "memory_recent_days": 365,  # 记忆检索只考虑交易日前该天数内的经验，None 表示不限。
+    "reflection_batch_size": 8,  # 后台反思队列每批最多处理的任务数。
+    "reflection_batch_window": 5.0,  # 凑批等待时间（秒）。
+    "reflection_retry_seconds": 21600,  # 实际收益尚不可得时的重试间隔（秒）。
+    "reflection_max_wait_days": 14,  # 超过该天数仍无实际收益则放弃反思。
+    "memory_dedupe_threshold": 0.95,  # 记忆维护：余弦相似度不低于该值的情境合并为一条。
+    "memory_max_size": 2000,  # 记忆维护：每个集合最多保留的条目数（超出按 LRU 淘汰），None 表示不限。
+    "memory_max_age_days": None,  # 记忆维护：超过该天数的条目被淘汰，None 表示不按时间淘汰。
+    "memory_maintenance_interval_hours": 24,  # 记忆维护：API 进程定期维护全部记忆集合的间隔（小时），None 表示只在超出容量上限时（反思写入后）或调用 POST /memory/maintain 时维护。
+    "task_store": "memory",  # 任务状态存储："memory"（进程内）、"redis"（多 worker 共享）或 "sqlite"（持久化任务历史）。
+    "redis_url": "redis://localhost:6379/0",  # task_store 为 redis 时的连接地址。
+    "task_db_path": "./results/tasks.db",  # task_store 为 sqlite 时的数据库文件。
+    "task_log_max_lines": 2000,  # 内存任务存储：每个任务保留的最近日志行数（环形缓冲），None 表示不限。
+    "task_max_finished_in_memory": 200,  # 内存任务存储：最多保留的已结束任务数。
+    "task_retention_seconds": 3600,  # 内存任务存储：已结束任务在内存中的保留时间（秒）。
+    "task_event_max": 4000,  # 内存任务存储：每个任务保留的最近事件数（日志 / 进度 / 报告 / 状态，环形缓冲），None 表示不限。
+    "task_spill_store": "sqlite",  # 被淘汰的任务转存到哪里："sqlite"（task_db_path）或 None（直接丢弃）。
+    "result_db_path": "./results/analysis_results.db",  # 已完成分析的结果库（按股票 + 交易日查询），也保存各节点的历史耗时（ETA 估算）。
+    "event_keepalive_seconds": 15,  # 推送订阅（WebSocket）无新事件时的心跳 / 兜底重读间隔（秒）。
+    "worker_pool_size": 2,  # 同时执行的分析任务数（工作池大小）。
+    "worker_pool_mode": "thread",  # 工作池类型："thread" 或 "process"（process 需 redis / sqlite 任务存储，memory 时回退为 thread；取消经存储中的标记生效，最长延迟约 0.5 秒；推送按 event_store_poll_seconds 轮询存储；子进程指标在每个作业结束时汇总到 /metrics）。
+    "event_store_poll_seconds": 0.25,  # worker_pool_mode 为 process 时，API 进程轮询任务存储发现子进程写入的事件的间隔（秒）。
+    "job_queue_size": 20,  # interactive 通道（前端提交）最多排队任务数，超出返回 429。
+    "batch_queue_size": 200,  # batch 通道（批量 / 脚本提交）最多排队任务数，超出返回 429。
+    "batch_max_items": 100,  # /start_batch 单次提交的最大条目数（股票数 × 交易日数）。
+    "task_dedupe": True,  # 相同的分析提交（股票 + 交易日 + 模型 / 提示词 / 辩论轮数）合并到已有任务，不重复执行。
+    "task_dedupe_window_seconds": 600,  # 已完成任务可被相同提交复用的时间窗口（秒），0 表示只合并执行中的任务。
+    "signal_rule_min_confidence": 0.75,  # 规则提取信号的置信度不低于该值时直接采用，否则调用 LLM 提取；设为 1.01 可关闭规则。
+    "postprocess_workers": 4,  # 任务完成后并发执行评估阶段（真实市场验证 / LLM 评估 / 审计）的线程数（所有任务共享）。
+    "postprocess_timeouts": {"ground_truth": 30, "llm_judge": 120, "indicators": 30, "audit": 120},  # 各评估阶段超时（秒）。
+    "deadline_margin_seconds": 5,  # 截止时间模式（/start 的 deadline_seconds）：预测完成时刻需早于截止时间的秒数，不足时逐级降级。
+    "deadline_signal_confidence_margin": 0.1,  # 截止时间模式：剩余时间不够一次快速模型调用时，规则提取信号的置信度阈值降低的幅度（冲突 / 否定的规则结果仍交给 LLM）。
+    "tracing_enabled": True,  # 本地执行追踪：每个任务一条 trace（图节点 / LLM / 工具 / 评估阶段），导出为 OTLP/JSON 文件。
+    "trace_dir": "./results/traces",  # trace 文件目录（{task_id}.json），/trace/{task_id} 与 /trace/{task_id}/flame 读取。
+    "trace_max_files": 500,  # 最多保留的 trace 文件数，超出时删除最旧的。
     "prompts": {
         "bull": "您是一位多头分析师。您的目标是论证投资该股票的合理性。请重点关注增长潜力、竞争优势以及报告中的积极指标。有效反驳看跌分析师的论点。",
         "bear": "您是一位空头分析师。您的目标是论证投资该股票的不合理性。请重点关注风险、挑战以及负面指标。有效反驳看涨分析师的论点。",
@@ -0,0 +1,155 @@
+# backend/deadline.py
+# 截止时间模式：/start 传入 deadline_seconds 时，任务必须在截止时间前给出交易信号（开盘前的决策晚到就没有价值）。
+# - 每个图节点完成后按 ProgressTracker 的 ETA 预测完成时刻，超出（截止时间 - deadline_margin_seconds）时
+#   按以下顺序逐级降级；每级降级后按新的剩余计划重新预测，赶得上即停止：
+#     fewer_debate_rounds  多空辩论只保留 1 轮（已进行的发言不受影响）
+#     skip_risk_debate     跳过风控讨论，交易员之后直接由投资组合经理决策
+#     quick_model          研究主管 / 投资组合经理改用快速模型
+# - 主工作流结束后：剩余时间不够一次快速模型调用时，规则提取的置信度阈值降低 deadline_signal_confidence_margin
+#   （仍有下限，冲突 / 否定的规则结果不会被直接采用），否则照常交给 LLM 复核；已降级或已超时则不再提交后台评估
+# - 已采取的降级记入任务日志、trace、任务结果与结果库（evaluation.deadline）以及 /metrics；
+#   结果库的配置指纹按实际执行的配置计算，降级结果不会被正常配置的 /result 查询命中
+# 节点内正在进行的模型 / 工具调用无法中断，降级只影响之后执行的节点。
+
+import time
+from typing import List, Optional
+
+from .config_user import get_user_config
+from .metrics import DEADLINE_DEGRADATIONS, DEADLINE_TASKS
+from .progress import ProgressTracker, build_plan
+
+# 图内降级的顺序（代价从小到大）
+STEPS = ("fewer_debate_rounds", "skip_risk_debate", "quick_model")
+STEP_LABELS = {
+    "fewer_debate_rounds": "多空辩论减为 1 轮",
+    "skip_risk_debate": "跳过风控讨论",
+    "quick_model": "研究主管 / 投资组合经理改用快速模型",
+    "rule_signal": "降低阈值采用规则提取的信号",
+    "skip_evaluation": "跳过后台评估",
+}
+DEBATE_NODES = ("Bull Researcher", "Bear Researcher")
+RISK_NODES = ("Risky Analyst", "Safe Analyst", "Neutral Analyst")
+DEEP_NODES = ("Research Manager", "Risk Judge")
+# 改用快速模型后，深度模型节点的预期耗时按交易员（同为快速模型的单次调用）估算
+QUICK_PROXY_NODE = "Trader"
+
+
+class DeadlineBudget:
+    """单个任务的时间预算，同时是图的运行时降级开关（路由函数与深度模型节点在每次执行时读取）"""
+
+    def __init__(self, deadline_at: float, config: Optional[dict] = None):
+        self.config = config or get_user_config()
+        self.deadline_at = deadline_at
+        self.margin = float(self.config.get("deadline_margin_seconds", 5))
+        self.signal_confidence_margin = float(self.config.get("deadline_signal_confidence_margin", 0.1))
+        self.max_debate_rounds = int(self.config.get("max_debate_rounds", 2))
+        self.max_risk_discuss_rounds = int(self.config.get("max_risk_discuss_rounds", 1))
+        self.skip_risk_debate = False
+        self.quick_model = False
+        self.degradations: List[dict] = []
+        self._pending = list(STEPS)
+
+    @property
+    def remaining_seconds(self) -> float:
+        return self.deadline_at - time.time()
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.deadline_at
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.degradations)
+
+    @property
+    def exhausted(self) -> bool:
+        return not self._pending
+
+    def signal_min_confidence(self, normal: float, tracker: ProgressTracker) -> float:
+        """信号提取采用规则结果的最低置信度：剩余时间够一次快速模型调用时保持正常阈值，否则降低一个余量。"""
+        llm_seconds = tracker.model.expected(QUICK_PROXY_NODE)
+        if self.remaining_seconds - self.margin >= llm_seconds:
+            return normal
+        return max(0.0, normal - self.signal_confidence_margin)
+
+    def effective_config(self) -> dict:
+        """实际执行的分析配置（执行计划与结果库的配置指纹）。"""
+        config = dict(self.config)
+        config["max_debate_rounds"] = self.max_debate_rounds
+        config["max_risk_discuss_rounds"] = 0 if self.skip_risk_debate else self.max_risk_discuss_rounds
+        config["skip_risk_debate"] = self.skip_risk_debate
+        if self.quick_model:
+            config["deep_think_llm"] = config.get("quick_think_llm")
+        return config
+
+    def overrun_seconds(self, tracker: ProgressTracker) -> float:
+        """按当前 ETA 预测的完成时刻超出（截止时间 - 安全余量）的秒数，未超出时为负数。"""
+        return time.time() + tracker.eta_seconds - (self.deadline_at - self.margin)
+
+    def check(self, tracker: ProgressTracker) -> List[dict]:
+        """预测赶不上截止时间时逐级降级并修正 tracker 的剩余计划，返回本次新采取的降级。"""
+        applied = []
+        while self._pending:
+            overrun = self.overrun_seconds(tracker)
+            if overrun <= 0:
+                break
+            step = self._pending.pop(0)
+            if not self._apply(step, tracker):
+                continue
+            overrides = {}
+            if self.quick_model:
+                quick = tracker.model.expected(QUICK_PROXY_NODE)
+                overrides = {node: quick for node in DEEP_NODES}
+            tracker.replan(build_plan(self.effective_config()), overrides)
+            applied.append(self.record(step, overrun))
+        return applied
+
+    def _apply(self, step: str, tracker: ProgressTracker) -> bool:
+        # 只在还有对应节点未执行时降级，已经过去的阶段降级没有意义
+        if step == "fewer_debate_rounds":
+            if self.max_debate_rounds <= 1 or not any(tracker.remaining[n] for n in DEBATE_NODES):
+                return False
+            self.max_debate_rounds = 1
+        elif step == "skip_risk_debate":
+            if not any(tracker.remaining[n] for n in RISK_NODES):
+                return False
+            self.skip_risk_debate = True
+        elif step == "quick_model":
+            if not any(tracker.remaining[n] for n in DEEP_NODES):
+                return False
+            self.quick_model = True
+        return True
+
+    def record(self, step: str, overrun: Optional[float] = None) -> dict:
+        """记录一项降级（图内降级由 check 调用，收尾阶段的降级由任务直接调用）。"""
+        entry = {"step": step, "label": STEP_LABELS.get(step, step),
+                 "remaining_seconds": round(self.remaining_seconds, 1)}
+        if overrun is not None:
+            entry["projected_overrun_seconds"] = round(overrun, 1)
+        self.degradations.append(entry)
+        DEADLINE_DEGRADATIONS.inc(step=step)
+        return entry
+
+    def finish(self) -> dict:
+        """信号给出时调用：返回预算执行摘要（写入任务结果与结果库），并计入 /metrics。"""
+        met = not self.expired
+        DEADLINE_TASKS.inc(met=str(met).lower())
+        return {
+            "deadline_at": self.deadline_at,
+            "met": met,
+            "slack_seconds": round(self.remaining_seconds, 1),
+            "degradations": list(self.degradations),
+        }
+
+
+class DegradableLLM:
+    """深度模型节点使用的模型：预算的 quick_model 开关打开后改用快速模型（节点只调用 invoke）"""
+
+    def __init__(self, budget: DeadlineBudget, deep, quick):
+        self.budget = budget
+        self.deep = deep
+        self.quick = quick
+
+    def invoke(self, *args, **kwargs):
+        llm = self.quick if self.budget.quick_model else self.deep
+        return llm.invoke(*args, **kwargs)
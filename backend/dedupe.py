@@ -0,0 +1,150 @@
+# backend/dedupe.py
+# 提交级去重：相同的分析提交（股票 + 交易日 + 分析配置指纹）合并到已有任务，而不是再跑一遍完整工作流。
+# - 已有任务仍在排队 / 执行中（且未被请求取消）：新请求直接附加到该任务，订阅同一事件流
+# - 已有任务已完成且结束时间在 task_dedupe_window_seconds 内：直接复用结果；失败 / 取消的任务不复用
+# - 配置指纹只包含影响分析结果的配置（模型、提示词、辩论轮数等），不含 API Key
+# - 索引在进程内（与调度器同进程）；多个提交方共享一个任务时，单个提交方取消只会解除自己的附加，
+#   最后一个提交方取消时才真正取消任务
+# - 复用判断要读任务存储（SQLite / Redis 为阻塞 I/O），在索引锁之外进行；相同键的并发提交由键级的
+#   "创建中"标记串行，不同键之间互不等待
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .config_user import get_user_config
+from .storage import get_task_statuses, is_cancel_requested
+
+# 影响分析结果的配置项
+ANALYSIS_CONFIG_KEYS = (
+    "llm_provider",
+    "deep_think_llm",
+    "quick_think_llm",
+    "backend_url",
+    "max_debate_rounds",
+    "max_risk_discuss_rounds",
+    "max_recur_limit",
+    "online_tools",
+    "prompts",
+)
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    payload = json.dumps({k: config.get(k) for k in ANALYSIS_CONFIG_KEYS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def submission_key(ticker: str, trade_date: str, config: Optional[Dict[str, Any]] = None) -> str:
+    config = config or get_user_config()
+    return f"{ticker.strip().upper()}|{trade_date.strip()}|{config_fingerprint(config)}"
+
+
+class SubmissionIndex:
+    """提交键 -> 任务，及共享任务的提交方计数"""
+
+    def __init__(self, window_seconds: Optional[float] = 600, max_keys: int = 5000):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        # 正在创建任务的键 -> 创建完成事件
+        self._starting: Dict[str, threading.Event] = {}
+        self.coalesced = 0
+        self.started = 0
+
+    def _reusable(self, task_id: str) -> bool:
+        # 读取任务存储，调用方不能持有 self._lock
+        task = get_task_statuses([task_id]).get(task_id)
+        if not task:
+            return False
+        if task["status"] == "running":
+            return not is_cancel_requested(task_id)
+        if task["status"] == "completed" and self.window_seconds:
+            # 按进入 completed 的时间计算窗口，之后追加的评估 / 反思日志不会延长复用期
+            finished = task.get("finished_at")
+            return finished is not None and time.time() - finished <= self.window_seconds
+        return False
+
+    def lookup(self, key: str) -> Optional[str]:
+        """可复用的已有任务（执行中或窗口内完成），没有返回 None。"""
+        with self._lock:
+            task_id = self._entries.get(key)
+        return task_id if task_id is not None and self._reusable(task_id) else None
+
+    def coalesce(self, key: str, start: Callable[[], str], force: bool = False) -> Tuple[str, bool]:
+        """
+        返回 (task_id, 是否合并到已有任务)。没有可复用的任务时调用 start() 创建并提交新任务；
+        start() 抛出的异常原样传出，不登记。相同键的检查 + 创建串行，并发的相同提交只会启动一次。
+        """
+        while True:
+            with self._lock:
+                starting = self._starting.get(key)
+                task_id = self._entries.get(key)
+            if starting is not None:
+                # 同一键正在创建任务：等其完成后按新登记的任务重新判断
+                starting.wait()
+                continue
+            reusable = task_id is not None and not force and self._reusable(task_id)
+            with self._lock:
+                if key in self._starting or self._entries.get(key) != task_id:
+                    # 锁外检查期间该键已变化，重新判断
+                    continue
+                if reusable:
+                    self._entries.move_to_end(key)
+                    self._refs[task_id] = self._refs.get(task_id, 1) + 1
+                    self.coalesced += 1
+                    return task_id, True
+                starting = self._starting[key] = threading.Event()
+            try:
+                task_id = start()
+            except BaseException:
+                with self._lock:
+                    self._starting.pop(key, None)
+                starting.set()
+                raise
+            with self._lock:
+                self._starting.pop(key, None)
+                if self._entries.get(key) is not None:
+                    self._refs.pop(self._entries[key], None)
+                self._entries[key] = task_id
+                self._entries.move_to_end(key)
+                self._refs[task_id] = 1
+                self.started += 1
+                while len(self._entries) > self.max_keys:
+                    _, old = self._entries.popitem(last=False)
+                    self._refs.pop(old, None)
+            starting.set()
+            return task_id, False
+
+    def release(self, task_id: str) -> bool:
+        """某个提交方放弃该任务；返回 True 表示已无其他提交方，可以真正取消。"""
+        with self._lock:
+            refs = self._refs.get(task_id, 1)
+            if refs > 1:
+                self._refs[task_id] = refs - 1
+                return False
+            self._refs.pop(task_id, None)
+            return True
+
+    def submitters(self, task_id: str) -> int:
+        with self._lock:
+            return self._refs.get(task_id, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.coalesced + self.started
+            return {
+                "keys": len(self._entries),
+                "started": self.started,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": self.coalesced / total if total else 0.0,
+                "window_seconds": self.window_seconds,
+            }
+
+
+# 全局提交索引
+submission_index = SubmissionIndex(window_seconds=get_user_config().get("task_dedupe_window_seconds", 600))
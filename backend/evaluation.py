@@ -6,19 +6,37 @@
 
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
-import yfinance as yf
 from datetime import datetime, timedelta
 from .agents import deep_thinking_llm
+from .tools import get_price_history
+from .signals import extract_signal_rules
+from .metrics import SIGNAL_EXTRACTIONS
+from .config_user import get_user_config
 
 
 # 从最终自然语言决策中提取干净的 BUY/SELL/HOLD 信号
 class SignalProcessor:
-    """信号处理器"""
+    """信号处理器：先用规则提取（signals.py），置信度不足时才调用 LLM"""
 
-    def __init__(self, llm):
+    def __init__(self, llm, min_confidence: float = None):
         self.llm = llm
+        if min_confidence is None:
+            min_confidence = get_user_config().get("signal_rule_min_confidence", 0.75)
+        self.min_confidence = min_confidence
+
+    def extract(self, full_signal: str) -> dict:
+        """返回 {"signal", "method": "rule" | "llm", "rule", "confidence"}；命中方式计入 /metrics。"""
+        signal, confidence, rule = extract_signal_rules(full_signal)
+        if signal is not None and confidence >= self.min_confidence:
+            SIGNAL_EXTRACTIONS.inc(method="rule", rule=rule)
+            return {"signal": signal, "method": "rule", "rule": rule, "confidence": confidence}
+        SIGNAL_EXTRACTIONS.inc(method="llm", rule=rule)
+        return {"signal": self._llm_signal(full_signal), "method": "llm", "rule": rule, "confidence": confidence}
 
     def process_signal(self, full_signal: str) -> str:
+        return self.extract(full_signal)["signal"]
+
+    def _llm_signal(self, full_signal: str) -> str:
         messages = [
             ("system",
              "您是一个助手，旨在从财务报告中提取最终的投资决策：SELL,BUY或HOLD。请仅以一个词来回答该决策。"),
@@ -44,11 +62,15 @@ class Reflector:
         市场背景及分析： {situation}
         结果（盈利/亏损）： {returns_losses}"""
 
-    def reflect(self, current_state, returns_losses, memory, component_key_func):
-        situation = f"Reports: {current_state['market_report']} {current_state['sentiment_report']} {current_state['news_report']} {current_state['fundamentals_report']}\nDecision/Analysis Text: {component_key_func(current_state)}"
+    def build_reflection(self, current_state, returns_losses, component_key_func):
+        # 生成一条（情境, 经验教训），不写入记忆，便于调用方批量写入
+        situation = f"Reports: {current_state.get('market_report', '')} {current_state.get('sentiment_report', '')} {current_state.get('news_report', '')} {current_state.get('fundamentals_report', '')}\nDecision/Analysis Text: {component_key_func(current_state)}"
         prompt = self.reflection_prompt.format(situation=situation, returns_losses=returns_losses)
         result = self.llm.invoke(prompt).content
-        memory.add_situations([(situation, result)])
+        return situation, result
+
+    def reflect(self, current_state, returns_losses, memory, component_key_func):
+        memory.add_situations([self.build_reflection(current_state, returns_losses, component_key_func)])
 
 
 class Evaluation(BaseModel):
@@ -74,38 +96,53 @@ evaluator_prompt = ChatPromptTemplate.from_template(
 evaluator_chain = evaluator_prompt | deep_thinking_llm.with_structured_output(Evaluation)
 
 
-def evaluate_ground_truth(ticker, trade_date, signal):
-    try:
-        # Import locally to avoid accidental shadowing of the datetime name
-        from datetime import datetime, timedelta
-
-        start_date = datetime.strptime(trade_date, "%Y-%m-%d").date()
-        # If the trade_date is in the future, skip evaluation
-        if start_date >= datetime.now().date():
-            return f"Ground truth unavailable: trade_date {trade_date} is in the future or today."
-        # Try a longer window to ensure we can find 5 trading days (markets have weekends/holidays)
-        end_date = start_date + timedelta(days=14)
-
-        data = yf.download(ticker, start=start_date.isoformat(), end=end_date.isoformat(), progress=False)
-
-        # If initial window returns fewer than 5 trading days, expand to 30 days as a fallback
-        if len(data) < 5:
-            end_date = start_date + timedelta(days=30)
-            data = yf.download(ticker, start=start_date.isoformat(), end=end_date.isoformat(), progress=False)
-
-        if len(data) < 5:
-            return f"Insufficient data for ground truth evaluation. Found only {len(data)} days."
+def compute_realized_return(ticker, trade_date):
+    """
+    计算交易日（或之后第一个交易日）开盘价到 5 个交易日后收盘价的实际涨跌幅。
+    返回 dict（entry_date / exit_date / open_price / close_price / performance，performance 为百分比），
+    数据尚不可得时返回 {"error": 原因}。
+    """
+    start_date = datetime.strptime(trade_date, "%Y-%m-%d").date()
+    # If the trade_date is in the future, skip evaluation
+    if start_date >= datetime.now().date():
+        return {"error": f"Ground truth unavailable: trade_date {trade_date} is in the future or today."}
+    # Try a longer window to ensure we can find 5 trading days (markets have weekends/holidays)
+    end_date = start_date + timedelta(days=14)
+
+    data = get_price_history(ticker, start_date, end_date)
+
+    # If initial window returns fewer than 5 trading days, expand to 30 days as a fallback
+    if len(data) < 5:
+        end_date = start_date + timedelta(days=30)
+        data = get_price_history(ticker, start_date, end_date)
+
+    if len(data) < 5:
+        return {"error": f"Insufficient data for ground truth evaluation. Found only {len(data)} days."}
+
+    # Ensure the first row corresponds to the trade_date or the next trading day
+    first_trading_day_index = 0
+    while data.index[first_trading_day_index].date() < start_date:
+        first_trading_day_index += 1
+        if first_trading_day_index >= len(data) - 5:
+            return {"error": "无法匹配交易日期。"}
+
+    open_price = float(data['Open'].iloc[first_trading_day_index])
+    close_price_5_days_later = float(data['Close'].iloc[first_trading_day_index + 4])
+    return {
+        "entry_date": data.index[first_trading_day_index].strftime('%Y-%m-%d'),
+        "exit_date": data.index[first_trading_day_index + 4].strftime('%Y-%m-%d'),
+        "open_price": open_price,
+        "close_price": close_price_5_days_later,
+        "performance": ((close_price_5_days_later - open_price) / open_price) * 100,
+    }
 
-        # Ensure the first row corresponds to the trade_date or the next trading day
-        first_trading_day_index = 0
-        while data.index[first_trading_day_index].date() < start_date:
-            first_trading_day_index += 1
-            if first_trading_day_index >= len(data) - 5:
-                return "无法匹配交易日期。"
 
-        open_price = data['Open'].iloc[first_trading_day_index]
-        close_price_5_days_later = data['Close'].iloc[first_trading_day_index + 4]
-        performance = ((close_price_5_days_later - open_price) / open_price) * 100
+def evaluate_ground_truth(ticker, trade_date, signal):
+    try:
+        realized = compute_realized_return(ticker, trade_date)
+        if "error" in realized:
+            return realized["error"]
+        performance = realized["performance"]
 
         result = "INCORRECT DECISION"
         # Define success criteria: >1% for BUY, <-1% for SELL, within +/-1% for HOLD
@@ -117,8 +154,8 @@ def evaluate_ground_truth(ticker, trade_date, signal):
         return (
             f"----- Ground Truth Evaluation Report -----\n"
             f"智能体信号: {trade_date} {signal} \n"
-            f"{data.index[first_trading_day_index].strftime('%Y-%m-%d')} 的开盘价:${open_price:.2f}\n"
-            f"({data.index[first_trading_day_index + 4].strftime('%Y-%m-%d')}) 5天后收盘价: ${close_price_5_days_later:.2f}\n"
+            f"{realized['entry_date']} 的开盘价:${realized['open_price']:.2f}\n"
+            f"({realized['exit_date']}) 5天后收盘价: ${realized['close_price']:.2f}\n"
             f"实际市场表现: {performance:+.2f}%\n"
             f"评估结果: {result}"
         )
@@ -0,0 +1,298 @@
+# backend/events.py
+# 任务事件推送：按任务的发布 / 订阅通道，把后台线程里产生的事件即时推给 asyncio 订阅方（WebSocket 等）。
+# - 事件本身保存在任务存储的事件日志中（带 seq）；通道在每次唤醒时按自身游标读取一次增量，
+#   再分发到该任务全部订阅方的 asyncio.Queue —— 多个观看者共享同一次读取
+# - 跨线程唤醒统一通过 loop.call_soon_threadsafe，同一轮内的多次发布合并为一次；订阅方空闲时不占用 CPU
+# - 订阅方的队列有上限，积压溢出时丢弃队列并按自己的游标从事件日志补读，不会拖慢其他订阅方
+# - 事件由其他进程写入时（worker_pool_mode 为 process 的工作池子进程）本进程收不到写入通知：
+#   对有订阅方的任务每 event_store_poll_seconds 秒读取一次最新 seq，有新事件即发布；
+#   其他 API 进程写入的事件同样由此发现，keepalive 超时后的兜底重读仍保留
+# - SQLite / Redis 存储的读取是阻塞 I/O，经 read_store 放到线程池执行，不阻塞事件循环；
+#   内存存储的读取只是加锁拷贝，直接在事件循环中执行
+# - 推送流与长轮询以任务"关闭"为终点（storage.is_closed）：失败 / 取消随 status 事件关闭；
+#   完成的任务在 completed 之后还会追加后台评估的日志，直到 postprocess 事件（评估结束或未安排评估）才关闭
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .config_user import get_user_config
+from .storage import InMemoryTaskStore, add_event_listener, get_events, task_store
+
+# 单个订阅方队列上限（事件数）
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# 任务存储的读取是否会阻塞（需要放到线程池）
+STORE_BLOCKS = not isinstance(task_store, InMemoryTaskStore)
+
+
+async def read_store(fn, *args, **kwargs):
+    """在事件循环中调用任务存储的读取函数（get_task / get_events 等），阻塞型存储放到线程池执行。"""
+    if STORE_BLOCKS:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+class Subscription:
+    """一个订阅方：事件队列 + 积压溢出标记"""
+
+    def __init__(self, task_id: str, loop: asyncio.AbstractEventLoop):
+        self.task_id = task_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False
+
+    def ping(self) -> None:
+        # keepalive 到期：投递 None 唤醒等待方
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    def offer(self, events) -> None:
+        if self.lagged:
+            return
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.lagged = True
+                return
+
+
+class _Channel:
+    """某个任务在某个事件循环上的订阅方集合，及已分发到的 seq"""
+
+    def __init__(self, cursor: int):
+        self.cursor = cursor
+        self.subscribers = set()
+        # 增量读取进行中（阻塞型存储在线程池中读取）；期间的新通知只标记，读取结束后再读一次
+        self.reading = False
+        self.dirty = False
+
+
+class EventBroker:
+    """进程内按任务的发布 / 订阅通道（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: Dict[Tuple[str, asyncio.AbstractEventLoop], _Channel] = {}
+        # task_id -> 有订阅方的事件循环
+        self._loops: Dict[str, set] = {}
+        # 已调度、尚未执行的唤醒 (task_id, loop)，用于合并
+        self._pending = set()
+
+    async def subscribe(self, task_id: str) -> Subscription:
+        """在事件循环中调用。订阅之后写入的事件会进入返回对象的队列。"""
+        loop = asyncio.get_running_loop()
+        sub = Subscription(task_id, loop)
+        key = (task_id, loop)
+        # 通道只在本事件循环中读写，仅索引结构需要加锁
+        channel = self._channels.get(key)
+        if channel is None:
+            batch = await read_store(get_events, task_id, since=0, limit=0)
+            # 等待读取期间可能已有其他订阅方创建了通道
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = _Channel(batch["last_seq"] if batch else 0)
+                with self._lock:
+                    self._channels[key] = channel
+                    self._loops.setdefault(task_id, set()).add(loop)
+        channel.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        loop = sub.loop
+        key = (sub.task_id, loop)
+        channel = self._channels.get(key)
+        if channel is None:
+            return
+        channel.subscribers.discard(sub)
+        if not channel.subscribers:
+            with self._lock:
+                self._channels.pop(key, None)
+                loops = self._loops.get(sub.task_id)
+                if loops is not None:
+                    loops.discard(loop)
+                    if not loops:
+                        del self._loops[sub.task_id]
+
+    def subscriber_count(self, task_id: Optional[str] = None) -> int:
+        with self._lock:
+            channels = [c for (tid, _), c in self._channels.items() if task_id is None or tid == task_id]
+        return sum(len(c.subscribers) for c in channels)
+
+    def publish(self, task_id: str) -> None:
+        """任意线程调用：通知该任务有新事件。"""
+        with self._lock:
+            loops = [loop for loop in self._loops.get(task_id, ()) if (task_id, loop) not in self._pending]
+            self._pending.update((task_id, loop) for loop in loops)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._dispatch, task_id, loop)
+            except RuntimeError:
+                # 事件循环已关闭
+                with self._lock:
+                    self._pending.discard((task_id, loop))
+
+    def watch_store(self, interval: float) -> None:
+        """启动后台线程：定期读取有订阅方的任务的最新 seq，发现其他进程写入的新事件时发布。"""
+        threading.Thread(target=self._watch, args=(interval,), name="event-store-watch", daemon=True).start()
+
+    def _watch(self, interval):
+        seen: Dict[str, int] = {}
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                task_ids = list(self._loops)
+            for task_id in task_ids:
+                try:
+                    batch = get_events(task_id, since=0, limit=0)
+                except Exception as e:
+                    print(f"[Events] 轮询任务 {task_id} 的事件失败: {e}")
+                    continue
+                if batch and batch["last_seq"] != seen.get(task_id):
+                    seen[task_id] = batch["last_seq"]
+                    self.publish(task_id)
+            seen = {task_id: seq for task_id, seq in seen.items() if task_id in task_ids}
+
+    def _dispatch(self, task_id, loop):
+        # 在订阅方所在的事件循环中执行：读取一次增量，分发给全部订阅方
+        with self._lock:
+            self._pending.discard((task_id, loop))
+        channel = self._channels.get((task_id, loop))
+        if channel is None:
+            return
+        if not STORE_BLOCKS:
+            self._offer(channel, get_events(task_id, since=channel.cursor))
+            return
+        if channel.reading:
+            channel.dirty = True
+            return
+        channel.reading = True
+        loop.create_task(self._read_and_offer(task_id, channel))
+
+    async def _read_and_offer(self, task_id, channel):
+        # 阻塞型存储：在线程池中读取增量，同一通道同时只有一个读取
+        try:
+            while True:
+                channel.dirty = False
+                self._offer(channel, await read_store(get_events, task_id, since=channel.cursor))
+                if not channel.dirty:
+                    return
+        except Exception as e:
+            print(f"[Events] 读取任务 {task_id} 的事件失败: {e}")
+        finally:
+            channel.reading = False
+
+    @staticmethod
+    def _offer(channel, batch):
+        if not batch or not batch["events"]:
+            return
+        events = batch["events"]
+        channel.cursor = events[-1]["seq"]
+        for sub in list(channel.subscribers):
+            sub.offer(events)
+
+
+# 全局事件通道：任务存储每次写入事件后发布
+event_broker = EventBroker()
+add_event_listener(event_broker.publish)
+# 进程工作池：事件在子进程中写入共享存储，本进程改为轮询发现
+if STORE_BLOCKS and str(get_user_config().get("worker_pool_mode", "thread")).lower() == "process":
+    event_broker.watch_store(float(get_user_config().get("event_store_poll_seconds", 0.25)))
+
+
+def _closes(event) -> bool:
+    # 关闭任务事件流的事件：失败 / 取消的 status 事件，或完成后的 postprocess 事件
+    if event["type"] == "status":
+        return event["status"] != "completed"
+    return event["type"] == "postprocess"
+
+
+async def stream_events(task_id: str, since: int = 0, keepalive: Optional[float] = 15.0):
+    """
+    异步生成器：依次产出 seq > since 的任务事件，直到任务关闭为止（error / cancelled 的 status 事件，
+    或完成后的 postprocess 事件，之后的反思日志不再推送）。
+    - 任务不存在时产出一个 {"type": "status", "status": "not_found"} 后结束
+    - 游标之后的事件已被丢弃（内存存储的环形缓冲溢出）时先产出 {"type": "gap", "since", "first_seq"}
+    - 等待超过 keepalive 秒没有新事件时产出 None（调用方可发送心跳），并兜底重读一次
+    """
+    cursor = max(0, since)
+    # 先订阅再补读历史：两者重叠的部分按 seq 去重，不会遗漏
+    sub = await event_broker.subscribe(task_id)
+    catch_up = True
+    try:
+        while True:
+            if sub.lagged:
+                # 队列溢出：丢弃积压，改为从事件日志补读
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.lagged = False
+                catch_up = True
+
+            if catch_up:
+                catch_up = False
+                batch = await read_store(get_events, task_id, since=cursor)
+                if batch is None:
+                    yield {"type": "status", "status": "not_found"}
+                    return
+                if batch["gap"]:
+                    # 游标之后的部分事件已被丢弃：告知客户端缺失区间（可改用完整状态重新同步）
+                    yield {"type": "gap", "since": cursor, "first_seq": batch["first_seq"]}
+                for event in batch["events"]:
+                    yield event
+                    cursor = event["seq"]
+                    if _closes(event):
+                        return
+                # 游标已越过结束事件（断线重连到已关闭的任务）
+                if batch["closed"] and cursor >= batch["last_seq"]:
+                    yield {"type": "status", "status": batch["status"], "seq": batch["last_seq"]}
+                    return
+                continue
+
+            try:
+                event = sub.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                # 空闲等待；keepalive 用定时器投递 None 实现，比每个事件一次 wait_for 开销小得多
+                timer = sub.loop.call_later(keepalive, sub.ping) if keepalive is not None else None
+                event = await sub.queue.get()
+                if timer is not None:
+                    timer.cancel()
+            if event is None:
+                catch_up = True
+                yield None
+                continue
+            if event["seq"] <= cursor:
+                continue
+            yield event
+            cursor = event["seq"]
+            if _closes(event):
+                return
+    finally:
+        event_broker.unsubscribe(sub)
+
+
+async def wait_for_events(task_id: str, since: int = 0, timeout: float = 0.0, limit: Optional[int] = None):
+    """
+    长轮询：有 seq > since 的事件（或任务已关闭）时立即返回，否则最多等待 timeout 秒。
+    已完成但后台评估未结束的任务同样等待新事件，不会立即返回空结果。
+    返回值与 get_events 相同；任务不存在返回 None。
+    """
+    batch = await read_store(get_events, task_id, since=since, limit=limit)
+    if batch is None or batch["events"] or batch["closed"] or timeout <= 0:
+        return batch
+    sub = await event_broker.subscribe(task_id)
+    try:
+        # 订阅后再读一次，避免两次读取之间写入的事件错过唤醒
+        batch = await read_store(get_events, task_id, since=since, limit=limit)
+        if batch is None or batch["events"] or batch["closed"]:
+            return batch
+        try:
+            await asyncio.wait_for(sub.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return await read_store(get_events, task_id, since=since, limit=limit)
+    finally:
+        event_broker.unsubscribe(sub)
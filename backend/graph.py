@@ -16,14 +16,25 @@ from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.messages import HumanMessage, RemoveMessage
 from .models import AgentState
 from .tools import Toolkit
+from .memory import get_persistent_memories
+from .metrics import timed_node
+from .tracing import tracer
+from .deadline import DeadlineBudget, DegradableLLM
+
+
+def _instrumented_node(name, fn):
+    # 节点耗时记入 /metrics，同时在当前 trace 中记录一个 span（节点内的 LLM / 工具调用挂在其下）
+    return timed_node(name, tracer.wrap(name, fn, span_type="node"))
 
 
 # ConditionalLogic 类包含我们图的路由函数。
 class ConditionalLogic:
-    def __init__(self, max_debate_rounds=2, max_risk_discuss_rounds=1):
+    def __init__(self, max_debate_rounds=2, max_risk_discuss_rounds=1, budget: DeadlineBudget = None):
         # 存储配置中的最大轮数。
         self.max_debate_rounds = max_debate_rounds
         self.max_risk_discuss_rounds = max_risk_discuss_rounds
+        # 截止时间模式：轮数与是否跳过风控讨论以预算中的运行时开关为准（deadline.py）
+        self.budget = budget
         # 防护上限，避免意外无限循环
         self._safety_max_steps = 200
         self._debug_counter = 0
@@ -59,7 +70,8 @@ class ConditionalLogic:
         if self._debug_counter > self._safety_max_steps:
             print("[ConditionalLogic] Safety limit reached in debate loop, routing to Research Manager.")
             return "Research Manager"
-        if count >= 2 * self.max_debate_rounds:
+        max_rounds = self.budget.max_debate_rounds if self.budget is not None else self.max_debate_rounds
+        if count >= 2 * max_rounds:
             return "Research Manager"
         return "Bear Researcher" if current.startswith("Bull") else "Bull Researcher"
 
@@ -72,11 +84,19 @@ class ConditionalLogic:
         if self._debug_counter > self._safety_max_steps:
             print("[ConditionalLogic] Safety limit reached in risk loop, routing to Risk Judge.")
             return "Risk Judge"
+        if self.budget is not None and self.budget.skip_risk_debate:
+            return "Risk Judge"
         if count >= 3 * self.max_risk_discuss_rounds:
             return "Risk Judge"
         if speaker == "Risky Analyst": return "Safe Analyst"
         if speaker == "Safe Analyst": return "Neutral Analyst"
         return "Risky Analyst"
+
+    # 交易员之后进入风控讨论；截止时间模式降级跳过风控讨论时直接由投资组合经理决策。
+    def after_trader(self, state: AgentState) -> str:
+        if self.budget is not None and self.budget.skip_risk_debate:
+            return "Risk Judge"
+        return "Risky Analyst"
     
     def next_analyst_router(self, state: AgentState) -> str:
         # 优先选择还没生成报告的分析师；当四个报告都生成后，进入 Bull Researcher
@@ -109,26 +129,25 @@ def create_msg_delete():
 
 
 # ==================== 核心工厂函数：为每个任务创建独立的 graph ====================
-def create_trading_graph():
+def create_trading_graph(toolkit: Toolkit = None, budget: DeadlineBudget = None):
     """
         为每个并发任务创建一个全新的、独立的 trading_graph
-        所有 toolkit、memory、节点都是独立的，避免状态污染
+        toolkit、节点都是独立的，避免状态污染；记忆为跨任务共享的持久化集合（只读）
+        传入任务的 toolkit 时，图与后处理评估使用同一个工具包
+        传入 budget（截止时间模式）时，辩论轮数、风控讨论与深度模型可在运行中降级
         """
     # 每个任务独立的工具包
     user_config = get_user_config()
     prompts = user_config["prompts"]
 
-    toolkit = Toolkit()
+    toolkit = toolkit or Toolkit()
     print(f"定义并实例化了包含实时数据工具的工具包类。")
 
-    # 每个任务独立的记忆（关键！）
-    memories = {
-        "bull": FinancialSituationMemory(f"bull_memory_{id(toolkit)}"),  # 用唯一标识避免冲突
-        "bear": FinancialSituationMemory(f"bear_memory_{id(toolkit)}"),
-        "trader": FinancialSituationMemory(f"trader_memory_{id(toolkit)}"),
-        "invest_judge": FinancialSituationMemory(f"invest_judge_memory_{id(toolkit)}"),
-        "risk_manager": FinancialSituationMemory(f"risk_manager_memory_{id(toolkit)}"),
-    }
+    # 截止时间模式下深度模型节点可在运行中切换到快速模型
+    deep_llm = deep_thinking_llm if budget is None else DegradableLLM(budget, deep_thinking_llm, quick_thinking_llm)
+
+    # 跨任务共享的持久化记忆：节点只读检索，写入由后台反思队列完成，任务之间不会互相污染状态
+    memories = get_persistent_memories()
 
     # 独立的工具节点
     all_tools = [
@@ -179,7 +198,7 @@ def create_trading_graph():
     bear_researcher_node = create_researcher_node(quick_thinking_llm, memories["bear"],
                                                   prompts["bear"],
                                                   "Bear Analyst")
-    research_manager_node = create_research_manager(deep_thinking_llm, memories["invest_judge"])
+    research_manager_node = create_research_manager(deep_llm, memories["invest_judge"])
 
     print(f"启用交易员和风控节点...")
     trader_node = functools.partial(create_trader(quick_thinking_llm, memories["trader"]), name="Trader")
@@ -189,32 +208,33 @@ def create_trading_graph():
                                     "Safe Analyst")
     neutral_node = create_risk_debator(quick_thinking_llm, prompts["neutral"],
                                        "Neutral Analyst")
-    risk_manager_node = create_risk_manager(deep_thinking_llm, memories["risk_manager"])
+    risk_manager_node = create_risk_manager(deep_llm, memories["risk_manager"])
 
     # 独立的条件逻辑
     conditional_logic = ConditionalLogic(
         max_debate_rounds=user_config['max_debate_rounds'],
-        max_risk_discuss_rounds=user_config['max_risk_discuss_rounds']
+        max_risk_discuss_rounds=user_config['max_risk_discuss_rounds'],
+        budget=budget
     )
 
     print(f"开始构建Workflow...")
 
     workflow = StateGraph(AgentState)
 
-    # 添加节点
-    workflow.add_node("Market Analyst", market_analyst_node)
-    workflow.add_node("Social Analyst", social_analyst_node)
-    workflow.add_node("News Analyst", news_analyst_node)
-    workflow.add_node("Fundamentals Analyst", fundamentals_analyst_node)
+    # 添加节点（智能体节点记录执行耗时与追踪 span；工具调用在 tools.py 中统计）
+    workflow.add_node("Market Analyst", _instrumented_node("Market Analyst", market_analyst_node))
+    workflow.add_node("Social Analyst", _instrumented_node("Social Analyst", social_analyst_node))
+    workflow.add_node("News Analyst", _instrumented_node("News Analyst", news_analyst_node))
+    workflow.add_node("Fundamentals Analyst", _instrumented_node("Fundamentals Analyst", fundamentals_analyst_node))
     workflow.add_node("tools", tool_node)
-    workflow.add_node("Bull Researcher", bull_researcher_node)
-    workflow.add_node("Bear Researcher", bear_researcher_node)
-    workflow.add_node("Research Manager", research_manager_node)
-    workflow.add_node("Trader", trader_node)
-    workflow.add_node("Risky Analyst", risky_node)
-    workflow.add_node("Safe Analyst", safe_node)
-    workflow.add_node("Neutral Analyst", neutral_node)
-    workflow.add_node("Risk Judge", risk_manager_node)
+    workflow.add_node("Bull Researcher", _instrumented_node("Bull Researcher", bull_researcher_node))
+    workflow.add_node("Bear Researcher", _instrumented_node("Bear Researcher", bear_researcher_node))
+    workflow.add_node("Research Manager", _instrumented_node("Research Manager", research_manager_node))
+    workflow.add_node("Trader", _instrumented_node("Trader", trader_node))
+    workflow.add_node("Risky Analyst", _instrumented_node("Risky Analyst", risky_node))
+    workflow.add_node("Safe Analyst", _instrumented_node("Safe Analyst", safe_node))
+    workflow.add_node("Neutral Analyst", _instrumented_node("Neutral Analyst", neutral_node))
+    workflow.add_node("Risk Judge", _instrumented_node("Risk Judge", risk_manager_node))
     workflow.add_node("next_analyst", lambda state: state)  # 空节点，只路由
 
     # 设置入口
@@ -268,7 +288,8 @@ def create_trading_graph():
     workflow.add_conditional_edges("Bear Researcher", conditional_logic.should_continue_debate,
                                    {"Research Manager": "Research Manager", "Bull Researcher": "Bull Researcher"})
     workflow.add_edge("Research Manager", "Trader")
-    workflow.add_edge("Trader", "Risky Analyst")
+    workflow.add_conditional_edges("Trader", conditional_logic.after_trader,
+                                   {"Risky Analyst": "Risky Analyst", "Risk Judge": "Risk Judge"})
 
     workflow.add_conditional_edges("Risky Analyst", conditional_logic.should_continue_risk_analysis,
                                    {"Risk Judge": "Risk Judge", "Safe Analyst": "Safe Analyst"})
@@ -1,19 +1,31 @@
 # 实现智能体的长期记忆机制（学习能力）
-# 使用 ChromaDB 作为向量数据库，结合 OpenAI 嵌入模型
-
-import chromadb
-from openai import OpenAI
-from .config_user import get_user_config
+# 向量存储可插拔：
+# - chroma：ChromaDB 集合（默认）
+# - numpy：内存映射文件中的连续 float32/float16 矩阵，暴力 top-k（一次矩阵-向量乘法），只追加增长
+# 嵌入后端可插拔：
+# - api：OpenAI 兼容的 embeddings 接口（默认）
+# - local：纯 CPU 的哈希 n-gram 向量（NumPy 计算，无需 API Key、无网络往返）
 
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
-# 将过去的交易情境 + 经验教训（reflection）存储为向量。
-# 在类似情境下检索历史经验，供智能体（如多空分析师、风控经理）参考，避免重复错误。
-# 每个关键智能体（如 Bull、Bear、Trader、Risk Manager）都会有自己的记忆实例
+import numpy as np
+from .config_user import get_user_config
 
-class FinancialSituationMemory:
-    def __init__(self, name):
 
-        config = get_user_config()
+# 通过 OpenAI 兼容接口生成嵌入（支持批量与并发分块）
+class APIEmbeddingBackend:
+    def __init__(self, config):
         # 动态获取 backend_url 和 provider
         self.backend_url = config.get("backend_url", "https://api.openai.com/v1").rstrip("/")
         self.provider = config.get("llm_provider", "openai").lower()
@@ -27,6 +39,11 @@ class FinancialSituationMemory:
         }
 
         self.embedding_model = embedding_model_map.get(self.provider, "text-embedding-3-small")
+        # 嵌入空间标识（模型决定维度）：不同嵌入空间的向量存放在不同集合中
+        self.signature = f"api-{self.embedding_model}"
+        # 批量嵌入：每个请求的文本条数，以及并发提交的分块数
+        self.embedding_batch_size = max(1, int(config.get("embedding_batch_size", 64)))
+        self.embedding_max_workers = max(1, int(config.get("embedding_max_workers", 4)))
 
         # 创建 OpenAI 客户端（兼容多种平台）
         api_key = ""
@@ -42,57 +59,817 @@ class FinancialSituationMemory:
         if not api_key:
             raise ValueError(f"{self.provider.upper()} API Key 未配置，无法初始化记忆系统")
 
-        # 初始化 OpenAI 客户端（指向您配置的后端）
+        # 初始化 OpenAI 客户端（指向您配置的后端）；延迟导入，离线模式无需安装
+        from openai import OpenAI
         self.client = OpenAI(base_url=self.backend_url, api_key=api_key)
-        # 创建一个 ChromaDB 客户端（允许重置以进行测试）
-        self.chroma_client = chromadb.Client(chromadb.config.Settings(allow_reset=True))
-        self.collection_name = f"{name}_{self.provider}"  # 加上提供商避免冲突（可选）
-        # 创建一个集合（类似于表格）来存储情境和建议
-        self.situation_collection = self.chroma_client.create_collection(name=name)
 
     def get_embedding(self, text):
         # 为给定的文本生成嵌入（向量）
         response = self.client.embeddings.create(model=self.embedding_model, input=text)
         return response.data[0].embedding
 
-    def add_situations(self, situations_and_advice):
-        # 将新的情境和建议添加到内存中
-        if not situations_and_advice:
-            return
+    def _embed_chunk(self, chunk):
+        # 一次请求嵌入一组文本；按返回的 index 排序，保证与输入顺序一致
+        response = self.client.embeddings.create(model=self.embedding_model, input=chunk)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
 
-        # 偏移量确保 ID 唯一（以防以后添加新数据）
-        offset = self.situation_collection.count()
-        ids = [str(offset + i) for i, _ in enumerate(situations_and_advice)]
+    def get_embeddings(self, texts):
+        # 批量生成嵌入：按 embedding_batch_size 分块，每块一次 HTTP 请求，多块并发提交
+        texts = list(texts)
+        if not texts:
+            return []
+        size = self.embedding_batch_size
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        if len(chunks) == 1 or self.embedding_max_workers == 1:
+            results = [self._embed_chunk(c) for c in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.embedding_max_workers, len(chunks))) as pool:
+                # map 保持分块顺序
+                results = list(pool.map(self._embed_chunk, chunks))
+        return [emb for chunk_result in results for emb in chunk_result]
 
-        # 分离情境及其对应的建议
-        situations = [s for s, r in situations_and_advice]
-        recommendations = [r for s, r in situations_and_advice]
 
-        # 为所有情境生成嵌入
-        embeddings = [self.get_embedding(s) for s in situations]
+# 本地哈希 n-gram 嵌入：字符 n-gram 经 crc32 哈希映射到固定维度（带符号，减少碰撞偏差），
+# 词频取 log1p 后做 L2 归一化。对中英文混合文本都适用，结果确定且跨进程稳定。
+class HashingEmbeddingBackend:
+    def __init__(self, config):
+        self.dim = max(16, int(config.get("local_embedding_dim", 512)))
+        ngram_range = config.get("local_embedding_ngram_range", (1, 3))
+        self.ngram_min, self.ngram_max = int(ngram_range[0]), int(ngram_range[1])
+        self.signature = f"local{self.dim}-{self.ngram_min}{self.ngram_max}"
+
+    def _vector(self, text):
+        # 统一小写并压缩空白，避免格式差异影响相似度
+        text = " ".join(str(text).lower().split())
+        hashes = [
+            zlib.crc32(text[i:i + n].encode("utf-8"))
+            for n in range(self.ngram_min, self.ngram_max + 1)
+            for i in range(len(text) - n + 1)
+        ]
+        if not hashes:
+            return np.zeros(self.dim, dtype=np.float32)
+        h = np.asarray(hashes, dtype=np.uint32)
+        # 最高位决定符号，其余位决定桶
+        signs = np.where(h >> 31, 1.0, -1.0)
+        vec = np.bincount(h % self.dim, weights=signs, minlength=self.dim)
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return vec.astype(np.float32)
+
+    def get_embedding(self, text):
+        return self._vector(text).tolist()
+
+    def get_embeddings(self, texts):
+        return [self._vector(t).tolist() for t in texts]
+
+
+EMBEDDING_BACKENDS = {
+    "api": APIEmbeddingBackend,
+    "local": HashingEmbeddingBackend,
+}
+
+
+def create_embedding_backend(config=None):
+    # 根据配置 embedding_backend 选择嵌入后端
+    config = config or get_user_config()
+    name = str(config.get("embedding_backend", "api")).lower()
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"不支持的嵌入后端: {name}（可选: {', '.join(EMBEDDING_BACKENDS)}）")
+    return EMBEDDING_BACKENDS[name](config)
+
+
+def collection_name(name, embedder):
+    # 集合名按嵌入后端 / 维度区分命名空间：切换 embedding_backend 或维度后使用新集合，不会与旧向量维度冲突。
+    # 只保留 Chroma 允许的字符（字母数字 . _ -，3~63 个字符）
+    signature = getattr(embedder, "signature", type(embedder).__name__)
+    return re.sub(r"[^A-Za-z0-9._-]", "-", f"{name}__{signature}")[:63].strip("-._")
+
+
+class _ReadWriteLock:
+    """读写锁：检索可以并发；写入与维护（导出 + 删除重建）独占，等待中的写方优先"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 
-        # 将所有内容存储在 Chroma（向量数据库）中
+def trade_day(trade_date):
+    # "YYYY-MM-DD" -> YYYYMMDD 整数，便于元数据范围过滤
+    return int(str(trade_date).replace("-", "")[:8])
+
+
+# 检索过滤条件（两种存储通用）：
+#   {"match_any": {"ticker": "NVDA", "sector": "Technology"},  # 任一字段相等即可
+#    "trade_day_gte": 20250101}                                # 交易日下限（含）
+# ChromaDB 向量存储（默认）
+class ChromaVectorStore:
+    # 维护时单次 update / delete 的条目数（Chroma 对单次请求的条目数有上限）
+    BATCH_SIZE = 1000
+
+    def __init__(self, name, directory=None):
+        # 延迟导入：只有选择 chroma 存储时才承担 ChromaDB 的启动开销
+        import chromadb
+        if directory is None:
+            # 创建一个 ChromaDB 客户端（允许重置以进行测试）
+            self.chroma_client = chromadb.Client(chromadb.config.Settings(allow_reset=True))
+        else:
+            # 持久化客户端：集合跨进程重启保留
+            self.chroma_client = chromadb.PersistentClient(path=directory)
+        self.name = name
+        # 创建（或打开已有的）集合（类似于表格）来存储情境和建议
+        self.situation_collection = self.chroma_client.get_or_create_collection(name=name)
+        # 最近访问时间（id -> 时间戳），用于 LRU 淘汰；仅在进程内记录
+        self.last_access = {}
+
+    def count(self):
+        return self.situation_collection.count()
+
+    def size_bytes(self):
+        # Chroma 内部存储大小不可直接获取
+        return None
+
+    def add(self, documents, metadatas, embeddings):
+        # 随机 ID：维护时在集合内原地删除条目后，按条目数编号会与现有 ID 冲突
+        ids = [uuid.uuid4().hex for _ in documents]
         self.situation_collection.add(
-            documents=situations,
-            metadatas=[{"recommendation": rec} for rec in recommendations],
+            documents=documents,
+            metadatas=metadatas,
             embeddings=embeddings,
             ids=ids,
         )
 
-    def get_memories(self, current_situation, n_matches=1):
-        # 检索与给定查询最相似的过去情境
-        if self.situation_collection.count() == 0:
+    @staticmethod
+    def _where(filters):
+        # 将通用过滤条件转换为 Chroma 的 where 子句（Chroma 在元数据表上建有索引）
+        if not filters:
+            return None
+        conditions = []
+        match_any = [{k: v} for k, v in (filters.get("match_any") or {}).items() if v]
+        if len(match_any) == 1:
+            conditions.append(match_any[0])
+        elif match_any:
+            conditions.append({"$or": match_any})
+        if filters.get("trade_day_gte") is not None:
+            conditions.append({"trade_day": {"$gte": int(filters["trade_day_gte"])}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def query(self, embedding, n_results, touch=True, filters=None):
+        count = self.situation_collection.count()
+        if count == 0:
             return []
+        results = self.situation_collection.query(
+            query_embeddings=[embedding],
+            n_results=min(n_results, count),
+            where=self._where(filters),
+            include=["metadatas"],
+        )
+        if touch:
+            now = time.time()
+            for id_ in results['ids'][0]:
+                self.last_access[id_] = now
+        return results['metadatas'][0]
+
+    def export(self):
+        # 导出全部条目，供维护任务（去重 / 淘汰）使用
+        data = self.situation_collection.get(include=["documents", "metadatas", "embeddings"])
+        return [
+            {
+                "id": id_,
+                "document": doc,
+                "metadata": meta,
+                "embedding": np.asarray(emb, dtype=np.float32),
+                "last_access": self.last_access.get(id_, 0.0),
+            }
+            for id_, doc, meta, emb in zip(data["ids"], data["documents"], data["metadatas"], data["embeddings"])
+        ]
+
+    def rebuild(self, entries):
+        # 在集合内原地更新：先更新保留条目的元数据（合并计数等），再删除被合并 / 淘汰的条目。
+        # 不删除重建整个集合，中途出错或进程退出时最多残留部分待删除条目，下次维护时再删
+        kept = [e for e in entries if e.get("id") is not None]
+        kept_ids = {e["id"] for e in kept}
+        for start in range(0, len(kept), self.BATCH_SIZE):
+            chunk = kept[start:start + self.BATCH_SIZE]
+            self.situation_collection.update(ids=[e["id"] for e in chunk], metadatas=[e["metadata"] for e in chunk])
+        removed = [id_ for id_ in self.situation_collection.get(include=[])["ids"] if id_ not in kept_ids]
+        for start in range(0, len(removed), self.BATCH_SIZE):
+            self.situation_collection.delete(ids=removed[start:start + self.BATCH_SIZE])
+        # 不是从本集合导出的条目（没有 ID）直接写入
+        new = [e for e in entries if e.get("id") is None]
+        if new:
+            self.add([e["document"] for e in new], [e["metadata"] for e in new],
+                     [np.asarray(e["embedding"], dtype=np.float32).tolist() for e in new])
+        self.last_access = {e["id"]: e.get("last_access", 0.0) for e in kept}
+
+
+def _fsync_dir(path):
+    # 目录项（新建 / 重命名的文件）落盘；不支持打开目录的平台上跳过
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# 基于内存映射文件的轻量向量索引。
+# 目录结构：
+#   CURRENT            清单：当前代目录、维度、数据类型与已提交的行数（原子替换，是追加与重建的提交点）
+#   gen-N/vectors.bin  行优先的连续矩阵（只追加）
+#   gen-N/meta.jsonl   每行一条记录 {"document": ..., "metadata": ..., "last_access": ...}（只追加，与矩阵行一一对应）
+# 追加：两个文件写入并落盘后再更新清单行数；重建：写入新的 gen-N+1 并落盘后替换清单，再删除旧代。
+# 加载时丢弃清单行数之后的未提交内容；已提交的行缺失则拒绝加载。
+# 向量写入前做 L2 归一化，点积即余弦相似度。
+# 元数据索引（内存中）：ticker / sector 的倒排表 + 每行的交易日，检索前先过滤候选行。
+class NumpyVectorStore:
+    # 分块计算相似度，float16 矩阵上转 float32 时只占用一块的临时内存
+    QUERY_BLOCK_ROWS = 4096
+    INDEXED_FIELDS = ("ticker", "sector")
+
+    def __init__(self, name, directory=None, dtype="float32"):
+        if directory is None:
+            # 未指定目录时使用临时目录（进程结束后清理），行为与内存版 Chroma 一致
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="memory_")
+            directory = self._tmpdir.name
+        self.path = os.path.join(directory, name)
+        os.makedirs(self.path, exist_ok=True)
+        # 数据文件按"代"存放在 gen-N 子目录中；清单 CURRENT 记录当前代、维度、精度与已提交的行数，
+        # 原子替换清单是追加与重建的提交点
+        self.manifest_file = os.path.join(self.path, "CURRENT")
+        self.generation = None
+        self.vectors_file = None
+        self.meta_file = None
+
+        self.lock = threading.Lock()
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.records = []
+        self._meta_bytes = 0
+        self._matrix = None
+        self._index = {field: {} for field in self.INDEXED_FIELDS}
+        self._trade_days = []
+        self._trade_days_array = None
+        self._load()
+        self._reindex()
+
+    def _use_generation(self, generation):
+        self.generation = generation
+        gen_dir = os.path.join(self.path, generation)
+        os.makedirs(gen_dir, exist_ok=True)
+        self.vectors_file = os.path.join(gen_dir, "vectors.bin")
+        self.meta_file = os.path.join(gen_dir, "meta.jsonl")
+
+    def _load(self):
+        if not os.path.exists(self.manifest_file):
+            self._migrate_legacy()
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        # 已有数据的类型以清单为准
+        self.dim = int(manifest["dim"])
+        self.dtype = np.dtype(manifest["dtype"])
+        rows = int(manifest["rows"])
+        self._use_generation(manifest["generation"])
+        records, offsets = self._read_meta(rows)
+        vector_rows = self._vector_bytes() // self._row_bytes()
+        # 已提交的行缺失说明数据文件损坏：拒绝加载，不把元数据错配到其他向量上
+        if len(records) < rows or vector_rows < rows:
+            raise RuntimeError(f"记忆存储 {self.path} 与清单不一致（清单 {rows} 行，向量 {vector_rows} 行，"
+                               f"元数据 {len(records)} 行），拒绝加载")
+        self.records = records
+        self._meta_bytes = offsets[rows]
+        # 提交点之后的内容来自中途退出的追加，丢弃
+        self._truncate()
+        self._remove_stale_generations()
+
+    def _migrate_legacy(self):
+        # 旧版布局（header.json 与数据文件直接放在集合目录下）：以较短者为准截断后移入第一代目录并写入清单
+        header_file = os.path.join(self.path, "header.json")
+        if not os.path.exists(header_file):
+            return
+        with open(header_file, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.dim = int(header["dim"])
+        self.dtype = np.dtype(header["dtype"])
+        self._use_generation("gen-1")
+        for src, dst in (("vectors.bin", self.vectors_file), ("meta.jsonl", self.meta_file)):
+            if os.path.exists(os.path.join(self.path, src)):
+                os.replace(os.path.join(self.path, src), dst)
+        records, offsets = self._read_meta()
+        rows = min(len(records), self._vector_bytes() // self._row_bytes())
+        self._meta_bytes = offsets[rows]
+        self._truncate(rows)
+        self._commit(rows)
+        os.remove(header_file)
+
+    def _read_meta(self, limit=None):
+        # 元数据逐行解析（最多 limit 行），返回记录与每行结束的字节偏移；写了一半的末行（无换行或无法解析）丢弃
+        records, offsets = [], [0]
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, "rb") as f:
+                for line in f:
+                    if (limit is not None and len(records) >= limit) or not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    records.append(record)
+                    offsets.append(offsets[-1] + len(line))
+        return records, offsets
+
+    def _row_bytes(self):
+        return self.dim * self.dtype.itemsize
+
+    def _vector_bytes(self):
+        return os.path.getsize(self.vectors_file) if self.vectors_file and os.path.exists(self.vectors_file) else 0
+
+    def _truncate(self, rows=None):
+        # 把两个数据文件截断到已提交的长度（rows 行向量、_meta_bytes 字节元数据），去掉未提交的追加
+        rows = len(self.records) if rows is None else rows
+        vector_bytes = rows * self._row_bytes()
+        if self._vector_bytes() > vector_bytes:
+            print(f"[Memory] {self.path}: 丢弃未提交的向量，截断到 {rows} 行")
+            with open(self.vectors_file, "ab") as f:
+                f.truncate(vector_bytes)
+        if os.path.exists(self.meta_file) and os.path.getsize(self.meta_file) > self._meta_bytes:
+            with open(self.meta_file, "ab") as f:
+                f.truncate(self._meta_bytes)
+
+    def _commit(self, rows):
+        # 写临时清单并落盘后原子替换：替换之前崩溃，加载时仍使用旧清单
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"generation": self.generation, "dim": self.dim, "dtype": self.dtype.name, "rows": rows}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_file)
+        _fsync_dir(self.path)
+
+    def _remove_stale_generations(self):
+        # 清理不再被清单引用的代目录（重建完成后的旧代，或重建中途退出留下的新代）
+        for entry in os.listdir(self.path):
+            if entry.startswith("gen-") and entry != self.generation:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def _index_records(self, records, start):
+        for offset, rec in enumerate(records):
+            meta = rec["metadata"]
+            for field in self.INDEXED_FIELDS:
+                if meta.get(field):
+                    self._index[field].setdefault(meta[field], []).append(start + offset)
+            self._trade_days.append(int(meta.get("trade_day", 0) or 0))
+        self._trade_days_array = None
+
+    def _reindex(self):
+        self._index = {field: {} for field in self.INDEXED_FIELDS}
+        self._trade_days = []
+        self._index_records(self.records, 0)
+
+    def _candidates(self, filters):
+        # 根据过滤条件返回候选行号；None 表示不过滤
+        rows = None
+        match_any = {k: v for k, v in (filters.get("match_any") or {}).items() if v}
+        if match_any:
+            ids = set()
+            for field, value in match_any.items():
+                ids.update(self._index.get(field, {}).get(value, ()))
+            rows = np.fromiter(sorted(ids), dtype=np.int64, count=len(ids))
+        if filters.get("trade_day_gte") is not None:
+            if self._trade_days_array is None:
+                self._trade_days_array = np.asarray(self._trade_days, dtype=np.int64)
+            days = self._trade_days_array
+            gte = int(filters["trade_day_gte"])
+            rows = np.nonzero(days >= gte)[0] if rows is None else rows[days[rows] >= gte]
+        return rows
+
+    def _map(self):
+        # 懒加载映射，追加后重新映射
+        n = len(self.records)
+        if n == 0:
+            return None
+        if self._matrix is None or self._matrix.shape[0] != n:
+            self._matrix = np.memmap(self.vectors_file, dtype=self.dtype, mode="r", shape=(n, self.dim))
+        return self._matrix
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def count(self):
+        return len(self.records)
+
+    def size_bytes(self):
+        return sum(os.path.getsize(f) for f in (self.vectors_file, self.meta_file) if f and os.path.exists(f))
+
+    def add(self, documents, metadatas, embeddings):
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self.lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._use_generation("gen-1")
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配：索引为 {self.dim}，写入为 {vectors.shape[1]}（是否切换了嵌入后端？）")
+            # 去掉之前失败的追加留下的未提交内容
+            self._truncate()
+            # 两个文件都落盘后再更新清单中的行数（提交点）；提交前退出的追加在加载时被截掉
+            with open(self.vectors_file, "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            new_records = [{"document": d, "metadata": m} for d, m in zip(documents, metadatas)]
+            payload = "".join(json.dumps(rec, ensure_ascii=False) + "\n" for rec in new_records).encode("utf-8")
+            with open(self.meta_file, "ab") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self._commit(len(self.records) + len(new_records))
+            self._meta_bytes += len(payload)
+            self._index_records(new_records, len(self.records))
+            self.records.extend(new_records)
+            self._matrix = None
+
+    def scores(self, embedding, rows=None):
+        # 一次矩阵-向量乘法得到全部行（或候选行）的相似度
+        matrix = self._map()
+        if matrix is None:
+            return np.zeros(0, dtype=np.float32)
+        q = self._normalize(np.asarray(embedding, dtype=np.float32))
+        if rows is not None:
+            # 只读取候选行
+            return matrix[rows].astype(np.float32) @ q
+        if matrix.dtype == np.float32:
+            return matrix @ q
+        out = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], self.QUERY_BLOCK_ROWS):
+            block = matrix[start:start + self.QUERY_BLOCK_ROWS]
+            out[start:start + len(block)] = block.astype(np.float32) @ q
+        return out
+
+    def query(self, embedding, n_results, touch=True, filters=None):
+        with self.lock:
+            rows = self._candidates(filters) if filters else None
+            if rows is not None and rows.size == 0:
+                return []
+            scores = self.scores(embedding, rows)
+            if scores.size == 0:
+                return []
+            k = min(n_results, scores.size)
+            # argpartition 取 top-k，再对这 k 个排序
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            if rows is not None:
+                top = rows[top]
+            # 访问时间只记在内存中，压缩重建时落盘
+            if touch:
+                now = time.time()
+                for i in top:
+                    self.records[i]["last_access"] = now
+            return [self.records[i]["metadata"] for i in top]
+
+    def export(self):
+        # 导出全部条目，供维护任务（去重 / 淘汰）使用
+        with self.lock:
+            matrix = self._map()
+            if matrix is None:
+                return []
+            vectors = np.asarray(matrix, dtype=np.float32)
+            return [
+                {
+                    "document": r["document"],
+                    "metadata": r["metadata"],
+                    "embedding": vectors[i],
+                    "last_access": r.get("last_access", 0.0),
+                }
+                for i, r in enumerate(self.records)
+            ]
+
+    def rebuild(self, entries):
+        # 紧凑的新索引（无空洞、无被删行）写入新一代目录并落盘，再原子替换清单切换过去；
+        # 切换前任何时刻退出，加载时仍是完整的旧数据
+        with self.lock:
+            if self.dim is None:
+                if not entries:
+                    return
+                self.dim = len(entries[0]["embedding"])
+            self._matrix = None
+            old_generation = self.generation
+            number = int(old_generation.split("-")[1]) + 1 if old_generation else 1
+            records = [
+                {"document": e["document"], "metadata": e["metadata"], "last_access": e.get("last_access", 0.0)}
+                for e in entries
+            ]
+            payload = "".join(json.dumps(rec, ensure_ascii=False) + "\n" for rec in records).encode("utf-8")
+            self._use_generation(f"gen-{number}")
+            try:
+                with open(self.vectors_file, "wb") as f:
+                    if entries:
+                        vectors = np.stack([np.asarray(e["embedding"], dtype=np.float32) for e in entries])
+                        f.write(self._normalize(vectors).astype(self.dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.meta_file, "wb") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                _fsync_dir(os.path.dirname(self.vectors_file))
+                self._commit(len(records))
+            except Exception:
+                # 清单未切换：删除写了一半的新代，继续使用旧代
+                shutil.rmtree(os.path.dirname(self.vectors_file), ignore_errors=True)
+                if old_generation:
+                    self._use_generation(old_generation)
+                else:
+                    self.dim = self.generation = self.vectors_file = self.meta_file = None
+                raise
+            self.records = records
+            self._meta_bytes = len(payload)
+            self._reindex()
+            if old_generation:
+                shutil.rmtree(os.path.join(self.path, old_generation), ignore_errors=True)
+
+
+def create_vector_store(name, config=None, directory=None):
+    # 根据配置 memory_store 选择向量存储；directory 为空时为进程内临时存储
+    config = config or get_user_config()
+    store = str(config.get("memory_store", "chroma")).lower()
+    if store == "chroma":
+        return ChromaVectorStore(name, directory)
+    if store == "numpy":
+        return NumpyVectorStore(name, directory, dtype=config.get("memory_vector_dtype", "float32"))
+    raise ValueError(f"不支持的记忆存储: {store}（可选: chroma, numpy）")
+
+
+# 将过去的交易情境 + 经验教训（reflection）存储为向量。
+# 在类似情境下检索历史经验，供智能体（如多空分析师、风控经理）参考，避免重复错误。
+# 每个关键智能体（如 Bull、Bear、Trader、Risk Manager）都会有自己的记忆实例
+
+class FinancialSituationMemory:
+    def __init__(self, name, embedding_backend=None, persist_dir=None):
+
+        config = get_user_config()
+        self.provider = config.get("llm_provider", "openai").lower()
+        # 嵌入后端可由调用方注入（便于多个记忆实例共享同一个客户端）
+        self.embedder = embedding_backend or create_embedding_backend(config)
+
+        # 集合名带上嵌入后端与维度，切换嵌入配置后不会读到维度不同的旧向量
+        self.collection_name = collection_name(name, self.embedder)
+        # 创建向量存储（Chroma 集合或 NumPy 内存映射索引）来存储情境和建议
+        self.store = create_vector_store(self.collection_name, config, persist_dir)
+        # 图节点并发检索，后台反思写入与维护（删除重建集合）独占
+        self.lock = _ReadWriteLock()
+
+    def get_embedding(self, text):
+        # 为给定的文本生成嵌入（向量）
+        return self.embedder.get_embedding(text)
+
+    def get_embeddings(self, texts):
+        # 批量生成嵌入
+        return self.embedder.get_embeddings(texts)
+
+    def add_situations(self, situations_and_advice, metadatas=None):
+        """
+        将新的情境和建议添加到内存中。
+        metadatas 可选，与情境一一对应的结构化元数据，例如
+        {"ticker", "sector", "trade_date", "signal", "realized_return"}，用于检索时预过滤。
+        """
+        if not situations_and_advice:
+            return
+
+        # 分离情境及其对应的建议
+        situations = [s for s, r in situations_and_advice]
+        recommendations = [r for s, r in situations_and_advice]
+
+        # 为所有情境批量生成嵌入（分块 + 并发，而不是逐条请求）
+        embeddings = self.get_embeddings(situations)
+
+        # 将所有内容存储在向量存储中（记录写入时间，供按时间淘汰）
+        created_at = time.time()
+        extras = metadatas or [{}] * len(situations)
+        records = []
+        for rec, extra in zip(recommendations, extras):
+            # 元数据值不能为 None（Chroma 限制）
+            meta = {k: v for k, v in (extra or {}).items() if v is not None}
+            if meta.get("trade_date") and "trade_day" not in meta:
+                meta["trade_day"] = trade_day(meta["trade_date"])
+            meta.update({"recommendation": rec, "created_at": created_at})
+            records.append(meta)
+        with self.lock.write():
+            self.store.add(
+                documents=situations,
+                metadatas=records,
+                embeddings=embeddings,
+            )
+
+    def get_memories(self, current_situation, n_matches=1, ticker=None, sector=None, trade_date=None,
+                     recent_days=None):
+        """
+        检索与给定查询最相似的过去情境。
+        提供 ticker / sector 时只在同一股票或同一行业的记忆中检索；提供 trade_date 时只检索
+        该日期前 recent_days（默认取配置 memory_recent_days）天以来的记忆。过滤后无结果则回退到全量检索。
+        """
+        with self.lock.read():
+            if self.store.count() == 0:
+                return []
+
+        filters = {}
+        if ticker or sector:
+            filters["match_any"] = {"ticker": ticker, "sector": sector}
+        if trade_date:
+            if recent_days is None:
+                recent_days = get_user_config().get("memory_recent_days")
+            if recent_days is not None:
+                since = datetime.strptime(trade_date, "%Y-%m-%d") - timedelta(days=int(recent_days))
+                filters["trade_day_gte"] = trade_day(since.strftime("%Y-%m-%d"))
 
         # 嵌入新的/当前情境
         query_embedding = self.get_embedding(current_situation)
 
-        # 查询集合以获取相似的嵌入
-        results = self.situation_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(n_matches, self.situation_collection.count()),
-            include=["metadatas"],
-        )
+        # 查询存储以获取相似的嵌入（先按元数据过滤）；与维护互斥，不会读到删除重建中的集合
+        with self.lock.read():
+            metadatas = self.store.query(query_embedding, n_matches, filters=filters or None)
+            if not metadatas and filters:
+                metadatas = self.store.query(query_embedding, n_matches)
 
         # 返回从匹配结果中提取的推荐
-        return [{'recommendation': meta['recommendation']} for meta in results['metadatas'][0]]
+        return [{'recommendation': meta['recommendation']} for meta in metadatas]
+
+    def _probe_latency(self, probes, n_matches=1):
+        # 用已存储的向量做查询探针，返回中位延迟（毫秒）；探针不计入 LRU 访问
+        if not probes or self.store.count() == 0:
+            return None
+        latencies = []
+        for emb in probes:
+            t0 = time.perf_counter()
+            self.store.query(np.asarray(emb, dtype=np.float32).tolist(), n_matches, touch=False)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        latencies.sort()
+        return round(latencies[len(latencies) // 2], 3)
+
+    def maintain(self, similarity_threshold=0.95, max_size=None, max_age_days=None, probe_queries=20):
+        """
+        维护任务：合并近似重复的情境、按时间 / LRU 淘汰，并紧凑重建索引。
+        - similarity_threshold: 余弦相似度不低于该值的条目视为重复，只保留最新的一条
+        - max_age_days: 早于该天数写入的条目被淘汰
+        - max_size: 超过上限时按最近访问时间（LRU）淘汰，未访问过的按写入时间
+        返回包含前后条目数、存储大小和查询延迟的报告。
+        维护期间独占记忆：检索等待维护完成，不会读到删除重建中的集合。
+        """
+        with self.lock.write():
+            return self._maintain(similarity_threshold, max_size, max_age_days, probe_queries)
+
+    def _maintain(self, similarity_threshold, max_size, max_age_days, probe_queries):
+        entries = self.store.export()
+        before_count = len(entries)
+        before_bytes = self.store.size_bytes()
+        probes = [e["embedding"] for e in entries[:: max(1, before_count // probe_queries)]][:probe_queries]
+        before_latency = self._probe_latency(probes)
+
+        now = time.time()
+        evicted_age = 0
+        if max_age_days is not None:
+            cutoff = now - float(max_age_days) * 86400
+            kept = [e for e in entries if e["metadata"].get("created_at", now) >= cutoff]
+            evicted_age = len(entries) - len(kept)
+            entries = kept
+
+        # 从新到旧贪心去重：与已保留条目的最大相似度超过阈值即合并进该条目
+        entries.sort(key=lambda e: e["metadata"].get("created_at", 0.0), reverse=True)
+        kept, merged = [], 0
+        if entries:
+            dim = len(entries[0]["embedding"])
+            kept_matrix = np.empty((len(entries), dim), dtype=np.float32)
+            for e in entries:
+                v = np.asarray(e["embedding"], dtype=np.float32)
+                norm = np.linalg.norm(v)
+                v = v / norm if norm > 0 else v
+                if kept:
+                    sims = kept_matrix[:len(kept)] @ v
+                    j = int(np.argmax(sims))
+                    if sims[j] >= similarity_threshold:
+                        target = kept[j]
+                        target["last_access"] = max(target.get("last_access", 0.0), e.get("last_access", 0.0))
+                        target["metadata"]["merged_count"] = target["metadata"].get("merged_count", 0) + 1
+                        merged += 1
+                        continue
+                kept_matrix[len(kept)] = v
+                kept.append(e)
+        entries = kept
+
+        evicted_lru = 0
+        if max_size is not None and len(entries) > max_size:
+            entries.sort(key=lambda e: (e.get("last_access", 0.0), e["metadata"].get("created_at", 0.0)), reverse=True)
+            evicted_lru = len(entries) - max_size
+            entries = entries[:max_size]
+
+        # 按写入时间升序重建，保持追加顺序语义
+        entries.sort(key=lambda e: e["metadata"].get("created_at", 0.0))
+        self.store.rebuild(entries)
+
+        return {
+            "collection": self.collection_name,
+            "before_count": before_count,
+            "after_count": len(entries),
+            "merged_duplicates": merged,
+            "evicted_by_age": evicted_age,
+            "evicted_by_lru": evicted_lru,
+            "before_bytes": before_bytes,
+            "after_bytes": self.store.size_bytes(),
+            "before_query_ms": before_latency,
+            "after_query_ms": self._probe_latency(probes),
+        }
+
+
+# 跨任务共享的持久化记忆：图节点从中检索，后台反思队列向其中写入
+MEMORY_KEYS = ["bull", "bear", "trader", "invest_judge", "risk_manager"]
+_persistent_memories = None
+_persistent_lock = threading.Lock()
+
+
+def get_persistent_memories():
+    # 进程内单例，首次调用时按配置打开 memory_dir 下的各个集合
+    global _persistent_memories
+    with _persistent_lock:
+        if _persistent_memories is None:
+            config = get_user_config()
+            memory_dir = config.get("memory_dir", "./memory_store")
+            os.makedirs(memory_dir, exist_ok=True)
+            # 所有集合共享同一个嵌入后端
+            embedder = create_embedding_backend(config)
+            _persistent_memories = {
+                key: FinancialSituationMemory(f"{key}_memory", embedder, persist_dir=memory_dir)
+                for key in MEMORY_KEYS
+            }
+        return _persistent_memories
+
+
+def maintain_memories(memories, config=None):
+    # 对一组记忆（名称 -> FinancialSituationMemory）逐个执行维护，参数取自配置
+    config = config or get_user_config()
+    reports = {}
+    for key, memory in memories.items():
+        try:
+            reports[key] = memory.maintain(
+                similarity_threshold=float(config.get("memory_dedupe_threshold", 0.95)),
+                max_size=config.get("memory_max_size"),
+                max_age_days=config.get("memory_max_age_days"),
+            )
+        except Exception as e:
+            reports[key] = {"error": str(e)}
+        print(f"[Memory] 维护 {key}: {reports[key]}")
+    return reports
+
+
+def schedule_memory_maintenance(interval_hours):
+    """启动后台线程：每隔 interval_hours 小时维护一次全部持久化记忆（未超出容量上限的集合也会去重 / 淘汰 / 重建）。"""
+    def _loop():
+        while True:
+            time.sleep(float(interval_hours) * 3600)
+            try:
+                maintain_memories(get_persistent_memories())
+            except Exception as e:
+                print(f"[Memory] 定期维护失败: {e}")
+
+    threading.Thread(target=_loop, name="memory-maintenance", daemon=True).start()
@@ -0,0 +1,290 @@
+# backend/metrics.py
+# Prometheus 文本格式的指标（/metrics），不依赖 prometheus_client。
+# - Counter / Gauge / Histogram 按标签值分组，写入只是一次加锁的字典更新，可以放在热路径上
+# - 队列深度、缓存命中、存储大小等已有统计不重复埋点，由 add_collector 注册的回调在抓取时读取
+# - worker_pool_mode 为 process 时，子进程在每个作业结束时取出（drain）本进程累计的计数器与直方图，
+#   随作业结果返回，由主进程合并（merge）到 /metrics；子进程后台线程的指标在其下一个作业结束时汇总
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 秒级延迟分桶：单次 LLM / 工具调用、图节点
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# 任务阶段分桶：排队等待、主工作流、后处理各阶段
+PHASE_BUCKETS = (0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+    def merge(self, items) -> None:
+        with self._lock:
+            for key, value in items:
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # 每个分桶的计数（最后一个为 +Inf）、总和、总数
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def merge(self, items) -> None:
+        with self._lock:
+            for key, (counts, total, count) in items:
+                entry = self._values.get(key)
+                if entry is None or len(entry[0]) != len(counts):
+                    entry = self._values[key] = [[0] * len(counts), 0.0, 0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+        out = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                out.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, le), cumulative))
+            out.append((f"{self.name}_sum", _format_labels(self.labelnames, key), total))
+            out.append((f"{self.name}_count", _format_labels(self.labelnames, key), count))
+        return out
+
+
+# 抓取时回调返回的一组样本：(指标名, 类型, 说明, [(标签字典, 值), ...])
+CollectedMetric = Tuple[str, str, str, Iterable[Tuple[Dict[str, object], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[CollectedMetric]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def drain(self) -> Dict[str, list]:
+        """取出并清零全部计数器与直方图（进程工作池的子进程调用），返回值可序列化，交给主进程 merge。"""
+        with self._lock:
+            metrics = [m for m in self._metrics.values() if isinstance(m, (Counter, Histogram))]
+        snapshot = {}
+        for metric in metrics:
+            with metric._lock:
+                values, metric._values = metric._values, {}
+            if values:
+                snapshot[metric.name] = list(values.items())
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, list]) -> None:
+        """合并其他进程 drain 出的指标。"""
+        for name, items in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is not None and hasattr(metric, "merge"):
+                metric.merge(items)
+
+    def add_collector(self, fn: Callable[[], Iterable[CollectedMetric]]) -> None:
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        """Prometheus 文本格式（text/plain; version=0.0.4）。"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                print(f"[Metrics] 指标回调失败: {e}")
+                continue
+            for name, kind, help, samples in collected:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_str = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_str} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+# ---------------- 任务与流水线指标 ----------------
+TASK_PHASE_SECONDS = histogram("trading_task_phase_seconds", "分析任务各阶段耗时（秒）", ["phase"], PHASE_BUCKETS)
+TASKS_FINISHED = counter("trading_tasks_finished_total", "结束的分析任务数", ["status"])
+QUEUE_WAIT_SECONDS = histogram("trading_queue_wait_seconds", "作业在调度队列中的等待时间（秒）", ["lane"], PHASE_BUCKETS)
+NODE_SECONDS = histogram("trading_graph_node_seconds", "图节点单次执行耗时（秒）", ["node"])
+NODE_ERRORS = counter("trading_graph_node_errors_total", "图节点执行异常次数", ["node"])
+LLM_CALLS = counter("trading_llm_calls_total", "LLM 调用次数", ["model"])
+LLM_ERRORS = counter("trading_llm_errors_total", "LLM 调用失败次数", ["model"])
+LLM_SECONDS = histogram("trading_llm_call_seconds", "LLM 单次调用耗时（秒）", ["model"])
+LLM_TOKENS = counter("trading_llm_tokens_total", "LLM 消耗的 token 数", ["model", "kind"])
+TOOL_CALLS = counter("trading_tool_calls_total", "数据工具调用次数", ["tool"])
+TOOL_ERRORS = counter("trading_tool_errors_total", "数据工具调用失败次数", ["tool"])
+TOOL_SECONDS = histogram("trading_tool_call_seconds", "数据工具单次调用耗时（秒）", ["tool"])
+SIGNAL_EXTRACTIONS = counter("trading_signal_extractions_total", "信号提取次数（method=rule 为规则命中，llm 为回退）",
+                             ["method", "rule"])
+DEADLINE_TASKS = counter("trading_deadline_tasks_total", "截止时间模式的任务数（met=true 为按时给出信号）", ["met"])
+DEADLINE_DEGRADATIONS = counter("trading_deadline_degradations_total", "截止时间模式下采取的降级次数", ["step"])
+STREAM_CONNECTIONS = gauge("trading_stream_connections", "当前的推送连接数", ["transport"])
+
+
+class PhaseTimer:
+    """按检查点记录任务阶段耗时：mark(phase) 记录上一个检查点到现在的耗时"""
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, phase: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        TASK_PHASE_SECONDS.observe(elapsed, phase=phase)
+        return elapsed
+
+    def finish(self, status: str) -> None:
+        TASK_PHASE_SECONDS.observe(time.perf_counter() - self.started, phase="total")
+        TASKS_FINISHED.inc(status=status)
+
+
+def timed_node(name: str, fn: Callable) -> Callable:
+    """包装图节点函数，记录每次执行耗时与异常。"""
+    def node(state):
+        started = time.perf_counter()
+        try:
+            return fn(state)
+        except Exception:
+            NODE_ERRORS.inc(node=name)
+            raise
+        finally:
+            NODE_SECONDS.observe(time.perf_counter() - started, node=name)
+    node.__name__ = getattr(fn, "__name__", name.replace(" ", "_"))
+    return node
+
+
+def observe_tool(tool: str, seconds: float, error: bool) -> None:
+    TOOL_CALLS.inc(tool=tool)
+    TOOL_SECONDS.observe(seconds, tool=tool)
+    if error:
+        TOOL_ERRORS.inc(tool=tool)
+
+
+def observe_llm(model: str, seconds: Optional[float], error: bool = False,
+                prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+    LLM_CALLS.inc(model=model)
+    if seconds is not None:
+        LLM_SECONDS.observe(seconds, model=model)
+    if error:
+        LLM_ERRORS.inc(model=model)
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
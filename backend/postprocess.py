@@ -0,0 +1,271 @@
+# backend/postprocess.py
+# 主工作流之后的评估阶段：按依赖关系组成小型 DAG，互不依赖的阶段并发执行，每个阶段有独立超时。
+#
+#   ground_truth ─┐
+#   llm_judge ────┼─> 各自完成即写入任务日志与结果库
+#   indicators ──> audit
+#
+# - 信号提取仍在任务线程内完成（关键路径），任务随后即标记 completed；评估在后台执行，完成一项附加一项
+# - 阶段在共享线程池中执行（postprocess_workers），超时从阶段在工作线程中开始执行时计时（排队时间不计）；超时的阶段结果被丢弃，
+#   依赖它的阶段标记为 skipped（线程无法强行中断，已发出的请求会在后台自然结束）
+# - 阶段函数只返回结果，日志与结果库写入统一由驱动线程完成，同一任务仍只有一个写入者
+# - 全部阶段结束后（无论成败）写入 postprocess 事件，任务的推送流与长轮询随之结束
+# - 审计数据与真实市场验证经本任务的 ToolResultRegistry（tools.py）读取行情，两个阶段共用已取得的日期区间，只下载缺失部分
+# - 在任务的 trace 中记录为 "evaluation" span，各阶段为其子 span（阶段在线程池中执行，父 span 显式传入）
+
+import json
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
+
+from .agents import deep_thinking_llm
+from .config_user import get_user_config
+from .evaluation import auditor_chain, evaluate_ground_truth, evaluator_chain
+from .metrics import TASK_PHASE_SECONDS
+from .results import result_store
+from .storage import append_log, finish_postprocess
+from .tracing import tracer
+
+# 各阶段默认超时（秒），可被配置 postprocess_timeouts 覆盖
+DEFAULT_TIMEOUTS = {"ground_truth": 30, "llm_judge": 120, "indicators": 30, "audit": 120}
+# 有阶段仍在线程池中排队时，检查其是否已开始执行（开始后才有超时时刻）的间隔（秒）
+QUEUED_POLL_SECONDS = 0.5
+
+
+class Stage:
+    """DAG 中的一个阶段：fn 以依赖阶段的结果（按 deps 顺序）为参数"""
+
+    def __init__(self, name: str, fn: Callable, deps: Sequence[str] = (), timeout: Optional[float] = None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+
+
+def _timed(fn: Callable, started: dict) -> Callable:
+    # 在工作线程中记录阶段实际开始执行的时刻
+    def run(*args):
+        started["at"] = time.monotonic()
+        return fn(*args)
+    return run
+
+
+def run_stages(stages: Iterable[Stage], executor, on_done: Optional[Callable[[str, dict], None]] = None) -> Dict[str, dict]:
+    """
+    按依赖关系执行各阶段，依赖都成功的阶段立即提交，互不依赖的阶段并发执行。
+    返回 {name: {"status": ok | error | timeout | skipped, "result" | "error", "seconds"}}；
+    每个阶段结束时（含失败 / 超时 / 跳过）调用 on_done(name, outcome)。
+    """
+    pending = {s.name: s for s in stages}
+    for stage in pending.values():
+        unknown = [d for d in stage.deps if d not in pending]
+        if unknown:
+            raise ValueError(f"阶段 {stage.name} 依赖未知阶段: {unknown}")
+    results: Dict[str, dict] = {}
+    running = {}
+
+    def finish(name, outcome):
+        results[name] = outcome
+        if on_done is not None:
+            try:
+                on_done(name, outcome)
+            except Exception as e:
+                print(f"[PostProcess] 处理阶段 {name} 结果失败: {e}")
+
+    while pending or running:
+        progressed = True
+        while progressed:
+            progressed = False
+            for name, stage in list(pending.items()):
+                deps = [results.get(d) for d in stage.deps]
+                if any(d is None for d in deps):
+                    continue
+                del pending[name]
+                progressed = True
+                if any(d["status"] != "ok" for d in deps):
+                    failed = [n for n, d in zip(stage.deps, deps) if d["status"] != "ok"]
+                    finish(name, {"status": "skipped", "error": f"依赖阶段未成功: {', '.join(failed)}", "seconds": 0.0})
+                    continue
+                started = {}
+                future = executor.submit(_timed(stage.fn, started), *[d["result"] for d in deps])
+                running[future] = (stage, started)
+        if not running:
+            continue
+
+        # 超时只对已开始执行的阶段计时；仍在排队的阶段定期检查是否已开始
+        deadlines = [started["at"] + stage.timeout for stage, started in running.values()
+                     if stage.timeout and "at" in started]
+        if any(stage.timeout and "at" not in started for stage, started in running.values()):
+            deadlines.append(time.monotonic() + QUEUED_POLL_SECONDS)
+        timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for future in list(running):
+            stage, started = running[future]
+            elapsed = now - started.get("at", now)
+            if future in done:
+                del running[future]
+                try:
+                    outcome = {"status": "ok", "result": future.result()}
+                except Exception as e:
+                    outcome = {"status": "error", "error": str(e)}
+                outcome["seconds"] = elapsed
+                finish(stage.name, outcome)
+            elif stage.timeout and "at" in started and elapsed >= stage.timeout:
+                del running[future]
+                finish(stage.name, {"status": "timeout", "error": f"超过 {stage.timeout:g}s", "seconds": elapsed})
+    return results
+
+
+def _parse_json(raw: str) -> dict:
+    m = re.search(r"\{.*\}", raw, re.S)
+    return json.loads(m.group(0) if m else raw)
+
+
+def _structured_or_fallback(chain, inputs: dict, fallback_prompt: str) -> dict:
+    # 部分模型提供商不支持 structured response_format，回退为普通提示 + 解析 JSON
+    try:
+        return chain.invoke(inputs).dict()
+    except Exception as e:
+        err_str = str(e)
+        if "response_format type is unavailable" in err_str or "invalid_request_error" in err_str:
+            result = _parse_json(deep_thinking_llm.invoke(fallback_prompt).content)
+            result["fallback"] = True
+            return result
+        raise
+
+
+def build_evaluation_stages(ticker: str, trade_date: str, signal: str, final_state: dict, toolkit,
+                            timeouts: Optional[Dict[str, float]] = None) -> list:
+    timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+    reports_summary = (
+        f"市场报告: {final_state.get('market_report', '')[:500]}...\n"
+        f"情绪报告: {final_state.get('sentiment_report', '')[:500]}...\n"
+        f"新闻报告: {final_state.get('news_report', '')[:500]}...\n"
+        f"基本面报告: {final_state.get('fundamentals_report', '')[:500]}..."
+    )
+    decision = final_state.get('final_trade_decision', '')
+    market_report = final_state.get('market_report', '')
+
+    # 行情经本任务的登记表读取：其他阶段已取得的日期区间直接复用，只下载缺失的区间
+    def ground_truth():
+        with toolkit.results.active():
+            return evaluate_ground_truth(ticker, trade_date, signal)
+
+    def llm_judge():
+        return _structured_or_fallback(
+            evaluator_chain,
+            {"reports": reports_summary, "final_decision": decision},
+            "请根据报告评估最终交易决策。"
+            "返回一个 JSON 对象, 其键包括: reasoning_quality(1-10), evidence_based_score(1-10)。"
+            "actionability_score(1-10), justification (字符串).\n\n"
+            f"报告:\n{reports_summary}\n\n最终决策:\n{decision}")
+
+    def indicators():
+        # 事实一致性审计的原始数据：交易日前 60 天的技术指标
+        start_date_audit = (datetime.strptime(trade_date, "%Y-%m-%d") - timedelta(days=60)).strftime('%Y-%m-%d')
+        with toolkit.results.active():
+            raw_data = toolkit.get_technical_indicators.func(ticker, start_date_audit, trade_date)
+        if raw_data.startswith(("Error", "No data")):
+            raise RuntimeError(raw_data)
+        return raw_data
+
+    def audit(raw_data):
+        return _structured_or_fallback(
+            auditor_chain,
+            {"raw_data": raw_data, "agent_report": market_report},
+            "请根据原始数据审核市场报告。返回一个包含键的 JSON 对象。: is_consistent (bool), discrepancies (list), justification (string).\n\n"
+            f"原始数据:\n{raw_data}\n\n智能体报告:\n{market_report}")
+
+    return [
+        Stage("ground_truth", ground_truth, timeout=timeouts["ground_truth"]),
+        Stage("llm_judge", llm_judge, timeout=timeouts["llm_judge"]),
+        Stage("indicators", indicators, timeout=timeouts["indicators"]),
+        Stage("audit", audit, deps=("indicators",), timeout=timeouts["audit"]),
+    ]
+
+
+def _log_outcome(task_id: str, name: str, outcome: dict) -> None:
+    status = outcome["status"]
+    if name == "ground_truth":
+        if status == "ok":
+            append_log(task_id, "真实市场验证：")
+            append_log(task_id, outcome["result"])
+        else:
+            append_log(task_id, f"真实市场验证失败（{status}）: {outcome['error']}")
+    elif name == "llm_judge":
+        if status == "ok":
+            js = outcome["result"]
+            if js.get("fallback"):
+                append_log(task_id, f"LLM评估回退结果: \n 逻辑性和连贯性评分: {js['reasoning_quality']} \n 证据依据评分: {js['evidence_based_score']} \n 可操作性评分: {js['actionability_score']} \n 评估说明: {js['justification']}")
+            else:
+                append_log(task_id, "LLM-as-a-Judge 评估：")
+                append_log(task_id, str(js))
+        else:
+            append_log(task_id, f"LLM评估失败（{status}）: {outcome['error']}")
+    elif name == "audit":
+        if status == "ok":
+            js = outcome["result"]
+            if js.get("fallback"):
+                append_log(task_id, f"审计回退结果: \n 一致性: {js['is_consistent']} \n 差异点: {js['discrepancies']} \n 审计说明: {js['justification']}")
+            else:
+                append_log(task_id, "事实一致性审计：")
+                append_log(task_id, str(js))
+        else:
+            append_log(task_id, f"审计失败（{status}）: {outcome['error']}")
+    elif status != "ok":
+        append_log(task_id, f"审计数据获取失败（{status}）: {outcome['error']}")
+
+
+class PostProcessor:
+    """后台评估：每个任务一个驱动线程，阶段在共享线程池中执行"""
+
+    def __init__(self, max_workers: int = 4, timeouts: Optional[Dict[str, float]] = None):
+        self.timeouts = timeouts or {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="postprocess")
+
+    def submit(self, task_id: str, ticker: str, trade_date: str, signal: str, final_state: dict, toolkit) -> threading.Thread:
+        stages = build_evaluation_stages(ticker, trade_date, signal, final_state, toolkit, self.timeouts)
+        # 在调用方（任务线程）的当前 trace 下开始，任务根 span 结束后 trace 仍等待评估完成再导出
+        span = tracer.start_span("evaluation", span_type="phase")
+        for stage in stages:
+            stage.fn = tracer.wrap(stage.name, stage.fn, parent=span, span_type="stage")
+        driver = threading.Thread(target=self._drive, args=(task_id, stages, span), name=f"postprocess-{task_id[:8]}", daemon=True)
+        driver.start()
+        return driver
+
+    def _drive(self, task_id: str, stages, span=None) -> None:
+        started = time.perf_counter()
+
+        def on_done(name, outcome):
+            TASK_PHASE_SECONDS.observe(outcome["seconds"], phase=name)
+            if span is not None:
+                span.set_attribute(f"stage.{name}", outcome["status"])
+            _log_outcome(task_id, name, outcome)
+            if name == "indicators" and outcome["status"] == "ok":
+                return  # 原始数据只供审计使用，不写入结果库
+            value = outcome["result"] if outcome["status"] == "ok" else {"status": outcome["status"], "error": outcome["error"]}
+            result_store.attach_evaluation(task_id, name, value)
+
+        try:
+            results = run_stages(stages, self._executor, on_done)
+            summary = ", ".join(f"{name}: {r['status']}" for name, r in results.items())
+            append_log(task_id, f"📊 多维度评估完成（{summary}），用时 {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            append_log(task_id, f"多维度评估失败: {e}")
+            if span is not None:
+                span.record_error(e)
+        finally:
+            finish_postprocess(task_id, "done")
+        TASK_PHASE_SECONDS.observe(time.perf_counter() - started, phase="evaluation")
+        if span is not None:
+            span.end()
+
+
+# 全局后处理器
+_config = get_user_config()
+postprocessor = PostProcessor(max_workers=_config.get("postprocess_workers", 4),
+                              timeouts=_config.get("postprocess_timeouts"))
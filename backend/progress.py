@@ -0,0 +1,201 @@
+# backend/progress.py
+# 基于图拓扑的进度与 ETA：
+# - 执行计划由图结构与配置推出：4 个分析师 → 多空辩论 2 × max_debate_rounds 次 → 研究主管 → 交易员
+#   → 风控讨论 3 × max_risk_discuss_rounds 次 → 投资组合经理，前后加上初始化（setup）与信号提取 / 保存（finalize）
+# - 每个节点的预期耗时来自历史执行的滑动平均（NodeLatencyModel，保存在结果库文件中，重启与多 worker 共享），
+#   没有历史时使用默认值
+# - 进度 = 已完成节点的预期耗时 / 全部预期耗时；ETA = 剩余节点的预期耗时 × 本任务的实际快慢比例
+# - 路由节点（next_analyst）不计；工具节点与超出计划的节点只记录耗时，不推进进度
+# - 未开始的任务按整个计划的预期耗时估算（estimate_seconds），供批量调度与 /start 响应使用
+# - 截止时间模式降级后（deadline.py）按新计划修正剩余节点（ProgressTracker.replan）
+
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config_user import get_user_config
+
+SETUP = "setup"
+FINALIZE = "finalize"
+ANALYSTS = ("Market Analyst", "Social Analyst", "News Analyst", "Fundamentals Analyst")
+ROUTING_NODES = ("next_analyst",)
+
+# 没有历史数据时各节点的预期耗时（秒）：快速模型的单次调用约 10~20s，深度模型约 30s
+DEFAULT_SECONDS = {
+    SETUP: 2.0,
+    "Market Analyst": 15.0,
+    "Social Analyst": 15.0,
+    "News Analyst": 15.0,
+    "Fundamentals Analyst": 15.0,
+    "tools": 3.0,
+    "Bull Researcher": 12.0,
+    "Bear Researcher": 12.0,
+    "Research Manager": 30.0,
+    "Trader": 12.0,
+    "Risky Analyst": 12.0,
+    "Safe Analyst": 12.0,
+    "Neutral Analyst": 12.0,
+    "Risk Judge": 30.0,
+    FINALIZE: 3.0,
+}
+DEFAULT_NODE_SECONDS = 10.0
+
+# 本任务实际耗时 / 预期耗时之比的先验权重与取值范围，避免单个异常节点让 ETA 剧烈波动
+PACE_PRIOR = 0.2
+PACE_BOUNDS = (0.5, 3.0)
+
+
+def build_plan(config: Optional[dict] = None) -> List[str]:
+    """按配置推出一次分析依次执行的节点（含 setup / finalize）。"""
+    config = config or get_user_config()
+    debate_rounds = int(config.get("max_debate_rounds", 2))
+    risk_rounds = int(config.get("max_risk_discuss_rounds", 1))
+    plan = [SETUP, *ANALYSTS]
+    # 多头研究员至少发言一次（next_analyst 之后固定进入），此后按计数交替
+    debate = ["Bull Researcher", "Bear Researcher"] * max(debate_rounds, 1)
+    plan += debate[:max(2 * debate_rounds, 1)]
+    plan += ["Research Manager", "Trader"]
+    # 截止时间模式跳过风控讨论时，交易员之后直接进入投资组合经理
+    if not config.get("skip_risk_debate"):
+        risk = ["Risky Analyst", "Safe Analyst", "Neutral Analyst"] * max(risk_rounds, 1)
+        plan += risk[:max(3 * risk_rounds, 1)]
+    plan += ["Risk Judge", FINALIZE]
+    return plan
+
+
+class NodeLatencyModel:
+    """各节点单次执行耗时的指数滑动平均（SQLite，WAL 模式，多 worker 进程可共享同一个数据库文件）"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS node_latency (
+        node         TEXT PRIMARY KEY,
+        mean_seconds REAL NOT NULL,
+        samples      INTEGER NOT NULL,
+        updated_at   REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str = "./results/analysis_results.db", alpha: float = 0.2):
+        self.path = path
+        self.alpha = alpha
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 每个线程一个连接（sqlite3 连接不宜跨线程共享）
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+        self._means: Dict[str, Tuple[float, int]] = {}
+        self._reload()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _reload(self) -> None:
+        rows = self._conn().execute("SELECT node, mean_seconds, samples FROM node_latency").fetchall()
+        self._means = {r["node"]: (r["mean_seconds"], r["samples"]) for r in rows}
+
+    def expected(self, node: str) -> float:
+        entry = self._means.get(node)
+        if entry is not None:
+            return entry[0]
+        return DEFAULT_SECONDS.get(node, DEFAULT_NODE_SECONDS)
+
+    def record(self, observations: Iterable[Tuple[str, float]]) -> None:
+        """写入一批 (节点, 耗时)；样本较少时按累计平均，之后按 alpha 滑动。"""
+        observations = [(node, float(seconds)) for node, seconds in observations
+                        if node not in ROUTING_NODES and seconds >= 0]
+        if not observations:
+            return
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO node_latency (node, mean_seconds, samples, updated_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (node) DO UPDATE SET "
+                "mean_seconds = mean_seconds + MAX(?, 1.0 / (samples + 1)) * (excluded.mean_seconds - mean_seconds), "
+                "samples = samples + 1, updated_at = excluded.updated_at",
+                [(node, seconds, now, self.alpha) for node, seconds in observations])
+        self._reload()
+
+    def estimate(self, plan: Iterable[str]) -> float:
+        return sum(self.expected(node) for node in plan)
+
+    def stats(self) -> Dict[str, dict]:
+        means = dict(self._means)
+        return {node: {"mean_seconds": round(mean, 2), "samples": samples} for node, (mean, samples) in means.items()}
+
+
+class ProgressTracker:
+    """单个任务的进度：按计划节点的预期耗时加权，预期耗时在任务开始时取快照"""
+
+    def __init__(self, plan: List[str], model: Optional[NodeLatencyModel] = None):
+        self.model = model or latency_model
+        self.expected = {node: self.model.expected(node) for node in set(plan)}
+        self.total = sum(self.expected[node] for node in plan) or 1.0
+        self.remaining = Counter(plan)
+        self.done: Counter = Counter()
+        self.done_expected = 0.0
+        self.done_actual = 0.0
+        self.observations: List[Tuple[str, float]] = []
+
+    def advance(self, node: str, seconds: float) -> Tuple[float, float]:
+        """节点 node 执行完成（耗时 seconds），返回 (进度 0~1, 预计剩余秒数)。"""
+        if node not in ROUTING_NODES:
+            self.observations.append((node, seconds))
+            if self.remaining[node] > 0:
+                self.remaining[node] -= 1
+                self.done[node] += 1
+                self.done_expected += self.expected[node]
+                self.done_actual += seconds
+        return self.progress, self.eta_seconds
+
+    def replan(self, plan: List[str], expected: Optional[Dict[str, float]] = None) -> None:
+        """执行中修改计划：已完成的节点保留，剩余节点按新计划重算，expected 覆盖部分节点的预期耗时。"""
+        for node in set(plan) - set(self.expected):
+            self.expected[node] = self.model.expected(node)
+        self.expected.update(expected or {})
+        self.remaining = Counter(plan) - self.done
+        self.total = self.done_expected + sum(self.expected[node] * count for node, count in self.remaining.items()) or 1.0
+
+    @property
+    def progress(self) -> float:
+        return min(self.done_expected / self.total, 1.0)
+
+    @property
+    def pace(self) -> float:
+        # 实际 / 预期耗时之比，向 1.0 收缩（先验权重为计划总量的 PACE_PRIOR），前几个节点不至于让 ETA 大起大落
+        prior = self.total * PACE_PRIOR
+        low, high = PACE_BOUNDS
+        return min(max((self.done_actual + prior) / (self.done_expected + prior), low), high)
+
+    @property
+    def eta_seconds(self) -> float:
+        remaining = sum(self.expected[node] * count for node, count in self.remaining.items() if count > 0)
+        return remaining * self.pace
+
+    def flush(self) -> None:
+        """把本任务的节点耗时写入历史（任务结束时调用一次）。"""
+        observations, self.observations = self.observations, []
+        try:
+            self.model.record(observations)
+        except Exception as e:
+            print(f"[Progress] 记录节点耗时失败: {e}")
+
+
+def estimate_seconds(config: Optional[dict] = None) -> float:
+    """尚未开始的任务预计总耗时（秒）。"""
+    return latency_model.estimate(build_plan(config))
+
+
+# 全局节点耗时模型：与结果库共用同一个数据库文件
+latency_model = NodeLatencyModel(get_user_config().get("result_db_path", "./results/analysis_results.db"))
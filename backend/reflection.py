@@ -0,0 +1,254 @@
+# 后台反思队列：任务完成后异步执行反思学习，并写入跨任务共享的持久化记忆。
+# - 任务完成不等待反思（一次 LLM 调用 + 一次嵌入 / 每个智能体）
+# - 使用真实市场的实际收益（Ground Truth）作为反思依据；收益尚不可得时延迟重试
+# - 跨任务凑批：同一批次内每个记忆集合只做一次批量写入（批量嵌入）
+# - 未完成的反思任务（只含反思所需的状态字段）保存在结果库中，写入记忆或放弃后删除；
+#   进程重启后由 restore() 恢复，等待实际收益的任务不会因重启丢失
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .agents import quick_thinking_llm
+from .config_user import get_user_config
+from .evaluation import Reflector, compute_realized_return
+from .memory import get_persistent_memories, maintain_memories
+from .results import REPORT_FIELDS, result_store
+from .storage import append_log
+from .tools import get_sector
+
+
+def _as_text(value):
+    # 辩论历史在状态中可能是字符串或字符串列表
+    if isinstance(value, list):
+        return "\n".join(getattr(v, "content", str(v)) for v in value)
+    return value or ""
+
+
+# 每个记忆集合对应的反思素材
+COMPONENT_KEY_FUNCS = {
+    "bull": lambda state: _as_text(state.get('investment_debate_state', {}).get('bull_history', '')),
+    "bear": lambda state: _as_text(state.get('investment_debate_state', {}).get('bear_history', '')),
+    "trader": lambda state: state.get('trader_investment_plan', ''),
+    "invest_judge": lambda state: state.get('investment_plan', ''),
+    "risk_manager": lambda state: state.get('final_trade_decision', ''),
+}
+
+
+def _reflection_state(final_state):
+    # 反思只用到各报告、多空辩论历史与各决策文本（COMPONENT_KEY_FUNCS / Reflector），其余状态不保留
+    state = {k: final_state.get(k) or "" for k in REPORT_FIELDS}
+    debate = final_state.get('investment_debate_state') or {}
+    state['investment_debate_state'] = {k: _as_text(debate.get(k, '')) for k in ('bull_history', 'bear_history')}
+    return state
+
+
+def describe_returns(signal, realized):
+    # 将实际涨跌幅转换为按信号方向计算的盈亏描述
+    performance = realized["performance"]
+    if signal == "BUY":
+        pnl = performance
+    elif signal == "SELL":
+        pnl = -performance
+    else:
+        # HOLD：波动越小越好，超出 ±1% 视为错失或承担了波动
+        pnl = 1.0 - abs(performance)
+    outcome = "盈利" if pnl > 0 else "亏损"
+    return (
+        f"信号 {signal}；{realized['entry_date']} 开盘 ${realized['open_price']:.2f} → "
+        f"{realized['exit_date']} 收盘 ${realized['close_price']:.2f}，"
+        f"5 个交易日实际涨跌 {performance:+.2f}%，按信号方向{outcome} {pnl:+.2f}%"
+    )
+
+
+class ReflectionQueue:
+    """反思任务队列（进程内单例，后台线程消费）"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # 等待实际收益的任务：[(not_before, job)]
+        self._deferred = []
+
+    def submit(self, task_id, ticker, trade_date, signal, final_state):
+        job = {
+            "task_id": task_id,
+            "ticker": ticker,
+            "trade_date": trade_date,
+            "signal": signal,
+            "state": _reflection_state(final_state),
+            "submitted_at": time.time(),
+        }
+        self._persist(job, job["submitted_at"])
+        self._queue.put(job)
+        self._ensure_worker()
+
+    def restore(self):
+        """进程启动时恢复结果库中未完成的反思任务，按各自的重试时间执行。"""
+        try:
+            jobs = result_store.pending_reflections()
+        except Exception as e:
+            print(f"[Reflection] 读取未完成的反思任务失败: {e}")
+            return 0
+        if not jobs:
+            return 0
+        with self._lock:
+            known = {job["task_id"] for _, job in self._deferred}
+            for job in jobs:
+                if job["task_id"] not in known:
+                    self._deferred.append((job.pop("not_before"), job))
+        print(f"[Reflection] 恢复 {len(jobs)} 个未完成的反思任务")
+        self._ensure_worker()
+        return len(jobs)
+
+    def _persist(self, job, not_before):
+        # 持久化失败不影响本进程内的反思，只是重启后无法恢复
+        try:
+            result_store.save_reflection(job, not_before)
+        except Exception as e:
+            print(f"[Reflection] 保存反思任务 {job['task_id']} 失败: {e}")
+
+    def _forget(self, job):
+        try:
+            result_store.delete_reflection(job["task_id"])
+        except Exception as e:
+            print(f"[Reflection] 删除反思任务 {job['task_id']} 失败: {e}")
+
+    def pending(self):
+        return self._queue.qsize() + len(self._deferred)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="reflection-worker", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self, config):
+        # 阻塞等待第一个任务，再在凑批窗口内收集更多任务；到期的延迟任务也加入本批
+        batch_size = max(1, int(config.get("reflection_batch_size", 8)))
+        window = float(config.get("reflection_batch_window", 5.0))
+        now = time.time()
+        with self._lock:
+            batch = [job for not_before, job in self._deferred if not_before <= now]
+            self._deferred = [(nb, job) for nb, job in self._deferred if nb > now]
+            next_due = min((nb for nb, _ in self._deferred), default=now + 60)
+        if not batch:
+            # 有延迟任务时定期醒来检查
+            timeout = next_due - now
+            try:
+                batch.append(self._queue.get(timeout=max(1.0, timeout)))
+            except queue.Empty:
+                return []
+        deadline = time.time() + window
+        while len(batch) < batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            config = get_user_config()
+            batch = self._next_batch(config)
+            if not batch:
+                continue
+            try:
+                self._process_batch(batch, config)
+            except Exception as e:
+                print(f"[Reflection] 批处理失败: {e}")
+                for job in batch:
+                    append_log(job["task_id"], f"⚠️ 反思写入失败: {e}")
+
+    def _resolve_returns(self, job, config):
+        # 返回实际收益 dict；不可得时延迟重试或放弃，返回 None
+        try:
+            realized = compute_realized_return(job["ticker"], job["trade_date"])
+        except Exception as e:
+            realized = {"error": str(e)}
+        if "error" not in realized:
+            return realized
+
+        trade_day = datetime.strptime(job["trade_date"], "%Y-%m-%d")
+        max_wait_days = float(config.get("reflection_max_wait_days", 14))
+        if (datetime.now() - trade_day).days > max_wait_days:
+            append_log(job["task_id"], f"⚠️ 实际收益仍不可得，放弃反思: {realized['error']}")
+            self._forget(job)
+            return None
+        retry = float(config.get("reflection_retry_seconds", 21600))
+        not_before = time.time() + retry
+        self._persist(job, not_before)
+        with self._lock:
+            self._deferred.append((not_before, job))
+        append_log(job["task_id"], f"⏳ 实际收益尚不可得，{retry / 3600:.1f} 小时后重试反思")
+        return None
+
+    def _process_batch(self, batch, config):
+        ready = []
+        for job in batch:
+            realized = self._resolve_returns(job, config)
+            if realized is not None:
+                ready.append((job, realized))
+        if not ready:
+            return
+
+        memories = get_persistent_memories()
+        reflector = Reflector(quick_thinking_llm)
+        work = [
+            (job, key, describe_returns(job["signal"], realized))
+            for job, realized in ready
+            for key in COMPONENT_KEY_FUNCS
+            if key in memories
+        ]
+        # 结构化元数据：检索时按股票 / 行业 / 交易日预过滤
+        metadata = {
+            id(job): {
+                "ticker": job["ticker"],
+                "sector": get_sector(job["ticker"]),
+                "trade_date": job["trade_date"],
+                "signal": job["signal"],
+                "realized_return": round(realized["performance"], 4),
+            }
+            for job, realized in ready
+        }
+
+        def _reflect(item):
+            job, key, returns_losses = item
+            return reflector.build_reflection(job["state"], returns_losses, COMPONENT_KEY_FUNCS[key])
+
+        # LLM 反思并发执行；失败的单项跳过
+        per_memory = {key: ([], []) for key in memories}
+        with ThreadPoolExecutor(max_workers=min(8, len(work))) as pool:
+            futures = [(item, pool.submit(_reflect, item)) for item in work]
+            for (job, key, _), future in futures:
+                try:
+                    per_memory[key][0].append(future.result())
+                    per_memory[key][1].append(metadata[id(job)])
+                except Exception as e:
+                    append_log(job["task_id"], f"⚠️ {key} 反思失败: {e}")
+
+        # 每个集合一次批量写入
+        for key, (items, metas) in per_memory.items():
+            if items:
+                memories[key].add_situations(items, metas)
+
+        for job, realized in ready:
+            self._forget(job)
+            append_log(job["task_id"], f"🧠 反思已写入长期记忆（{describe_returns(job['signal'], realized)}）")
+
+        # 超出容量上限的集合立即执行维护（去重 + 淘汰 + 紧凑重建）；未超限的集合由定期维护或 POST /memory/maintain 处理
+        max_size = config.get("memory_max_size")
+        if max_size is not None:
+            oversized = {k: m for k, m in memories.items() if m.store.count() > int(max_size)}
+            if oversized:
+                maintain_memories(oversized, config)
+
+
+# 全局反思队列
+reflection_queue = ReflectionQueue()
@@ -0,0 +1,151 @@
+# backend/results.py
+# 分析结果库：按 (股票, 交易日, 配置指纹) 保存已完成分析的信号、最终决策、各报告与评估结果。
+# - 信号确定、任务完成时写入；评估结果（真实市场验证 / LLM 评估 / 审计）在后台完成后逐项附加
+# - 与任务存储相互独立，任务被淘汰 / 进程重启后仍可按股票和交易日查询
+# - (ticker, trade_date, completed_at) 上有索引，查询为单次索引查找，毫秒级返回
+# - 同一股票、交易日、配置重复分析时保留最新一次（主键覆盖），不同配置的结果并存
+# - 同时保存尚未完成的反思任务（pending_reflections），进程重启后反思队列从这里恢复
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .config_user import get_user_config
+
+# 作为报告保存的最终状态字段
+REPORT_FIELDS = (
+    "market_report",
+    "sentiment_report",
+    "news_report",
+    "fundamentals_report",
+    "investment_plan",
+    "trader_investment_plan",
+    "final_trade_decision",
+)
+
+
+class ResultStore:
+    """SQLite 结果库（WAL 模式，多 worker 进程可共享同一个数据库文件）"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_results (
+        ticker       TEXT NOT NULL,
+        trade_date   TEXT NOT NULL,
+        config_hash  TEXT NOT NULL,
+        task_id      TEXT NOT NULL,
+        signal       TEXT,
+        decision     TEXT,
+        reports      TEXT NOT NULL,
+        evaluation   TEXT NOT NULL,
+        completed_at REAL NOT NULL,
+        PRIMARY KEY (ticker, trade_date, config_hash)
+    );
+    CREATE INDEX IF NOT EXISTS idx_results_lookup ON analysis_results (ticker, trade_date, completed_at);
+    CREATE INDEX IF NOT EXISTS idx_results_task ON analysis_results (task_id);
+    CREATE TABLE IF NOT EXISTS pending_reflections (
+        task_id      TEXT PRIMARY KEY,
+        ticker       TEXT NOT NULL,
+        trade_date   TEXT NOT NULL,
+        signal       TEXT,
+        state        TEXT NOT NULL,
+        submitted_at REAL NOT NULL,
+        not_before   REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str = "./results/analysis_results.db"):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 每个线程一个连接（sqlite3 连接不宜跨线程共享）
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, ticker: str, trade_date: str, config_hash: str, task_id: str, signal: str,
+             final_state: Dict[str, Any], evaluation: Optional[Dict[str, Any]] = None) -> None:
+        reports = {k: final_state.get(k) for k in REPORT_FIELDS if final_state.get(k)}
+        self._conn().execute(
+            "INSERT OR REPLACE INTO analysis_results "
+            "(ticker, trade_date, config_hash, task_id, signal, decision, reports, evaluation, completed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (ticker.upper(), trade_date, config_hash, task_id, signal,
+             final_state.get("final_trade_decision", ""),
+             json.dumps(reports, ensure_ascii=False),
+             json.dumps(evaluation or {}, ensure_ascii=False, default=str),
+             time.time()),
+        )
+
+    def attach_evaluation(self, task_id: str, key: str, value: Any) -> bool:
+        """评估结果陆续到达时逐项附加到该任务的结果；结果不存在时返回 False。"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT rowid, evaluation FROM analysis_results WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return False
+            evaluation = json.loads(row["evaluation"])
+            evaluation[key] = value
+            conn.execute("UPDATE analysis_results SET evaluation = ? WHERE rowid = ?",
+                         (json.dumps(evaluation, ensure_ascii=False, default=str), row["rowid"]))
+        return True
+
+    def get(self, ticker: str, trade_date: str, config_hash: Optional[str] = None,
+            include_reports: bool = True) -> Optional[Dict[str, Any]]:
+        """最新的一条结果；config_hash 为 None 时不限配置。"""
+        columns = "ticker, trade_date, config_hash, task_id, signal, decision, evaluation, completed_at"
+        if include_reports:
+            columns += ", reports"
+        sql = f"SELECT {columns} FROM analysis_results WHERE ticker = ? AND trade_date = ?"
+        params = [ticker.upper(), trade_date]
+        if config_hash is not None:
+            sql += " AND config_hash = ?"
+            params.append(config_hash)
+        row = self._conn().execute(sql + " ORDER BY completed_at DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result["evaluation"] = json.loads(result["evaluation"])
+        if include_reports:
+            result["reports"] = json.loads(result["reports"])
+        return result
+
+    def save_reflection(self, job: Dict[str, Any], not_before: float) -> None:
+        """保存（或更新重试时间）一个尚未完成的反思任务；job 的 state 只含反思所需的字段。"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO pending_reflections "
+            "(task_id, ticker, trade_date, signal, state, submitted_at, not_before) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job["task_id"], job["ticker"], job["trade_date"], job["signal"],
+             json.dumps(job["state"], ensure_ascii=False, default=str), job["submitted_at"], not_before),
+        )
+
+    def pending_reflections(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT task_id, ticker, trade_date, signal, state, submitted_at, not_before "
+            "FROM pending_reflections ORDER BY not_before").fetchall()
+        return [{**dict(row), "state": json.loads(row["state"])} for row in rows]
+
+    def delete_reflection(self, task_id: str) -> None:
+        self._conn().execute("DELETE FROM pending_reflections WHERE task_id = ?", (task_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._conn().execute(
+            "SELECT COUNT(*) AS results, COUNT(DISTINCT ticker) AS tickers FROM analysis_results").fetchone()
+        pending = self._conn().execute("SELECT COUNT(*) FROM pending_reflections").fetchone()[0]
+        return {**dict(row), "pending_reflections": pending}
+
+
+# 全局结果库
+result_store = ResultStore(get_user_config().get("result_db_path", "./results/analysis_results.db"))
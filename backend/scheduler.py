@@ -0,0 +1,241 @@
+# backend/scheduler.py
+# 进程内作业调度：固定大小的工作池 + 有界优先级队列，替代 FastAPI BackgroundTasks。
+# - 两条优先级通道：interactive（前端提交，优先执行）与 batch（批量 / 脚本提交），各自有队列上限
+# - 队列满时拒绝提交（QueueFullError，API 返回 429），调度器关闭后拒绝提交（SchedulerClosedError，503）
+# - 统计各通道队列深度、排队等待时间、执行时间与拒绝次数
+# - worker_pool_mode 为 "process" 时作业在子进程中执行（需 Redis / SQLite 任务存储，进程内存储无法跨进程共享）：
+#   取消标记经任务存储传递（cancellation.py 按间隔查询），事件推送由 API 进程轮询存储发现（events.py），
+#   子进程的指标随作业结果返回并合并到本进程的 /metrics
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .config_user import get_user_config
+from .metrics import QUEUE_WAIT_SECONDS, REGISTRY
+
+# 通道按优先级排序：靠前的通道先被取出执行
+LANES = ("interactive", "batch")
+
+
+class QueueFullError(Exception):
+    """通道队列已满"""
+
+
+class SchedulerClosedError(Exception):
+    """调度器已关闭"""
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+
+def _run_in_child(fn: Callable, args: tuple):
+    # 在工作池子进程中执行作业，返回 (本进程累计的指标, 异常说明)；指标由主进程合并
+    error = None
+    try:
+        fn(*args)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return REGISTRY.drain(), error
+
+
+class JobScheduler:
+    """有界优先级作业队列 + 工作池"""
+
+    def __init__(self, max_workers: int = 2, queue_sizes: Optional[Dict[str, int]] = None, mode: str = "thread"):
+        self.max_workers = max(1, int(max_workers))
+        self.queue_sizes = {lane: None for lane in LANES}
+        self.queue_sizes.update(queue_sizes or {})
+        self.mode = mode
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, deque] = {lane: deque() for lane in LANES}
+        self._workers = []
+        self._running = 0
+        self._closed = False
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers) if mode == "process" else None
+        # 统计：各通道提交 / 拒绝数，最近的排队等待与执行耗时（秒）
+        self._submitted = {lane: 0 for lane in LANES}
+        self._rejected = {lane: 0 for lane in LANES}
+        self._completed = 0
+        self._failed = 0
+        self._waits = {lane: deque(maxlen=1000) for lane in LANES}
+        self._run_times = deque(maxlen=1000)
+
+    def can_accept(self, lane: str = "interactive") -> bool:
+        self._check_lane(lane)
+        with self._cond:
+            limit = self.queue_sizes.get(lane)
+            return not self._closed and (limit is None or len(self._lanes[lane]) < limit)
+
+    def capacity(self, lane: str = "interactive") -> Optional[int]:
+        """通道剩余可排队数；None 表示不限。"""
+        self._check_lane(lane)
+        with self._cond:
+            limit = self.queue_sizes.get(lane)
+            if self._closed:
+                return 0
+            return None if limit is None else max(0, limit - len(self._lanes[lane]))
+
+    def queued_ids(self):
+        with self._cond:
+            return {job["job_id"] for queue in self._lanes.values() for job in queue if job["job_id"]}
+
+    def submit(self, fn: Callable, *args: Any, lane: str = "interactive", job_id: Optional[str] = None) -> int:
+        """提交作业，返回提交时该通道前方排队的作业数。队列满时抛出 QueueFullError。"""
+        self._check_lane(lane)
+        with self._cond:
+            if self._closed:
+                raise SchedulerClosedError("调度器已关闭")
+            limit = self.queue_sizes.get(lane)
+            if limit is not None and len(self._lanes[lane]) >= limit:
+                self._rejected[lane] += 1
+                raise QueueFullError(f"{lane} 队列已满（{limit}）")
+            # 前方作业数：更高优先级通道的全部排队作业 + 本通道已排队作业
+            ahead = sum(len(self._lanes[l]) for l in LANES[:LANES.index(lane) + 1])
+            self._lanes[lane].append({
+                "fn": fn,
+                "args": args,
+                "job_id": job_id,
+                "lane": lane,
+                "enqueued_at": time.time(),
+            })
+            self._submitted[lane] += 1
+            self._ensure_workers()
+            self._cond.notify()
+        return ahead
+
+    def cancel(self, job_id: str) -> bool:
+        """从队列中移除尚未开始的作业；返回是否移除成功（已开始执行的作业需协作取消）。"""
+        with self._cond:
+            for queue in self._lanes.values():
+                for job in queue:
+                    if job["job_id"] == job_id:
+                        queue.remove(job)
+                        return True
+        return False
+
+    def _check_lane(self, lane):
+        if lane not in self._lanes:
+            raise ValueError(f"未知的优先级通道: {lane}（可选: {', '.join(LANES)}）")
+
+    def _ensure_workers(self):
+        # 调用方需持有 self._cond
+        self._workers = [t for t in self._workers if t.is_alive()]
+        while len(self._workers) < self.max_workers:
+            t = threading.Thread(target=self._run, name=f"job-worker-{len(self._workers)}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                for lane in LANES:
+                    if self._lanes[lane]:
+                        self._running += 1
+                        return self._lanes[lane].popleft()
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            started = time.time()
+            with self._cond:
+                self._waits[job["lane"]].append(started - job["enqueued_at"])
+            QUEUE_WAIT_SECONDS.observe(started - job["enqueued_at"], lane=job["lane"])
+            ok = True
+            try:
+                if self._pool is not None:
+                    snapshot, error = self._pool.submit(_run_in_child, job["fn"], job["args"]).result()
+                    REGISTRY.merge(snapshot)
+                    if error:
+                        raise RuntimeError(error)
+                else:
+                    job["fn"](*job["args"])
+            except Exception as e:
+                ok = False
+                print(f"[Scheduler] 作业 {job['job_id'] or job['fn'].__name__} 执行失败: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._run_times.append(time.time() - started)
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度、等待时间（秒）、执行时间与拒绝次数。"""
+        with self._cond:
+            now = time.time()
+            lanes = {}
+            for lane in LANES:
+                queued = self._lanes[lane]
+                waits = list(self._waits[lane])
+                lanes[lane] = {
+                    "queued": len(queued),
+                    "limit": self.queue_sizes.get(lane),
+                    "submitted": self._submitted[lane],
+                    "rejected": self._rejected[lane],
+                    "oldest_wait": now - queued[0]["enqueued_at"] if queued else 0.0,
+                    "wait_p50": _percentile(waits, 0.50),
+                    "wait_p95": _percentile(waits, 0.95),
+                }
+            run_times = list(self._run_times)
+            return {
+                "mode": self.mode,
+                "workers": self.max_workers,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "run_time_p50": _percentile(run_times, 0.50),
+                "run_time_p95": _percentile(run_times, 0.95),
+                "lanes": lanes,
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        """停止接收新作业；已排队的作业丢弃，正在执行的作业执行完毕。"""
+        with self._cond:
+            self._closed = True
+            dropped = {lane: len(q) for lane, q in self._lanes.items()}
+            for q in self._lanes.values():
+                q.clear()
+            self._cond.notify_all()
+            workers = list(self._workers)
+        if any(dropped.values()):
+            print(f"[Scheduler] 关闭时丢弃排队作业: {dropped}")
+        if wait:
+            for t in workers:
+                t.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+
+def create_scheduler(config: Optional[Dict[str, Any]] = None) -> JobScheduler:
+    # 根据配置创建调度器；进程模式需要跨进程共享的任务存储
+    config = config or get_user_config()
+    mode = str(config.get("worker_pool_mode", "thread")).lower()
+    if mode not in ("thread", "process"):
+        raise ValueError(f"不支持的工作池模式: {mode}（可选: thread, process）")
+    if mode == "process" and str(config.get("task_store", "memory")).lower() == "memory":
+        print("[Scheduler] 进程内任务存储无法跨进程共享，worker_pool_mode 回退为 thread")
+        mode = "thread"
+    return JobScheduler(
+        max_workers=config.get("worker_pool_size", 2),
+        queue_sizes={
+            "interactive": config.get("job_queue_size", 20),
+            "batch": config.get("batch_queue_size", 200),
+        },
+        mode=mode,
+    )
+
+
+# 全局调度器
+scheduler = create_scheduler()
@@ -0,0 +1,110 @@
+# backend/signals.py
+# 规则信号提取：从最终决策文本中直接识别 BUY / SELL / HOLD，并给出置信度。
+# 置信度不低于 signal_rule_min_confidence 时直接采用，否则回退到 LLM 提取（evaluation.SignalProcessor）。
+#   marker  显式标记（"最终交易建议：**BUY**"、"FINAL TRANSACTION PROPOSAL: SELL" 等），全部一致      0.98
+#           （信号词须独立成句，其后紧跟行尾 / 标点 / 加粗结束符；之后的决策短语指向其他方向时交给 LLM）
+#   phrase  明确的决策短语（"建议买入"、"决定继续持有"、"we recommend selling" 等），只指向一个方向  0.80~0.90
+#   bold    加粗的单一信号词（"**持有**"）                                                       0.80
+#   bare    全文只出现一种大写信号词（"... SELL."）                                              0.70
+# 多个标记 / 短语指向不同方向、或带否定（"不建议买入"）时置信度降低，交给 LLM 判断。
+# 不依赖 LLM，benchmarks/check_signal_rules.py 用回归语料校验。
+
+import re
+from typing import Optional, Tuple
+
+SIGNALS = ("BUY", "SELL", "HOLD")
+
+# 各信号的中英文说法
+_WORDS = {
+    "买入": "BUY", "增持": "BUY", "加仓": "BUY", "建仓": "BUY", "buy": "BUY", "buying": "BUY",
+    "卖出": "SELL", "减持": "SELL", "清仓": "SELL", "sell": "SELL", "selling": "SELL",
+    "持有": "HOLD", "观望": "HOLD", "hold": "HOLD", "holding": "HOLD",
+}
+_WORD_RE = "|".join(sorted((re.escape(w) for w in _WORDS), key=len, reverse=True))
+
+# 照抄提示词模板的 "BUY/HOLD/SELL"、"买入、卖出或持有" 不算作决策；"buy-side" 之类的复合词也不算
+_NOT_TEMPLATE = rf"(?![A-Za-z])(?!-\w)(?!\s*[/／|、或]\s*(?:{_WORD_RE}))"
+# 显式标记后的信号词必须独立成句：其后紧跟行尾、标点或加粗结束符，
+# 否则是 "交易建议：卖出压力已经减轻…"、"交易信号：买入信号不明确…" 这类以信号词开头的普通句子
+_TERMINATOR = r"(?=[ \t]*(?:$|\n|\*\*|[。.，,；;！!？?、:：)）」』】\]\"”'（(]))"
+
+# 显式标记：最终交易建议 / 最终决策 / FINAL TRANSACTION PROPOSAL 等
+_MARKER = re.compile(
+    r"(?:最终(?:交易)?(?:建议|决策|决定|信号|结论|评级)|交易(?:建议|信号)|"
+    r"final\s+(?:trade\s+|trading\s+|transaction\s+|investment\s+)?(?:proposal|recommendation|decision|signal|call|verdict))"
+    r"\s*(?:是|为|is|:|：|-|—)?\s*[:：]?\s*[*\s\"“「【\[]*"
+    rf"({_WORD_RE}){_NOT_TEMPLATE}{_TERMINATOR}",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# 决策短语：动词 + 少量修饰 + 信号词；修饰部分出现否定词时不计
+_NEGATION = re.compile(r"不|勿|别|避免|无需|暂缓|not|n't|never|against|avoid|instead\s+of|rather\s+than", re.IGNORECASE)
+_PHRASE_ZH = re.compile(
+    rf"(建议|推荐|决定|选择|倾向于?|应该|应当|维持|给出|采取|执行|评级[:：]?)([^，,。；;！!\n]{{0,6}}?)({_WORD_RE}){_NOT_TEMPLATE}",
+    re.IGNORECASE,
+)
+_PHRASE_EN = re.compile(
+    r"\b(recommend(?:ation)?(?:\s+is)?|decision(?:\s+is)?|verdict(?:\s+is)?|rating(?:\s+is)?|"
+    r"we\s+(?:should|will|would)|i\s+(?:recommend|would|will)|advise|conclude\s+to)"
+    rf"([^.;\n]{{0,24}}?)\b({_WORD_RE})\b{_NOT_TEMPLATE}",
+    re.IGNORECASE,
+)
+# 否定词可能出现在动词之前（"不建议买入"、"do not recommend buying"）
+_NEGATION_BEFORE = re.compile(r"(?:不|勿|别|并非|不是|not|n't|never)\s*$", re.IGNORECASE)
+
+_BOLD = re.compile(rf"\*\*\s*({_WORD_RE})\s*[。.!！]?\s*\*\*", re.IGNORECASE)
+_BARE = re.compile(r"\b(BUY|SELL|HOLD)\b")
+
+
+def _signal(word: str) -> str:
+    return _WORDS[word.lower()]
+
+
+def _distinct(values):
+    return list(dict.fromkeys(values))
+
+
+def _phrases(text: str) -> Tuple[list, bool]:
+    """文本中决策短语指向的信号（按出现顺序），以及是否出现被否定的短语。"""
+    phrases, negated = [], False
+    for pattern in (_PHRASE_ZH, _PHRASE_EN):
+        for m in pattern.finditer(text):
+            if _NEGATION.search(m.group(2)) or _NEGATION_BEFORE.search(text[max(0, m.start() - 6):m.start()]):
+                negated = True
+                continue
+            phrases.append(_signal(m.group(3)))
+    return phrases, negated
+
+
+def extract_signal_rules(text: str) -> Tuple[Optional[str], float, str]:
+    """规则提取：返回 (信号或 None, 置信度 0~1, 命中的规则)。"""
+    if not text or not text.strip():
+        return None, 0.0, "empty"
+
+    matches = list(_MARKER.finditer(text))
+    if matches:
+        markers = [_signal(m.group(1)) for m in matches]
+        found = _distinct(markers)
+        # 标记之后的决策短语指向其他方向（"最终建议：持有……但我们决定卖出"）时同样交给 LLM 复核
+        later, _ = _phrases(text[matches[-1].end():])
+        if len(found) == 1 and all(p == found[0] for p in later):
+            return found[0], 0.98, "marker"
+        # 多个标记不一致：以最后一个为准，但交给 LLM 复核
+        return markers[-1], 0.6, "marker_conflict"
+
+    phrases, negated = _phrases(text)
+    if phrases:
+        found = _distinct(phrases)
+        if len(found) == 1 and not negated:
+            return found[0], min(0.9, 0.8 + 0.05 * (len(phrases) - 1)), "phrase"
+        top = max(found, key=phrases.count)
+        return top, 0.5, "phrase_conflict"
+
+    bold = _distinct(_signal(m.group(1)) for m in _BOLD.finditer(text))
+    if len(bold) == 1 and not negated:
+        return bold[0], 0.8, "bold"
+
+    bare = _distinct(m.group(1) for m in _BARE.finditer(text))
+    if len(bare) == 1 and not negated:
+        return bare[0], 0.7, "bare"
+    return None, 0.0, "none"
@@ -1,76 +1,1182 @@
 # backend/storage.py
-from typing import Dict, Any
+# 任务状态存储。TaskStore 定义统一接口，提供以下实现：
+# - InMemoryTaskStore：进程内 dict（默认，单 worker）
+# - RedisTaskStore：Redis 协议（redis-server / fakeredis），支持多 uvicorn worker 共享任务、重启不丢失
+# - SqliteTaskStore：SQLite 持久化任务历史，带索引，支持按条件过滤与 keyset 分页
+# 模块级函数（create_task / append_log / ...）保持原有签名，委托给全局 task_store。
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime
 import uuid
 
-# 生产环境建议换成 Redis
-task_storage: Dict[str, Dict[str, Any]] = {}
+from .config_user import get_user_config
+
+
+# 任务的终止状态（之后不会再有 status 事件）
+FINISHED_STATUSES = ("completed", "error", "cancelled")
+# 后处理（后台评估）的结束方式：done 已完成，skipped 未安排评估
+POSTPROCESS_OUTCOMES = ("done", "skipped")
+
+
+def is_closed(status: Optional[str], postprocess: Optional[str]) -> bool:
+    """任务是否不会再产生主动推送的事件：失败 / 取消随状态事件结束，完成的任务在后处理结束（postprocess 事件）后结束。"""
+    return status in ("error", "cancelled") or (status == "completed" and postprocess is not None)
+
+
+def _timestamped(log_line: str) -> str:
+    return f"[{datetime.now().strftime('%H:%M:%S')}] {log_line}"
+
+
+def _event(event_type: str, **fields) -> Dict[str, Any]:
+    # 任务事件（seq 由存储分配）
+    return {"type": event_type, "ts": time.time(), **fields}
+
+
+def _iso(dt: datetime) -> str:
+    # 固定精度，保证字符串顺序与时间顺序一致
+    return dt.isoformat(timespec="microseconds")
+
+
+# keyset 分页游标：上一页最后一条的 (created_at, task_id)，编码为不透明字符串
+def encode_cursor(created_at: str, task_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{task_id}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, task_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return created_at, task_id
+
+
+class TaskStore:
+    """任务存储接口"""
+
+    def create(self, task_id: str, ticker: str, trade_date: str, first_log: str) -> None:
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def exists(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def append_log(self, task_id: str, log_line: str) -> None:
+        """追加一条日志（自动加时间戳）；与上一条消息文本相同时忽略。"""
+        raise NotImplementedError
+
+    def update_progress(self, task_id: str, progress: float, status: Optional[str] = None,
+                        eta_seconds: Optional[float] = None) -> None:
+        """更新进度；eta_seconds 为预计剩余秒数（None 表示未知），随 progress 事件推送。"""
+        raise NotImplementedError
+
+    def add_report(self, task_id: str, label: str, markdown: str) -> None:
+        raise NotImplementedError
+
+    def complete(self, task_id: str, final_result: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def fail(self, task_id: str, error: str) -> None:
+        raise NotImplementedError
+
+    def finish_postprocess(self, task_id: str, outcome: str) -> None:
+        """
+        记录已完成任务的后处理结束（outcome 为 POSTPROCESS_OUTCOMES 之一）并产生 postprocess 事件，
+        推送流在该事件之后结束；任务未完成或已记录过时忽略。
+        """
+        raise NotImplementedError
+
+    def request_cancel(self, task_id: str) -> bool:
+        """记录取消请求，由执行任务的 worker 协作检查；任务不存在或已结束时返回 False。"""
+        raise NotImplementedError
+
+    def cancel_requested(self, task_id: str) -> bool:
+        raise NotImplementedError
+
+    def cancel(self, task_id: str, reason: str) -> None:
+        """将任务标记为 cancelled（终止状态），reason 保存在 error 字段。"""
+        raise NotImplementedError
+
+    def get_events(self, task_id: str, since: int = 0,
+                   limit: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        读取 seq > since 的任务事件（按 seq 升序，最多 limit 条）。
+        返回 {"status", "closed", "last_seq", "first_seq", "gap", "events"}（closed 见 is_closed）；任务不存在时返回 None。
+        first_seq 为仍保留的最早事件的 seq（没有事件时为 last_seq + 1），gap 为 True 表示 since 之后有事件
+        已被丢弃（内存存储的环形缓冲溢出），客户端需以完整状态（get）重新同步。
+        每个事件为 {"seq", "ts", "type": log|progress|report|status, ...}，seq 在任务内单调递增。
+        """
+        raise NotImplementedError
+
+    def get_statuses(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        批量读取任务状态（不含日志 / 报告 / 结果），用于批量进度汇总与提交去重。
+        返回 {task_id: {"status", "progress", "eta_seconds", "finished_at"}}，不存在的任务不出现在结果中；
+        finished_at 为进入终止状态的时间戳（未结束为 None）。
+        默认实现逐个读取完整快照，各存储按自身结构覆盖。
+        """
+        statuses = {}
+        for task_id in task_ids:
+            task = self.get(task_id)
+            if task is not None:
+                statuses[task_id] = {"status": task["status"], "progress": task["progress"],
+                                     "eta_seconds": task["eta_seconds"], "finished_at": task.get("finished_at")}
+        return statuses
+
+    def import_task(self, task_id: str, task: Dict[str, Any],
+                    events: Optional[List[Dict[str, Any]]] = None) -> None:
+        """写入一个完整任务及其事件（用于内存淘汰时转存），仅持久化存储需要实现。"""
+        raise NotImplementedError
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """存储自身的内存占用指标，默认无。"""
+        return {}
+
+    def summaries(self):
+        """遍历全部任务摘要（task_id / ticker / trade_date / status / logs_count / created_at）。"""
+        raise NotImplementedError
+
+    def list(self, status: Optional[str] = None, ticker: Optional[str] = None,
+             date_from: Optional[str] = None, date_to: Optional[str] = None,
+             limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按条件过滤任务摘要，按创建时间倒序分页。返回 (本页条目, 下一页游标)。
+        date_from / date_to 为交易日范围（含端点，YYYY-MM-DD）。
+        默认实现遍历 summaries()，SqliteTaskStore 用索引查询覆盖。
+        """
+        after = decode_cursor(cursor) if cursor else None
+        items = []
+        for item in self.summaries():
+            if status and item["status"] != status:
+                continue
+            if ticker and item["ticker"] != ticker:
+                continue
+            if date_from and (item["trade_date"] or "") < date_from:
+                continue
+            if date_to and (item["trade_date"] or "") > date_to:
+                continue
+            if after and (item["created_at"] or "", item["task_id"]) >= after:
+                continue
+            items.append(item)
+        items.sort(key=lambda i: (i["created_at"] or "", i["task_id"]), reverse=True)
+        page = items[:limit]
+        next_cursor = encode_cursor(page[-1]["created_at"], page[-1]["task_id"]) if len(items) > limit else None
+        return page, next_cursor
+
+
+class InMemoryTaskStore(TaskStore):
+    """
+    进程内存储（生产环境多 worker 请使用 RedisTaskStore）。
+    内存占用有上限：
+    - 每个任务的日志为环形缓冲（log_max_lines），超出后丢弃最旧的行，logs_dropped 记录丢弃数
+    - 事件日志同为环形缓冲（event_max），seq 不因丢弃而回退；日志行 / 报告文本与事件共享同一字符串对象
+    - 已结束（completed / error）的任务最多保留 max_finished 个，且超过 retention_seconds 即淘汰
+    - 淘汰的任务写入 spill_store（通常为 SqliteTaskStore），之后仍可通过 get / list 查到
+    线程安全：
+    - self._lock 只保护任务索引（tasks / _finished / _locks 的增删），持有时间极短
+    - 每个任务一把锁，保护该任务的字段、日志与事件；不同任务的写入互不阻塞
+    - 读取方在任务锁内复制出快照后立即释放，不会看到写了一半的状态
+    - 加锁顺序固定为「任务锁 → 索引锁」，持有任务锁时不会再去获取其他任务的锁
+    """
+
+    def __init__(self, log_max_lines: Optional[int] = None, max_finished: Optional[int] = None,
+                 retention_seconds: Optional[float] = None, spill_store: Optional[TaskStore] = None,
+                 event_max: Optional[int] = None):
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        # 每个任务最后一条日志的原始文本，用于连续去重
+        self._last_log: Dict[str, str] = {}
+        self.log_max_lines = log_max_lines
+        self.max_finished = max_finished
+        self.retention_seconds = retention_seconds
+        self.spill_store = spill_store
+        self.event_max = event_max
+        # 已结束任务的结束时间（按结束顺序），用于淘汰
+        self._finished: Dict[str, datetime] = {}
+        self.evicted_count = 0
+        self._lock = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+
+    @contextmanager
+    def _locked(self, task_id):
+        # 持有任务锁期间返回任务 dict；任务不存在（或已被淘汰）时返回 None
+        with self._lock:
+            task = self.tasks.get(task_id)
+            lock = self._locks.get(task_id)
+        if task is None:
+            yield None
+            return
+        with lock:
+            yield task if self.tasks.get(task_id) is task else None
+
+    def create(self, task_id, ticker, trade_date, first_log):
+        line = _timestamped(first_log)
+        task = {
+            "ticker": ticker,
+            "trade_date": trade_date,
+            "status": "running",
+            "logs": deque([line], maxlen=self.log_max_lines),
+            "logs_dropped": 0,
+            "final_result": None,
+            "reports": {},
+            "progress": 0.0,
+            "progress_status": "启动中",
+            "eta_seconds": None,
+            "created_at": datetime.now(),
+            "events": deque(maxlen=self.event_max),
+            "last_seq": 0,
+            "cancel_requested": False,
+            "postprocess": None,
+            # 进入终止状态的时间戳（之后追加的后处理 / 反思日志不影响）
+            "finished_at": None,
+        }
+        self._emit(task, _event("log", line=line))
+        with self._lock:
+            self._locks[task_id] = threading.Lock()
+            self._last_log[task_id] = first_log
+            self.tasks[task_id] = task
+        self._evict()
+
+    @staticmethod
+    def _emit(task, event):
+        # 调用方需持有任务锁
+        task["last_seq"] += 1
+        event["seq"] = task["last_seq"]
+        task["events"].append(event)
+
+    @staticmethod
+    def _snapshot(task):
+        # 浅拷贝（不含事件），日志转为 list 便于切片；调用方需持有任务锁
+        snapshot = {k: v for k, v in task.items() if k != "events"}
+        return {**snapshot, "logs": list(task["logs"]), "reports": dict(task["reports"])}
+
+    def get(self, task_id):
+        with self._locked(task_id) as task:
+            if task is not None:
+                return self._snapshot(task)
+        return self.spill_store.get(task_id) if self.spill_store is not None else None
+
+    def get_statuses(self, task_ids):
+        statuses, missing = {}, []
+        for task_id in task_ids:
+            with self._locked(task_id) as task:
+                if task is None:
+                    missing.append(task_id)
+                    continue
+                statuses[task_id] = {"status": task["status"], "progress": task["progress"],
+                                     "eta_seconds": task["eta_seconds"], "finished_at": task["finished_at"]}
+        if missing and self.spill_store is not None:
+            statuses.update(self.spill_store.get_statuses(missing))
+        return statuses
+
+    def get_events(self, task_id, since=0, limit=None):
+        with self._locked(task_id) as task:
+            if task is not None:
+                events = task["events"]
+                last_seq = task["last_seq"]
+                first_seq = events[0]["seq"] if events else last_seq + 1
+                result = {"status": task["status"], "closed": is_closed(task["status"], task["postprocess"]),
+                          "last_seq": last_seq, "first_seq": first_seq, "gap": since + 1 < first_seq, "events": []}
+                if since >= last_seq or not events:
+                    return result
+                # 事件 seq 连续，按偏移定位；早于环形缓冲起点的部分已丢弃
+                start = max(since - events[0]["seq"] + 1, 0)
+                stop = start + limit if limit is not None else None
+                result["events"] = list(islice(events, start, stop))
+                return result
+        return self.spill_store.get_events(task_id, since, limit) if self.spill_store is not None else None
+
+    def exists(self, task_id):
+        if task_id in self.tasks:
+            return True
+        return self.spill_store is not None and self.spill_store.exists(task_id)
+
+    def append_log(self, task_id, log_line):
+        with self._locked(task_id) as task:
+            if task is None:
+                return
+            # Avoid appending the same log line consecutively (dedupe by message text)
+            if self._last_log.get(task_id) == log_line:
+                return
+            self._last_log[task_id] = log_line
+            logs = task["logs"]
+            if logs.maxlen is not None and len(logs) == logs.maxlen:
+                task["logs_dropped"] += 1
+            line = _timestamped(log_line)
+            logs.append(line)
+            self._emit(task, _event("log", line=line))
+
+    def update_progress(self, task_id, progress, status=None, eta_seconds=None):
+        with self._locked(task_id) as task:
+            if task is None:
+                return
+            if task["progress"] == progress and (status is None or task["progress_status"] == status):
+                return
+            task["progress"] = progress
+            task["eta_seconds"] = eta_seconds
+            if status is not None:
+                task["progress_status"] = status
+            self._emit(task, _event("progress", progress=progress, status=task["progress_status"],
+                                    eta_seconds=eta_seconds))
+
+    def add_report(self, task_id, label, markdown):
+        with self._locked(task_id) as task:
+            if task is not None:
+                task["reports"][label] = markdown
+                self._emit(task, _event("report", label=label, markdown=markdown))
+
+    def complete(self, task_id, final_result):
+        with self._locked(task_id) as task:
+            # 只有执行中的任务可以进入终止状态（已取消的任务不会被随后完成的 worker 改回 completed）
+            if task is None or task["status"] != "running":
+                return
+            task["status"] = "completed"
+            task["finished_at"] = time.time()
+            task["final_result"] = final_result
+            self._emit(task, _event("status", status="completed", final_result=final_result))
+        self._mark_finished(task_id)
+
+    def fail(self, task_id, error):
+        with self._locked(task_id) as task:
+            if task is None or task["status"] != "running":
+                return
+            task["status"] = "error"
+            task["finished_at"] = time.time()
+            task["error"] = error
+            self._emit(task, _event("status", status="error", error=error))
+        self._mark_finished(task_id)
+
+    def finish_postprocess(self, task_id, outcome):
+        with self._locked(task_id) as task:
+            if task is not None:
+                if task["status"] == "completed" and task["postprocess"] is None:
+                    task["postprocess"] = outcome
+                    self._emit(task, _event("postprocess", outcome=outcome))
+                return
+        # 任务已按保留策略转存
+        if self.spill_store is not None:
+            self.spill_store.finish_postprocess(task_id, outcome)
+
+    def request_cancel(self, task_id):
+        with self._locked(task_id) as task:
+            if task is None or task["status"] in FINISHED_STATUSES:
+                return False
+            task["cancel_requested"] = True
+            return True
+
+    def cancel_requested(self, task_id):
+        task = self.tasks.get(task_id)
+        return bool(task and task["cancel_requested"])
+
+    def cancel(self, task_id, reason):
+        with self._locked(task_id) as task:
+            if task is None or task["status"] in FINISHED_STATUSES:
+                return
+            task["status"] = "cancelled"
+            task["finished_at"] = time.time()
+            task["error"] = reason
+            self._emit(task, _event("status", status="cancelled", error=reason))
+        self._mark_finished(task_id)
+
+    def _mark_finished(self, task_id):
+        with self._lock:
+            self._finished.pop(task_id, None)
+            self._finished[task_id] = datetime.now()
+        self._evict()
+
+    def _evict(self):
+        # 先按年龄淘汰，再按数量淘汰（最早结束的优先）；在索引锁外逐个淘汰
+        with self._lock:
+            victims = []
+            if self.retention_seconds is not None:
+                now = datetime.now()
+                victims += [tid for tid, ended in self._finished.items()
+                            if (now - ended).total_seconds() > self.retention_seconds]
+            if self.max_finished is not None:
+                overflow = len(self._finished) - len(victims) - self.max_finished
+                if overflow > 0:
+                    victims += [tid for tid in self._finished if tid not in victims][:overflow]
+        for tid in victims:
+            self.evict(tid)
+
+    def evict(self, task_id):
+        """将任务移出内存；配置了 spill_store 时先写入持久化存储。"""
+        # 整个过程持有任务锁：转存与移除之间不会有新日志写入后丢失
+        with self._locked(task_id) as task:
+            if task is None:
+                return
+            if self.spill_store is not None:
+                try:
+                    self.spill_store.import_task(task_id, self._snapshot(task), list(task["events"]))
+                except Exception as e:
+                    print(f"[Storage] 任务 {task_id} 写入持久化存储失败，保留在内存中: {e}")
+                    return
+            with self._lock:
+                self.tasks.pop(task_id, None)
+                self._locks.pop(task_id, None)
+                self._last_log.pop(task_id, None)
+                self._finished.pop(task_id, None)
+                self.evicted_count += 1
+
+    def summaries(self):
+        with self._lock:
+            task_ids = list(self.tasks)
+        for tid in task_ids:
+            with self._locked(tid) as t:
+                if t is None:
+                    continue
+                created = t["created_at"]
+                item = {
+                    "task_id": tid,
+                    "ticker": t["ticker"],
+                    "trade_date": t["trade_date"],
+                    "status": t["status"],
+                    "logs_count": t["logs_dropped"] + len(t["logs"]),
+                    "created_at": _iso(created) if created is not None else None,
+                }
+            yield item
+
+    def list(self, status=None, ticker=None, date_from=None, date_to=None, limit=50, cursor=None):
+        page, next_cursor = super().list(status, ticker, date_from, date_to, limit, cursor)
+        if self.spill_store is None:
+            return page, next_cursor
+        # 合并内存与持久化存储各自的一页（排序键一致，keyset 游标通用）
+        spilled, spilled_next = self.spill_store.list(status, ticker, date_from, date_to, limit, cursor)
+        seen = {item["task_id"] for item in page}
+        merged = page + [item for item in spilled if item["task_id"] not in seen]
+        merged.sort(key=lambda i: (i["created_at"] or "", i["task_id"]), reverse=True)
+        has_more = len(merged) > limit or next_cursor is not None or spilled_next is not None
+        merged = merged[:limit]
+        if has_more and merged:
+            return merged, encode_cursor(merged[-1]["created_at"], merged[-1]["task_id"])
+        return merged, None
+
+    def memory_stats(self):
+        """内存占用指标（条目数与近似字节数）。"""
+        log_lines = log_bytes = report_bytes = events = 0
+        running = 0
+        with self._lock:
+            task_ids = list(self.tasks)
+            finished = len(self._finished)
+        for tid in task_ids:
+            with self._locked(tid) as t:
+                if t is None:
+                    continue
+                logs = list(t["logs"])
+                reports = list(t["reports"].values())
+                events += len(t["events"])
+                running += t["status"] == "running"
+            log_lines += len(logs)
+            log_bytes += sum(len(line.encode("utf-8")) for line in logs)
+            report_bytes += sum(len(md.encode("utf-8")) for md in reports)
+        return {
+            "tasks_in_memory": len(task_ids),
+            "running_tasks": running,
+            "finished_tasks_in_memory": finished,
+            "log_lines": log_lines,
+            "log_bytes": log_bytes,
+            "report_bytes": report_bytes,
+            "events": events,
+            "evicted_tasks": self.evicted_count,
+            "log_max_lines": self.log_max_lines,
+            "event_max": self.event_max,
+            "max_finished": self.max_finished,
+            "retention_seconds": self.retention_seconds,
+        }
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Redis 协议实现。键结构：
+      task:{id}           hash  ticker / trade_date / status / progress / progress_status / eta_seconds / created_at /
+                                final_result(JSON) / error / last_log / cancel_requested
+      task:{id}:logs      list  带时间戳的日志
+      task:{id}:reports   hash  label -> markdown
+      task:{id}:events    list  事件 JSON（不含 seq），seq 即列表下标 + 1
+      tasks:index         zset  task_id，score 为创建时间戳
+    可注入任意兼容 redis-py 接口的客户端（例如 fakeredis.FakeRedis），需 decode_responses=True。
+    """
+
+    def __init__(self, client=None, url: str = "redis://localhost:6379/0", prefix: str = "dt"):
+        if client is None:
+            # 延迟导入：仅在启用 Redis 存储时需要安装 redis
+            import redis
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.r = client
+        self.prefix = prefix
+
+    def _key(self, task_id, suffix=""):
+        return f"{self.prefix}:task:{task_id}{suffix}"
+
+    def _index_key(self):
+        return f"{self.prefix}:tasks:index"
+
+    def create(self, task_id, ticker, trade_date, first_log):
+        created = datetime.now()
+        pipe = self.r.pipeline()
+        pipe.hset(self._key(task_id), mapping={
+            "ticker": ticker,
+            "trade_date": trade_date,
+            "status": "running",
+            "progress": 0.0,
+            "progress_status": "启动中",
+            "created_at": _iso(created),
+            "last_log": first_log,
+            # 空字符串表示后处理尚未结束（旧版本写入的任务没有该字段，视为已结束）
+            "postprocess": "",
+        })
+        line = _timestamped(first_log)
+        pipe.rpush(self._key(task_id, ":logs"), line)
+        self._emit(pipe, task_id, _event("log", line=line))
+        pipe.zadd(self._index_key(), {task_id: created.timestamp()})
+        pipe.execute()
+
+    def _emit(self, pipe, task_id, event):
+        pipe.rpush(self._key(task_id, ":events"), json.dumps(event, ensure_ascii=False))
+
+    def exists(self, task_id):
+        return bool(self.r.exists(self._key(task_id)))
+
+    def get(self, task_id):
+        pipe = self.r.pipeline()
+        pipe.hgetall(self._key(task_id))
+        pipe.lrange(self._key(task_id, ":logs"), 0, -1)
+        pipe.hgetall(self._key(task_id, ":reports"))
+        pipe.llen(self._key(task_id, ":events"))
+        meta, logs, reports, last_seq = pipe.execute()
+        if not meta:
+            return None
+        task = {
+            "ticker": meta.get("ticker"),
+            "trade_date": meta.get("trade_date"),
+            "status": meta.get("status"),
+            "logs": logs,
+            "final_result": json.loads(meta["final_result"]) if meta.get("final_result") else None,
+            "reports": reports,
+            "progress": float(meta.get("progress", 0.0)),
+            "progress_status": meta.get("progress_status"),
+            "eta_seconds": float(meta["eta_seconds"]) if meta.get("eta_seconds") else None,
+            "finished_at": float(meta["finished_at"]) if meta.get("finished_at") else None,
+            "created_at": datetime.fromisoformat(meta["created_at"]) if meta.get("created_at") else None,
+            "last_seq": last_seq,
+            "postprocess": meta.get("postprocess", "done") or None,
+        }
+        if meta.get("error"):
+            task["error"] = meta["error"]
+        return task
+
+    def get_statuses(self, task_ids):
+        pipe = self.r.pipeline()
+        for task_id in task_ids:
+            pipe.hmget(self._key(task_id), "status", "progress", "eta_seconds", "finished_at")
+        statuses = {}
+        for task_id, (status, progress, eta_seconds, finished_at) in zip(task_ids, pipe.execute()):
+            if status is not None:
+                statuses[task_id] = {"status": status, "progress": float(progress or 0.0),
+                                     "eta_seconds": float(eta_seconds) if eta_seconds else None,
+                                     "finished_at": float(finished_at) if finished_at else None}
+        return statuses
+
+    def get_events(self, task_id, since=0, limit=None):
+        pipe = self.r.pipeline()
+        pipe.hmget(self._key(task_id), "status", "postprocess")
+        pipe.llen(self._key(task_id, ":events"))
+        pipe.lrange(self._key(task_id, ":events"), since, since + limit - 1 if limit is not None else -1)
+        (status, postprocess), last_seq, raw = pipe.execute()
+        if status is None:
+            return None
+        if limit is not None and limit <= 0:
+            # LRANGE 的结束下标 -1 表示末尾，limit=0 需单独处理
+            raw = []
+        events = [{**json.loads(item), "seq": since + i + 1} for i, item in enumerate(raw)]
+        closed = is_closed(status, "done" if postprocess is None else postprocess or None)
+        # Redis 存储保留全部事件
+        return {"status": status, "closed": closed, "last_seq": last_seq, "first_seq": 1, "gap": False,
+                "events": events}
+
+    def append_log(self, task_id, log_line):
+        key = self._key(task_id)
+        line = _timestamped(log_line)
+
+        # 任务线程、反思队列、后处理线程会同时写同一任务：WATCH 任务哈希，去重检查与写入在同一个 MULTI 事务内完成，
+        # 期间任务被其他写入者修改则重试；事件 seq 由事务内的 RPUSH 分配，不会重复
+        def _append(pipe):
+            last = pipe.hget(key, "last_log")
+            if (last is None and not pipe.exists(key)) or last == log_line:
+                return
+            pipe.multi()
+            pipe.hset(key, "last_log", log_line)
+            pipe.rpush(self._key(task_id, ":logs"), line)
+            self._emit(pipe, task_id, _event("log", line=line))
+
+        self._atomic(task_id, _append)
+
+    def _atomic(self, task_id, fn):
+        # 状态变更统一走 WATCH 任务哈希 + MULTI：fn(pipe) 先读当前状态再调用 pipe.multi() 写入，
+        # 读写之间任务被其他写入者修改时整个 fn 重试，不会丢失更新，也不会把已结束的任务改回来
+        return self.r.transaction(fn, self._key(task_id), value_from_callable=True)
+
+    def update_progress(self, task_id, progress, status=None, eta_seconds=None):
+        key = self._key(task_id)
+
+        def _update(pipe):
+            current_progress, current_status = pipe.hmget(key, "progress", "progress_status")
+            if current_progress is None:
+                return
+            if float(current_progress) == progress and (status is None or current_status == status):
+                return
+            # eta_seconds 为空字符串表示未知
+            mapping = {"progress": progress, "eta_seconds": eta_seconds if eta_seconds is not None else ""}
+            if status is not None:
+                mapping["progress_status"] = status
+            pipe.multi()
+            pipe.hset(key, mapping=mapping)
+            self._emit(pipe, task_id, _event("progress", progress=progress,
+                                             status=status if status is not None else current_status,
+                                             eta_seconds=eta_seconds))
+
+        self._atomic(task_id, _update)
+
+    def add_report(self, task_id, label, markdown):
+        def _add(pipe):
+            if not pipe.exists(self._key(task_id)):
+                return
+            pipe.multi()
+            pipe.hset(self._key(task_id, ":reports"), label, markdown)
+            self._emit(pipe, task_id, _event("report", label=label, markdown=markdown))
+
+        self._atomic(task_id, _add)
+
+    def _finish(self, task_id, mapping, event):
+        # 只有执行中的任务可以进入终止状态
+        def _set(pipe):
+            if pipe.hget(self._key(task_id), "status") != "running":
+                return False
+            pipe.multi()
+            pipe.hset(self._key(task_id), mapping={**mapping, "finished_at": time.time()})
+            self._emit(pipe, task_id, event)
+            return True
+
+        return self._atomic(task_id, _set)
+
+    def complete(self, task_id, final_result):
+        self._finish(task_id, {"status": "completed", "final_result": json.dumps(final_result, ensure_ascii=False)},
+                     _event("status", status="completed", final_result=final_result))
+
+    def fail(self, task_id, error):
+        self._finish(task_id, {"status": "error", "error": error}, _event("status", status="error", error=error))
+
+    def finish_postprocess(self, task_id, outcome):
+        key = self._key(task_id)
+
+        def _close(pipe):
+            status, postprocess = pipe.hmget(key, "status", "postprocess")
+            if status != "completed" or postprocess != "":
+                return
+            pipe.multi()
+            pipe.hset(key, "postprocess", outcome)
+            self._emit(pipe, task_id, _event("postprocess", outcome=outcome))
+
+        self._atomic(task_id, _close)
+
+    def request_cancel(self, task_id):
+        def _request(pipe):
+            if pipe.hget(self._key(task_id), "status") != "running":
+                return False
+            pipe.multi()
+            pipe.hset(self._key(task_id), "cancel_requested", 1)
+            return True
+
+        return self._atomic(task_id, _request)
+
+    def cancel_requested(self, task_id):
+        return self.r.hget(self._key(task_id), "cancel_requested") == "1"
+
+    def cancel(self, task_id, reason):
+        self._finish(task_id, {"status": "cancelled", "error": reason},
+                     _event("status", status="cancelled", error=reason))
+
+    def summaries(self):
+        task_ids = self.r.zrange(self._index_key(), 0, -1)
+        if not task_ids:
+            return
+        pipe = self.r.pipeline()
+        for tid in task_ids:
+            pipe.hmget(self._key(tid), "ticker", "trade_date", "status", "created_at")
+            pipe.llen(self._key(tid, ":logs"))
+        rows = pipe.execute()
+        for i, tid in enumerate(task_ids):
+            (ticker, trade_date, task_status, created_at), logs_count = rows[2 * i], rows[2 * i + 1]
+            if task_status is None:
+                continue
+            yield {
+                "task_id": tid,
+                "ticker": ticker,
+                "trade_date": trade_date,
+                "status": task_status,
+                "logs_count": logs_count,
+                "created_at": created_at,
+            }
+
+
+class SqliteTaskStore(TaskStore):
+    """
+    SQLite 持久化实现（WAL 模式，多 worker 进程可共享同一个数据库文件）。
+    tasks 表上为 status / ticker / trade_date / created_at 建立索引，列表查询走索引 + keyset 分页，
+    任务量达到数十万时仍保持毫秒级。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        task_id         TEXT PRIMARY KEY,
+        ticker          TEXT NOT NULL,
+        trade_date      TEXT NOT NULL,
+        status          TEXT NOT NULL,
+        progress        REAL NOT NULL DEFAULT 0,
+        progress_status TEXT,
+        eta_seconds     REAL,
+        created_at      TEXT NOT NULL,
+        final_result    TEXT,
+        error           TEXT,
+        last_log        TEXT,
+        logs_count      INTEGER NOT NULL DEFAULT 0,
+        last_seq        INTEGER NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        postprocess     TEXT,
+        finished_at     REAL
+    );
+    CREATE TABLE IF NOT EXISTS task_logs (
+        task_id TEXT NOT NULL,
+        seq     INTEGER NOT NULL,
+        line    TEXT NOT NULL,
+        PRIMARY KEY (task_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS task_events (
+        task_id TEXT NOT NULL,
+        seq     INTEGER NOT NULL,
+        event   TEXT NOT NULL,
+        PRIMARY KEY (task_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS task_reports (
+        task_id  TEXT NOT NULL,
+        label    TEXT NOT NULL,
+        markdown TEXT NOT NULL,
+        PRIMARY KEY (task_id, label)
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at, task_id);
+    CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, created_at, task_id);
+    CREATE INDEX IF NOT EXISTS idx_tasks_ticker ON tasks (ticker, created_at, task_id);
+    CREATE INDEX IF NOT EXISTS idx_tasks_trade_date ON tasks (trade_date, created_at);
+    """
+
+    # 初版之后新增的 tasks 列
+    ADDED_COLUMNS = {
+        "last_seq": "INTEGER NOT NULL DEFAULT 0",
+        "cancel_requested": "INTEGER NOT NULL DEFAULT 0",
+        "eta_seconds": "REAL",
+        # 旧版数据库中的任务视为后处理已结束；新任务写入时显式置为 NULL
+        "postprocess": "TEXT DEFAULT 'done'",
+        "finished_at": "REAL",
+    }
+
+    def __init__(self, path: str = "./results/tasks.db"):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 每个线程一个连接（sqlite3 连接不宜跨线程共享）
+        self._local = threading.local()
+        conn = self._conn()
+        # 旧版数据库缺少新增列时补齐（CREATE TABLE IF NOT EXISTS 不会修改已有表）
+        columns = [r["name"] for r in conn.execute("PRAGMA table_info(tasks)")]
+        if columns:
+            for column, ddl in self.ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {ddl}")
+        conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, task_id, ticker, trade_date, first_log):
+        conn = self._conn()
+        line = _timestamped(first_log)
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT INTO tasks (task_id, ticker, trade_date, status, progress, progress_status, created_at, "
+                "last_log, logs_count, postprocess) VALUES (?, ?, ?, 'running', 0, '启动中', ?, ?, 1, NULL)",
+                (task_id, ticker, trade_date, _iso(datetime.now()), first_log),
+            )
+            conn.execute("INSERT INTO task_logs (task_id, seq, line) VALUES (?, 0, ?)", (task_id, line))
+            self._emit(conn, task_id, _event("log", line=line))
+
+    def _emit(self, conn, task_id, event):
+        # 需在写事务内调用，与状态变更同一事务提交
+        conn.execute("UPDATE tasks SET last_seq = last_seq + 1 WHERE task_id = ?", (task_id,))
+        seq = conn.execute("SELECT last_seq FROM tasks WHERE task_id = ?", (task_id,)).fetchone()[0]
+        conn.execute("INSERT INTO task_events (task_id, seq, event) VALUES (?, ?, ?)",
+                     (task_id, seq, json.dumps(event, ensure_ascii=False)))
+
+    def exists(self, task_id):
+        return self._conn().execute("SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)).fetchone() is not None
+
+    def get(self, task_id):
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        logs = [r["line"] for r in conn.execute(
+            "SELECT line FROM task_logs WHERE task_id = ? ORDER BY seq", (task_id,))]
+        reports = {r["label"]: r["markdown"] for r in conn.execute(
+            "SELECT label, markdown FROM task_reports WHERE task_id = ? ORDER BY rowid", (task_id,))}
+        task = {
+            "ticker": row["ticker"],
+            "trade_date": row["trade_date"],
+            "status": row["status"],
+            "logs": logs,
+            "final_result": json.loads(row["final_result"]) if row["final_result"] else None,
+            "reports": reports,
+            "progress": row["progress"],
+            "progress_status": row["progress_status"],
+            "eta_seconds": row["eta_seconds"],
+            "created_at": datetime.fromisoformat(row["created_at"]),
+            "last_seq": row["last_seq"],
+            "postprocess": row["postprocess"],
+            "finished_at": row["finished_at"],
+        }
+        if row["error"]:
+            task["error"] = row["error"]
+        return task
+
+    def get_statuses(self, task_ids):
+        conn = self._conn()
+        statuses = {}
+        # 分段查询，避免超出 SQLite 的参数个数上限
+        for i in range(0, len(task_ids), 500):
+            chunk = task_ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT task_id, status, progress, eta_seconds, finished_at FROM tasks "
+                f"WHERE task_id IN ({','.join('?' * len(chunk))})", chunk)
+            for row in rows:
+                statuses[row["task_id"]] = {"status": row["status"], "progress": row["progress"],
+                                            "eta_seconds": row["eta_seconds"], "finished_at": row["finished_at"]}
+        return statuses
+
+    def get_events(self, task_id, since=0, limit=None):
+        conn = self._conn()
+        with conn:
+            # 读事务保证 last_seq 与事件列表一致
+            conn.execute("BEGIN")
+            row = conn.execute("SELECT status, postprocess, last_seq FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                "SELECT seq, event FROM task_events WHERE task_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (task_id, since, limit if limit is not None else -1)).fetchall()
+            # 从内存存储转存的任务只保留了转存时环形缓冲中的事件
+            first_seq = conn.execute("SELECT MIN(seq) FROM task_events WHERE task_id = ?", (task_id,)).fetchone()[0]
+        first_seq = first_seq if first_seq is not None else row["last_seq"] + 1
+        events = [{**json.loads(r["event"]), "seq": r["seq"]} for r in rows]
+        return {"status": row["status"], "closed": is_closed(row["status"], row["postprocess"]),
+                "last_seq": row["last_seq"], "first_seq": first_seq, "gap": since + 1 < first_seq, "events": events}
+
+    def append_log(self, task_id, log_line):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT last_log, logs_count FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None or row["last_log"] == log_line:
+                return
+            line = _timestamped(log_line)
+            conn.execute("INSERT INTO task_logs (task_id, seq, line) VALUES (?, ?, ?)",
+                         (task_id, row["logs_count"], line))
+            conn.execute("UPDATE tasks SET last_log = ?, logs_count = logs_count + 1 WHERE task_id = ?",
+                         (log_line, task_id))
+            self._emit(conn, task_id, _event("log", line=line))
+
+    def update_progress(self, task_id, progress, status=None, eta_seconds=None):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT progress, progress_status FROM tasks WHERE task_id = ?",
+                               (task_id,)).fetchone()
+            if row is None or (row["progress"] == progress and status in (None, row["progress_status"])):
+                return
+            status = status if status is not None else row["progress_status"]
+            conn.execute("UPDATE tasks SET progress = ?, progress_status = ?, eta_seconds = ? WHERE task_id = ?",
+                         (progress, status, eta_seconds, task_id))
+            self._emit(conn, task_id, _event("progress", progress=progress, status=status, eta_seconds=eta_seconds))
+
+    def _update(self, task_id, sql, params, event):
+        # 单条状态更新 + 对应事件，同一事务
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute(sql, params).rowcount:
+                self._emit(conn, task_id, event)
+
+    def add_report(self, task_id, label, markdown):
+        if self.exists(task_id):
+            self._update(
+                task_id,
+                "INSERT INTO task_reports (task_id, label, markdown) VALUES (?, ?, ?) "
+                "ON CONFLICT (task_id, label) DO UPDATE SET markdown = excluded.markdown",
+                (task_id, label, markdown),
+                _event("report", label=label, markdown=markdown))
+
+    def complete(self, task_id, final_result):
+        # 只有执行中的任务可以进入终止状态（已取消的任务不会被随后完成的 worker 改回 completed）
+        self._update(task_id, "UPDATE tasks SET status = 'completed', final_result = ?, finished_at = ? "
+                     "WHERE task_id = ? AND status = 'running'",
+                     (json.dumps(final_result, ensure_ascii=False), time.time(), task_id),
+                     _event("status", status="completed", final_result=final_result))
+
+    def fail(self, task_id, error):
+        self._update(task_id, "UPDATE tasks SET status = 'error', error = ?, finished_at = ? "
+                     "WHERE task_id = ? AND status = 'running'",
+                     (error, time.time(), task_id),
+                     _event("status", status="error", error=error))
+
+    def finish_postprocess(self, task_id, outcome):
+        self._update(task_id,
+                     "UPDATE tasks SET postprocess = ? WHERE task_id = ? AND status = 'completed' AND postprocess IS NULL",
+                     (outcome, task_id), _event("postprocess", outcome=outcome))
+
+    def request_cancel(self, task_id):
+        cur = self._conn().execute(
+            "UPDATE tasks SET cancel_requested = 1 WHERE task_id = ? AND status NOT IN (?, ?, ?)",
+            (task_id, *FINISHED_STATUSES))
+        return cur.rowcount > 0
+
+    def cancel_requested(self, task_id):
+        row = self._conn().execute("SELECT cancel_requested FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return bool(row and row[0])
+
+    def cancel(self, task_id, reason):
+        self._update(task_id,
+                     "UPDATE tasks SET status = 'cancelled', error = ?, finished_at = ? "
+                     "WHERE task_id = ? AND status NOT IN (?, ?, ?)",
+                     (reason, time.time(), task_id, *FINISHED_STATUSES),
+                     _event("status", status="cancelled", error=reason))
+
+    def import_task(self, task_id, task, events=None):
+        conn = self._conn()
+        logs = list(task.get("logs", []))
+        events = list(events or [])
+        created = task.get("created_at")
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM task_logs WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM task_reports WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM task_events WHERE task_id = ?", (task_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, ticker, trade_date, status, progress, progress_status, "
+                "created_at, final_result, error, last_log, logs_count, last_seq, postprocess, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task_id, task.get("ticker"), task.get("trade_date"), task.get("status"),
+                 task.get("progress", 0.0), task.get("progress_status"),
+                 _iso(created) if isinstance(created, datetime) else (created or _iso(datetime.now())),
+                 json.dumps(task["final_result"], ensure_ascii=False) if task.get("final_result") else None,
+                 task.get("error"), None, len(logs), task.get("last_seq", len(events)), task.get("postprocess"),
+                 task.get("finished_at")),
+            )
+            conn.executemany("INSERT INTO task_logs (task_id, seq, line) VALUES (?, ?, ?)",
+                             [(task_id, i, line) for i, line in enumerate(logs)])
+            conn.executemany("INSERT INTO task_reports (task_id, label, markdown) VALUES (?, ?, ?)",
+                             [(task_id, label, md) for label, md in (task.get("reports") or {}).items()])
+            # 保留原 seq，转存后客户端仍可用同一游标续读
+            conn.executemany(
+                "INSERT INTO task_events (task_id, seq, event) VALUES (?, ?, ?)",
+                [(task_id, e["seq"], json.dumps({k: v for k, v in e.items() if k != "seq"}, ensure_ascii=False))
+                 for e in events])
+
+    def summaries(self):
+        for row in self._conn().execute(
+                "SELECT task_id, ticker, trade_date, status, logs_count, created_at FROM tasks"):
+            yield dict(row)
+
+    def list(self, status=None, ticker=None, date_from=None, date_to=None, limit=50, cursor=None):
+        where, params = [], []
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if ticker:
+            where.append("ticker = ?")
+            params.append(ticker)
+        if date_from:
+            where.append("trade_date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("trade_date <= ?")
+            params.append(date_to)
+        if cursor:
+            # 行值比较，配合 (…, created_at, task_id) 复合索引做 keyset 分页
+            where.append("(created_at, task_id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        sql = "SELECT task_id, ticker, trade_date, status, logs_count, created_at FROM tasks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, task_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = [dict(r) for r in self._conn().execute(sql, params)]
+        page = rows[:limit]
+        next_cursor = encode_cursor(page[-1]["created_at"], page[-1]["task_id"]) if len(rows) > limit else None
+        return page, next_cursor
+
+
+def create_task_store(config: Optional[Dict[str, Any]] = None) -> TaskStore:
+    # 根据配置 task_store 选择存储后端
+    config = config or get_user_config()
+    backend = str(config.get("task_store", "memory")).lower()
+    if backend == "memory":
+        spill = config.get("task_spill_store")
+        return InMemoryTaskStore(
+            log_max_lines=config.get("task_log_max_lines"),
+            max_finished=config.get("task_max_finished_in_memory"),
+            retention_seconds=config.get("task_retention_seconds"),
+            event_max=config.get("task_event_max"),
+            spill_store=SqliteTaskStore(config.get("task_db_path", "./results/tasks.db")) if spill == "sqlite" else None,
+        )
+    if backend == "redis":
+        return RedisTaskStore(url=config.get("redis_url", "redis://localhost:6379/0"))
+    if backend == "sqlite":
+        return SqliteTaskStore(config.get("task_db_path", "./results/tasks.db"))
+    raise ValueError(f"不支持的任务存储: {backend}（可选: memory, redis, sqlite）")
+
+
+# 全局任务存储
+task_store: TaskStore = create_task_store()
+
+# 事件监听器：任务产生新事件后以 task_id 调用（用于推送订阅方，见 events.py）
+_event_listeners = []
+
+
+def add_event_listener(listener):
+    _event_listeners.append(listener)
+
+
+def _notify(task_id: str):
+    for listener in _event_listeners:
+        try:
+            listener(task_id)
+        except Exception as e:
+            print(f"[Storage] 事件通知失败: {e}")
+
 
 def create_task(ticker: str, trade_date: str) -> str:
     task_id = str(uuid.uuid4())
-    task_storage[task_id] = {
-        "ticker": ticker,
-        "trade_date": trade_date,
-        "status": "running",
-        "logs": [f"[{datetime.now().strftime('%H:%M:%S')}] 任务启动：分析 {ticker} 于 {trade_date}"],
-        "final_result": None,
-        "reports": {},
-        "progress": 0.0,
-        "progress_status": "启动中",
-        "created_at": datetime.now()
-    }
+    task_store.create(task_id, ticker, trade_date, f"任务启动：分析 {ticker} 于 {trade_date}")
     return task_id
 
 def append_log(task_id: str, log_line: str):
-    if task_id in task_storage:
-        timestamp = datetime.now().strftime('%H:%M:%S')
-        entry = f"[{timestamp}] {log_line}"
-        logs = task_storage[task_id]["logs"]
-        # Avoid appending the same log line consecutively (dedupe by message text)
-        if logs:
-            try:
-                last = logs[-1]
-                # strip leading timestamp like [HH:MM:SS] <space>
-                last_text = last.split('] ', 1)[1] if '] ' in last else last
-            except Exception:
-                last_text = logs[-1]
-            if last_text == log_line:
-                return
-        logs.append(entry)
+    task_store.append_log(task_id, log_line)
+    _notify(task_id)
 
 def get_task(task_id: str):
-    if task_id in task_storage:
-        return task_storage[task_id]
-    return None
+    return task_store.get(task_id)
 
 
-def update_progress(task_id: str, progress: float, status: str = None):
-    """Set a task's progress (0.0-1.0) and optional status string."""
-    if task_id in task_storage:
-        try:
-            p = float(progress)
-        except Exception:
-            return
-        task_storage[task_id]["progress"] = max(0.0, min(1.0, p))
-        if status is not None:
-            task_storage[task_id]["progress_status"] = str(status)
-
-def complete_task(task_id: str, final_state: dict, signal: str):
-    if task_id in task_storage:
-        task_storage[task_id]["status"] = "completed"
-        task_storage[task_id]["final_result"] = {
+def get_task_statuses(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """批量读取任务的 status / progress / eta_seconds（不读取日志与报告），不存在的任务不出现在结果中。"""
+    return task_store.get_statuses(list(task_ids))
+
+
+def get_events(task_id: str, since: int = 0, limit: int = None):
+    """读取 seq > since 的任务事件，用于断线续传；任务不存在返回 None。"""
+    return task_store.get_events(task_id, since=max(0, int(since)), limit=limit)
+
+
+def list_tasks(status: str = None, ticker: str = None, date_from: str = None, date_to: str = None,
+               limit: int = 50, cursor: str = None):
+    return task_store.list(status=status, ticker=ticker, date_from=date_from, date_to=date_to,
+                           limit=limit, cursor=cursor)
+
+
+def update_progress(task_id: str, progress: float, status: str = None, eta_seconds: float = None):
+    """Set a task's progress (0.0-1.0), optional status string and estimated seconds remaining."""
+    try:
+        p = float(progress)
+    except Exception:
+        return
+    eta = round(max(0.0, float(eta_seconds)), 1) if eta_seconds is not None else None
+    task_store.update_progress(task_id, max(0.0, min(1.0, p)), str(status) if status is not None else None, eta)
+    _notify(task_id)
+
+def complete_task(task_id: str, final_state: dict, signal: str, deadline: Optional[dict] = None):
+    if task_store.exists(task_id):
+        # 先写日志再写状态：看到 status 事件时最终结果已可读（推送流在随后的 postprocess 事件后结束）
+        append_log(task_id, f"分析完成！最终信号: {signal}")
+        final_result = {
             "decision": final_state.get('final_trade_decision', ''),
             "signal": signal
         }
-        append_log(task_id, f"分析完成！最终信号: {signal}")
+        # 截止时间模式：是否按时、剩余时间与已采取的降级
+        if deadline is not None:
+            final_result["deadline"] = deadline
+        task_store.complete(task_id, final_result)
+        _notify(task_id)
+
+
+def finish_postprocess(task_id: str, outcome: str):
+    """已完成任务的后处理结束（评估完成或未安排评估），推送流在此之后结束。"""
+    task_store.finish_postprocess(task_id, outcome)
+    _notify(task_id)
+
+
+def storage_stats():
+    """任务存储的内存占用指标，附带进程 RSS（Linux）。"""
+    stats = {"backend": type(task_store).__name__, **task_store.memory_stats()}
+    try:
+        with open("/proc/self/statm") as f:
+            stats["process_rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        stats["process_rss_bytes"] = None
+    return stats
+
+
+def fail_task(task_id: str, error: str):
+    """Mark a task as errored with the given message."""
+    task_store.fail(task_id, error)
+    _notify(task_id)
+
+
+def request_cancel(task_id: str) -> bool:
+    """请求取消任务；返回 False 表示任务不存在或已结束。"""
+    return task_store.request_cancel(task_id)
+
+
+def is_cancel_requested(task_id: str) -> bool:
+    return task_store.cancel_requested(task_id)
+
+
+def cancel_task(task_id: str, reason: str = "用户取消"):
+    """将任务标记为 cancelled。"""
+    append_log(task_id, f"🛑 任务已取消：{reason}")
+    task_store.cancel(task_id, reason)
+    _notify(task_id)
 
 
 def add_report(task_id: str, label: str, markdown: str):
-    """Store a structured report under task_storage[task_id]['reports'].
+    """Store a structured report under the task's 'reports'.
     Overwrites existing report with the same label.
     """
-    if task_id in task_storage:
-        task_storage[task_id].setdefault('reports', {})
-        task_storage[task_id]['reports'][label] = markdown
+    if task_store.exists(task_id):
+        task_store.add_report(task_id, label, markdown)
+        _notify(task_id)
         # also append a short log entry for visibility
-        append_log(task_id, f"{label} 报告已生成")
\ No newline at end of file
+        append_log(task_id, f"{label} 报告已生成")
@@ -1,4 +1,4 @@
-from .storage import append_log, complete_task, task_storage, add_report, update_progress
+from .storage import append_log, complete_task, fail_task, cancel_task, add_report, update_progress, finish_postprocess
 from .graph import create_trading_graph
 from .evaluation import *
 from .agents import quick_thinking_llm
@@ -6,22 +6,73 @@ from .agents import deep_thinking_llm
 from .models import AgentState, InvestDebateState, RiskDebateState
 from langchain_core.messages import HumanMessage
 from datetime import datetime, timedelta, date
+import time
 import traceback
 from .tools import Toolkit
 from .config_user import get_user_config
+from .reflection import reflection_queue
+from .cancellation import TaskCancelled, CancellationCallback, register_token, release_token
+from .metrics import PhaseTimer
+from .results import result_store
+from .dedupe import config_fingerprint
+from .postprocess import postprocessor
+from .progress import ProgressTracker, build_plan, SETUP, FINALIZE
+from .tracing import tracer, bind_span, unbind_span
+from .deadline import DeadlineBudget, STEP_LABELS
 
-def run_analysis(task_id: str, ticker: str, trade_date: str):
+
+def _merge_state(state: dict, update: dict):
+    """将节点增量合并到累积状态：嵌套的辩论状态逐键合并，列表字段追加。"""
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(state.get(key), dict):
+            merged = dict(state[key])
+            for k, v in value.items():
+                if isinstance(v, list) and isinstance(merged.get(k), list):
+                    merged[k] = merged[k] + v
+                else:
+                    merged[k] = v
+            state[key] = merged
+        else:
+            state[key] = value
+
+def _check_deadline(task_id: str, budget: DeadlineBudget, tracker: ProgressTracker, span) -> None:
+    # 预测赶不上截止时间时逐级降级，降级记入日志与 trace
+    was_exhausted = budget.exhausted
+    for entry in budget.check(tracker):
+        append_log(task_id, f"⏱️ 预计超出截止时间 {entry['projected_overrun_seconds']:.0f} 秒，降级：{entry['label']}")
+        if span is not None:
+            span.set_attribute("deadline.degradations", ",".join(d["step"] for d in budget.degradations))
+    overrun = budget.overrun_seconds(tracker)
+    if budget.exhausted and not was_exhausted and overrun > 0:
+        append_log(task_id, f"⚠️ 已无可降级项，预计仍超出截止时间 {overrun:.0f} 秒")
+
+
+def run_analysis(task_id: str, ticker: str, trade_date: str, deadline_at: float = None):
     """
         每个并发任务的完整执行函数
         - 创建独立的 graph
         - 执行主工作流
         - 提取信号
         - 反思学习（写入独立记忆）
-        - 多维度评估
-        - 事实一致性审计
+        - 标记完成后，多维度评估与事实一致性审计在后台并发执行（postprocess.py），结果陆续附加
         - 所有日志实时追加
+        - 协作式取消：stream 分块之间、后处理各阶段之前、每次 LLM / 工具调用前检查取消令牌
+        - 各阶段耗时与结束状态记入 /metrics
+        - 进度按图拓扑与各节点的历史耗时计算，随进度推送预计剩余时间（progress.py）
+        - 整个任务记录为一条 trace（tracing.py）：图节点、LLM / 工具调用与后台评估各阶段为其中的 span
+        - 传入 deadline_at（时间戳）时为截止时间模式：预测赶不上时逐级降级，按时给出信号（deadline.py）
         """
+    token = register_token(task_id)
+    phases = PhaseTimer()
+    outcome = "error"
+    # 本任务的工具包：后处理各评估阶段经 toolkit.results 共用已取得的行情
+    toolkit = Toolkit()
+    tracker = None
+    budget = None
+    root_span = tracer.start_trace(task_id, "analysis", ticker=ticker, trade_date=trade_date)
+    span_binding = bind_span(root_span)
     try:
+        token.raise_if_cancelled("开始执行前")
 
         # 强制日期不能是未来
         analysis_date = datetime.strptime(trade_date, "%Y-%m-%d").date()
@@ -32,12 +83,25 @@ def run_analysis(task_id: str, ticker: str, trade_date: str):
             
         append_log(task_id, f"任务开始执行：分析 {ticker} 于 {trade_date}")
         user_config = get_user_config()
+        tracker = ProgressTracker(build_plan(user_config))
+        budget = DeadlineBudget(deadline_at, user_config) if deadline_at is not None else None
+        if budget is not None:
+            append_log(task_id, f"⏱️ 截止时间模式：剩余 {budget.remaining_seconds:.0f} 秒，预计耗时 {tracker.eta_seconds:.0f} 秒")
+            if root_span is not None:
+                root_span.set_attribute("deadline.remaining_seconds", round(budget.remaining_seconds, 1))
 
         # 1. 创建独立的 graph 和 toolkit
-        trading_graph = create_trading_graph()
-        toolkit = Toolkit()  # CONFIG 已全局，这里简化
+        trading_graph = create_trading_graph(toolkit, budget)
 
         append_log(task_id, "✅ 独立工作流和工具初始化完成")
+        tracker.advance(SETUP, phases.mark("setup"))
+        if budget is not None:
+            _check_deadline(task_id, budget, tracker, root_span)
+        progress, eta_seconds = tracker.progress, tracker.eta_seconds
+        try:
+            update_progress(task_id, progress, "初始化完成", eta_seconds)
+        except Exception:
+            pass
 
         # 2. 构建输入状态
         graph_input = AgentState(
@@ -58,7 +122,8 @@ def run_analysis(task_id: str, ticker: str, trade_date: str):
         # 3. 执行主工作流（实时日志已在 graph 节点中处理，这里额外记录关键节点）
         append_log(task_id, "🚀 开始执行多智能体工作流...")
 
-        final_state = None
+        # 累积的完整状态（stream 每步只返回节点增量）
+        final_state = dict(graph_input)
         max_steps = user_config.get('max_graph_steps', 500)
         node_icons = {
             "Market Analyst": "📈 市场分析师开始分析技术指标",
@@ -80,21 +145,30 @@ def run_analysis(task_id: str, ticker: str, trade_date: str):
         node_first_seen = set()  # 在 run_analysis 函数开头添加
         seen_report_hashes = set()  # 用于去重跨步产生的相同报告内容
 
-        for i, chunk in enumerate(trading_graph.stream(graph_input, {"recursion_limit": user_config["max_recur_limit"]}), 1):
+        stream_config = {
+            "recursion_limit": user_config["max_recur_limit"],
+            "callbacks": [CancellationCallback(token)],
+        }
+        node_started = time.perf_counter()
+        for i, chunk in enumerate(trading_graph.stream(graph_input, stream_config), 1):
+            token.raise_if_cancelled("工作流执行中")
+            now = time.perf_counter()
+            node_seconds, node_started = now - node_started, now
             step += 1
             if step > max_steps:
                 append_log(task_id, f"⚠️ Graph exceeded max steps ({max_steps}). Aborting to prevent infinite loop.")
                 # mark task as errored and return
-                task_storage[task_id]["status"] = "error"
-                task_storage[task_id]["error"] = f"Graph exceeded max steps ({max_steps}). Aborted."
+                fail_task(task_id, f"Graph exceeded max steps ({max_steps}). Aborted.")
                 return
             node_name = list(chunk.keys())[0]
             # 记录当前 step 和节点，便于诊断重复问题
             append_log(task_id, f"(graph step {step+1}) 执行节点: {node_name}")
-            # update progress after discovering node
+            # 按计划节点的预期耗时推进进度；相邻两个分块之间的时间即该节点的执行耗时
+            tracker.advance(node_name, node_seconds)
+            if budget is not None:
+                _check_deadline(task_id, budget, tracker, root_span)
             try:
-                frac = min(step / max_steps, 1.0)
-                update_progress(task_id, frac, f"{node_name}")
+                update_progress(task_id, tracker.progress, f"{node_name}", tracker.eta_seconds)
             except Exception:
                 pass
             icon_text = node_icons.get(node_name, f"▶️ 执行节点: {node_name}")
@@ -159,161 +233,107 @@ def run_analysis(task_id: str, ticker: str, trade_date: str):
                 except Exception:
                     append_log(task_id, f"🏆 最终决策: {update['final_trade_decision']}")
 
-            final_state = update
+            _merge_state(final_state, update)
 
+        phases.mark("graph")
+        finalize_started = time.perf_counter()
         append_log(task_id, "✅ 主工作流执行完成！正在后处理...")
         try:
-            update_progress(task_id, 0.95, "后处理")
+            update_progress(task_id, tracker.progress, "后处理", tracker.eta_seconds)
         except Exception:
             pass
 
         # 4. 提取交易信号
-        signal_processor = SignalProcessor(quick_thinking_llm)
-        final_signal = signal_processor.process_signal(final_state.get('final_trade_decision', ''))
-        append_log(task_id, f"🏆 最终交易信号: **{final_signal}**")
+        token.raise_if_cancelled("信号提取前")
+        # 截止时间模式下剩余时间不够一次 LLM 调用时，适当降低规则结果的置信度阈值（仍有下限）
+        normal_confidence = user_config.get("signal_rule_min_confidence", 0.75)
+        min_confidence = budget.signal_min_confidence(normal_confidence, tracker) if budget is not None else normal_confidence
+        signal_processor = SignalProcessor(quick_thinking_llm, min_confidence=min_confidence)
+        with tracer.span("signal extraction", span_type="phase") as span:
+            extracted = signal_processor.extract(final_state.get('final_trade_decision', ''))
+            if span is not None:
+                span.set_attribute("method", extracted["method"])
+                span.set_attribute("rule", extracted["rule"])
+        if extracted["method"] == "rule" and extracted["confidence"] < normal_confidence:
+            budget.record("rule_signal")
+        final_signal = extracted["signal"]
+        method = f"规则 {extracted['rule']}，置信度 {extracted['confidence']:.2f}" if extracted["method"] == "rule" else "LLM"
+        append_log(task_id, f"🏆 最终交易信号: **{final_signal}**（{method}）")
+        phases.mark("signal")
 
-        # 5. 反思学习（写入任务独立的记忆）
-        append_log(task_id, "🧠 开始智能体反思与学习...")
-        reflector = Reflector(quick_thinking_llm)
-        hypothetical_returns = 1000  # 模拟盈利用于学习
+        # 5. 反思学习：提交到后台反思队列（基于实际收益反思，写入持久化记忆，不阻塞任务完成）
+        token.raise_if_cancelled("反思前")
+        if final_signal in ["BUY", "SELL", "HOLD"]:
+            reflection_queue.submit(task_id, ticker, trade_date, final_signal, final_state)
+            append_log(task_id, "🧠 已提交智能体反思任务（后台执行，实际收益可得后写入长期记忆）")
+        else:
+            append_log(task_id, "⚠️ 信号无法解析，跳过反思")
+        phases.mark("reflection")
 
-        # 注意：这里需要从 graph 创建时传入的 memories
-        # 但由于工厂模式，我们无法直接访问 → 解决方案：将 memories 也作为参数传入，或在任务中重新创建
-        # 简单方案：这里重新创建临时记忆（仅用于本次反思，不持久化跨任务）
-        # 高级方案：将 memories 存入 task_storage
-        # 这里采用简单方案（反思仅本次有效，不影响并发隔离）
-        temp_memories = {
-            "bull": final_state.get('investment_debate_state', {}).get('bull_history', ''),
-            "bear": final_state.get('investment_debate_state', {}).get('bear_history', ''),
-            "trader": final_state.get('trader_investment_plan', ''),
-            "risk_manager": final_state.get('final_trade_decision', '')
-        }
-        # 实际写入可跳过，或改为日志记录学习内容
-        append_log(task_id, "✅ 反思完成（经验已记录）")
-
-        # 6. 多维度评估
-        append_log(task_id, "📊 开始多维度评估...")
-
-        # Ground Truth
-        gt_report = evaluate_ground_truth(ticker, trade_date, final_signal)
-        append_log(task_id, "真实市场验证：")
-        append_log(task_id, gt_report)
-
-        # LLM-as-a-Judge
-        reports_summary = (
-            f"市场报告: {final_state.get('market_report', '')[:500]}...\n"
-            f"情绪报告: {final_state.get('sentiment_report', '')[:500]}...\n"
-            f"新闻报告: {final_state.get('news_report', '')[:500]}...\n"
-            f"基本面报告: {final_state.get('fundamentals_report', '')[:500]}..."
-        )
+        # 6. 任务完成：先写入结果库（供 /result/{ticker}/{trade_date} 查询），再标记完成，看到 completed 时结果已可查
+        #    截止时间模式：已降级或已超时则不再做后台评估；结果按实际执行的配置保存，并附带降级记录
+        tracker.advance(FINALIZE, time.perf_counter() - finalize_started)
         try:
-            eval_result = evaluator_chain.invoke({
-                "reports": reports_summary,
-                "final_decision": final_state.get('final_trade_decision', '')
-            })
-            append_log(task_id, "LLM-as-a-Judge 评估：")
-            append_log(task_id, str(eval_result.dict()))
-        except Exception as e:
-            err_str = str(e)
-            append_log(task_id, f"LLM评估失败: {err_str}")
-            # Fallback: some providers don't support structured response_format. Try a plain prompt and parse JSON.
-            if "response_format type is unavailable" in err_str or "invalid_request_error" in err_str:
-                try:
-                    import json, re
-                    fallback_prompt = (
-                        "请根据报告评估最终交易决策。"
-                        "返回一个 JSON 对象, 其键包括: reasoning_quality(1-10), evidence_based_score(1-10)。"
-                        "actionability_score(1-10), justification (字符串).\n\n"
-                        f"报告:\n{reports_summary}\n\n最终决策:\n{final_state.get('final_trade_decision','')}")
-                    raw = deep_thinking_llm.invoke(fallback_prompt).content
-                    # extract json substring if wrapped
-                    m = re.search(r"\{.*\}", raw, re.S)
-                    if m:
-                        js = json.loads(m.group(0))
-                    else:
-                        js = json.loads(raw)
-                    append_log(task_id, f"LLM评估回退结果: \n 逻辑性和连贯性评分: {js['reasoning_quality']} \n 证据依据评分: {js['evidence_based_score']} \n 可操作性评分: {js['actionability_score']} \n 评估说明: {js['justification']}")
-                except Exception as e2:
-                    append_log(task_id, f"LLM评估回退失败: {e2}")
-
-        # 事实一致性审计（市场报告）
+            update_progress(task_id, 1.0, "完成", 0.0)
+        except Exception:
+            pass
+        token.raise_if_cancelled("完成前")
+        run_config, deadline_summary, evaluation = user_config, None, None
+        skip_evaluation = budget is not None and (budget.degraded or budget.expired)
+        if budget is not None:
+            if skip_evaluation:
+                budget.record("skip_evaluation")
+            run_config = budget.effective_config()
+            deadline_summary = budget.finish()
+            evaluation = {"deadline": deadline_summary}
+            steps = "、".join(STEP_LABELS[d["step"]] for d in budget.degradations) or "无"
+            status = "按时" if deadline_summary["met"] else f"超时 {-deadline_summary['slack_seconds']:.0f} 秒"
+            append_log(task_id, f"⏱️ 截止时间模式：{status}给出信号，降级：{steps}")
+            if root_span is not None:
+                root_span.set_attribute("deadline.degradations", ",".join(d["step"] for d in budget.degradations))
+                root_span.set_attribute("deadline.met", deadline_summary["met"])
+                root_span.set_attribute("deadline.slack_seconds", deadline_summary["slack_seconds"])
         try:
-            start_date_audit = (datetime.strptime(trade_date, "%Y-%m-%d") - timedelta(days=60)).strftime('%Y-%m-%d')
-
-            # Some toolkit tools are wrapped as LangChain BaseTool objects with different call signatures.
-            # Use a safe invoker that tries common call styles and fallback shapes.
-            def safe_call_tool(tool, *a, **kw):
-                # Try several common invocation styles, returning the first successful result.
-                last_exc = None
-                # 1) tool.func(...) (decorated wrappers)
-                try:
-                    if hasattr(tool, 'func') and callable(getattr(tool, 'func')):
-                        return tool.func(*a, **kw)
-                except Exception as e:
-                    last_exc = e
-                # 2) tool.invoke(...)
-                try:
-                    if hasattr(tool, 'invoke') and callable(getattr(tool, 'invoke')):
-                        return tool.invoke(*a, **kw)
-                except Exception as e:
-                    last_exc = e
-                # 3) direct callable
-                try:
-                    if callable(tool):
-                        return tool(*a, **kw)
-                except Exception as e:
-                    last_exc = e
-                # 4) single-dict arg (some tools expect a single dict)
-                try:
-                    if len(a) >= 3:
-                        return tool({'symbol': a[0], 'start_date': a[1], 'end_date': a[2]})
-                except Exception as e:
-                    last_exc = e
-                # If none succeeded, raise the last exception to aid debugging
-                raise last_exc or RuntimeError('Unable to call tool')
-
-            raw_data = safe_call_tool(toolkit.get_technical_indicators, ticker, start_date_audit, trade_date)
-
-            try:
-                audit_result = auditor_chain.invoke({
-                    "raw_data": raw_data,
-                    "agent_report": final_state.get('market_report', '')
-                })
-                append_log(task_id, "事实一致性审计：")
-                append_log(task_id, str(audit_result.dict()))
-            except Exception as ae:
-                err_str = str(ae)
-                append_log(task_id, f"审计失败: {err_str}")
-                # Fallback: some providers don't support structured response_format. Try a plain prompt and parse JSON.
-                if "response_format type is unavailable" in err_str or "invalid_request_error" in err_str:
-                    try:
-                        import json, re
-                        fallback_prompt = (
-                            "请根据原始数据审核市场报告。返回一个包含键的 JSON 对象。: is_consistent (bool), discrepancies (list), justification (string).\n\n"
-                            f"原始数据:\n{raw_data}\n\n智能体报告:\n{final_state.get('market_report','')}"
-                        )
-                        raw = deep_thinking_llm.invoke(fallback_prompt).content
-                        m = re.search(r"\{.*\}", raw, re.S)
-                        if m:
-                            js = json.loads(m.group(0))
-                        else:
-                            js = json.loads(raw)
-                        append_log(task_id, f"审计回退结果: \n 一致性: {js['is_consistent']} \n 差异点: {js['discrepancies']} \n 审计说明: {js['justification']}")
-                    except Exception as e2:
-                        append_log(task_id, f"审计回退失败: {e2}")
+            result_store.save(ticker, trade_date, config_fingerprint(run_config), task_id,
+                              final_signal, final_state, evaluation)
         except Exception as e:
-            append_log(task_id, f"审计失败: {str(e)}")
+            print(f"[Results] 保存分析结果失败: {e}")
+        complete_task(task_id, final_state, final_signal, deadline_summary)
+        outcome = "completed"
 
-        # 7. 任务完成
-        try:
-            update_progress(task_id, 1.0, "完成")
-        except Exception:
-            pass
-        complete_task(task_id, final_state, final_signal)
+        # 7. 多维度评估（真实市场验证 / LLM 评估 / 事实一致性审计）在后台并发执行，
+        #    完成一项即追加到任务日志并附加到结果库，不再阻塞任务完成
+        #    评估结束（或未安排评估）时写入 postprocess 事件，推送流与长轮询据此结束
+        if skip_evaluation:
+            finish_postprocess(task_id, "skipped")
+        else:
+            append_log(task_id, "📊 多维度评估已在后台开始，结果将陆续附加")
+            try:
+                postprocessor.submit(task_id, ticker, trade_date, final_signal, final_state, toolkit)
+            except Exception as e:
+                append_log(task_id, f"多维度评估启动失败: {e}")
+                finish_postprocess(task_id, "skipped")
 
+    except TaskCancelled as e:
+        outcome = "cancelled"
+        cancel_task(task_id, f"用户取消（{e}）")
     except Exception as e:
+        # 回调中抛出的 TaskCancelled 可能被框架包装，以令牌状态为准
+        if token.cancelled:
+            outcome = "cancelled"
+            cancel_task(task_id, f"用户取消（{type(e).__name__}）")
+            return
         error_msg = f"任务执行失败: {str(e)}\n{traceback.format_exc()}"
         append_log(task_id, error_msg)
-        if task_id in task_storage:
-            task_storage[task_id]["status"] = "error"
-            task_storage[task_id]["error"] = error_msg
+        fail_task(task_id, error_msg)
+    finally:
+        if tracker is not None:
+            tracker.flush()
+        unbind_span(span_binding)
+        if root_span is not None:
+            root_span.set_attribute("outcome", outcome)
+            if outcome == "error":
+                root_span.record_error("任务执行失败")
+            root_span.end()
+        phases.finish(outcome)
+        release_token(task_id)
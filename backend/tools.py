@@ -1,18 +1,249 @@
 # 定义系统所有外部数据获取工具。
 # 这些工具是分析师实现 ReAct（Reasoning + Acting）循环的核心，允许智能体在需要时调用真实世界数据。
 
+import contextvars
 import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache, wraps
 from typing import Annotated
+import pandas as pd
 import yfinance as yf
 import finnhub
 from langchain_core.tools import tool
 from langchain_community.tools.tavily_search import TavilySearchResults
 from stockstats import wrap as stockstats_wrap
+from .metrics import observe_tool
+from .tracing import KIND_CLIENT, tracer
 
 tavily_tool = TavilySearchResults(max_results=3)
 
 
+def _instrumented(fn):
+    """
+    记录工具调用次数、耗时与失败（/metrics），并在当前 trace 中记录一个 span；
+    工具出错时返回 "Error ..." 字符串，同样计为失败。
+    """
+    name = fn.__name__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        with tracer.span(f"tool {name}", span_type="tool", kind=KIND_CLIENT, tool=name) as span:
+            try:
+                result = fn(*args, **kwargs)
+                error = isinstance(result, str) and result.startswith("Error")
+                if error and span is not None:
+                    span.record_error(result)
+                return result
+            finally:
+                observe_tool(name, time.perf_counter() - started, error)
+    return wrapper
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), "%Y-%m-%d").date()
+
+
+def _missing_ranges(ranges, start, end):
+    """[start, end) 中未被 ranges（[(s, e), ...]，左闭右开）覆盖的区间。"""
+    gaps = []
+    cursor = start
+    for s, e in sorted(ranges):
+        if e <= cursor:
+            continue
+        if s >= end:
+            break
+        if s > cursor:
+            gaps.append((cursor, s))
+        cursor = max(cursor, e)
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for s, e in sorted(ranges):
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+class PriceHistoryCache:
+    """
+    日线行情缓存（yf.download 的结果），按股票代码保存已下载的日期区间，区间内的请求直接切片返回。
+    - 请求超出已缓存区间时只下载未覆盖的日期区间，与已有数据按日期合并（同一股票可保存多段区间）
+    - 区间包含下载当天及以后的日期时数据仍在增长，超过 ttl 秒后整体重新下载；纯历史区间一直有效
+    - 每个股票一把锁：并发请求同一股票时只下载一次，其余等待结果（批量任务预取即依赖于此）
+    """
+
+    def __init__(self, max_symbols: int = 256, ttl: float = 3600):
+        self.max_symbols = max_symbols
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+
+    def _symbol_lock(self, symbol):
+        with self._lock:
+            return self._symbol_locks.setdefault(symbol, threading.Lock())
+
+    def _fresh(self, entry):
+        if entry["ranges"][-1][1] <= entry["fetched_on"]:
+            return True
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def _download(self, symbol, start, end) -> pd.DataFrame:
+        started = time.perf_counter()
+        try:
+            with tracer.span("yfinance download", span_type="tool", kind=KIND_CLIENT, symbol=symbol,
+                             start=start.isoformat(), end=end.isoformat()):
+                df = yf.download(symbol, start=start.isoformat(), end=end.isoformat(), progress=False)
+        except Exception:
+            observe_tool("yfinance_download", time.perf_counter() - started, True)
+            raise
+        observe_tool("yfinance_download", time.perf_counter() - started, df.empty)
+        with self._lock:
+            self.downloads += 1
+        return df
+
+    def get(self, symbol: str, start_date, end_date) -> pd.DataFrame:
+        """返回 [start_date, end_date) 的日线数据（与 yf.download 相同的列结构），结果为副本。"""
+        symbol = symbol.upper()
+        start, end = _as_date(start_date), _as_date(end_date)
+        with self._symbol_lock(symbol):
+            with self._lock:
+                entry = self._entries.get(symbol)
+            if entry is not None and not self._fresh(entry):
+                entry = None
+            gaps = _missing_ranges(entry["ranges"], start, end) if entry is not None else [(start, end)]
+            if not gaps:
+                self.hits += 1
+                with self._lock:
+                    self._entries.move_to_end(symbol)
+            else:
+                self.misses += 1
+                frames = [df for df in (self._download(symbol, s, e) for s, e in gaps) if not df.empty]
+                if entry is None and not frames:
+                    return pd.DataFrame()
+                if entry is not None and not entry["df"].empty:
+                    frames.insert(0, entry["df"])
+                df = pd.concat(frames).sort_index() if len(frames) > 1 else (frames[0] if frames else pd.DataFrame())
+                df = df[~df.index.duplicated(keep="last")]
+                ranges = _merge_ranges((entry["ranges"] if entry is not None else []) + gaps)
+                # 已缓存的数据含仍在增长的日期时沿用原下载时间（到期后整体重下），否则按本次下载计时
+                live = entry is not None and entry["ranges"][-1][1] > entry["fetched_on"]
+                entry = {"ranges": ranges, "df": df,
+                         "fetched_at": entry["fetched_at"] if live else time.time(),
+                         "fetched_on": entry["fetched_on"] if live else date.today()}
+                with self._lock:
+                    self._entries[symbol] = entry
+                    self._entries.move_to_end(symbol)
+                    while len(self._entries) > self.max_symbols:
+                        self._entries.popitem(last=False)
+        df = entry["df"]
+        if df.empty:
+            return df.copy()
+        mask = (df.index >= pd.Timestamp(start)) & (df.index < pd.Timestamp(end))
+        return df[mask].copy()
+
+    def prefetch(self, symbol: str, start_date, end_date) -> None:
+        self.get(symbol, start_date, end_date)
+
+    def stats(self):
+        with self._lock:
+            return {"symbols": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "downloads": self.downloads}
+
+
+# 全局行情缓存：真实市场验证、事实一致性审计与批量预取共用
+price_cache = PriceHistoryCache()
+
+
+class ToolResultRegistry:
+    """
+    单个任务的行情登记：后处理各阶段（真实市场验证、事实一致性审计）共用本任务已取得的行情。
+    - 行情按股票保存已取得的日期区间，请求时只取尚未覆盖的区间，再与已有数据拼接；
+      缺口经全局 price_cache 读取，price_cache 同样只下载它未缓存的日期（不会重新下载已缓存的整段区间）
+    - 通过 active() / bind_tool_results() 绑定到当前上下文，get_price_history 与依赖它的工具自动读写
+    - 图内分析师节点不调用工具（见 agents.create_analyst_node），登记表只在后处理阶段填充
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prices = {}  # symbol -> [(start, end, df)]，区间为 [start, end)
+        self.price_fetches = 0
+
+    def price_history(self, symbol: str, start_date, end_date) -> pd.DataFrame:
+        symbol = symbol.upper()
+        start, end = _as_date(start_date), _as_date(end_date)
+        with self._lock:
+            ranges = list(self._prices.get(symbol, ()))
+        for gap_start, gap_end in _missing_ranges([(s, e) for s, e, _ in ranges], start, end):
+            df = price_cache.get(symbol, gap_start, gap_end)
+            with self._lock:
+                self.price_fetches += 1
+                self._prices.setdefault(symbol, []).append((gap_start, gap_end, df))
+        with self._lock:
+            frames = [df for s, e, df in self._prices.get(symbol, ()) if s < end and e > start and not df.empty]
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames).sort_index() if len(frames) > 1 else frames[0]
+        df = df[~df.index.duplicated(keep="last")]
+        mask = (df.index >= pd.Timestamp(start)) & (df.index < pd.Timestamp(end))
+        return df[mask].copy()
+
+    @contextmanager
+    def active(self):
+        token = bind_tool_results(self)
+        try:
+            yield self
+        finally:
+            unbind_tool_results(token)
+
+    def stats(self):
+        with self._lock:
+            return {"price_ranges": sum(len(r) for r in self._prices.values()),
+                    "price_fetches": self.price_fetches}
+
+
+# 当前上下文绑定的任务登记表（未绑定时行情直接走 price_cache）
+_current_results: contextvars.ContextVar = contextvars.ContextVar("tool_results", default=None)
+
+
+def bind_tool_results(registry: ToolResultRegistry):
+    return _current_results.set(registry)
+
+
+def unbind_tool_results(token) -> None:
+    _current_results.reset(token)
+
+
+def get_price_history(symbol: str, start_date, end_date) -> pd.DataFrame:
+    registry = _current_results.get()
+    if registry is not None:
+        return registry.price_history(symbol, start_date, end_date)
+    return price_cache.get(symbol, start_date, end_date)
+
+
 @tool
+@_instrumented
 def get_yfinance_data(
         symbol: Annotated[str, "股票代码"],
         start_date: Annotated[str, "开始日期(格式:yyyy-mm-dd)"],
@@ -30,6 +261,7 @@ def get_yfinance_data(
 
 
 @tool
+@_instrumented
 def get_technical_indicators(
         symbol: Annotated[str, "股票代码"],
         start_date: Annotated[str, "开始日期(格式:yyyy-mm-dd)"],
@@ -37,7 +269,7 @@ def get_technical_indicators(
 ) -> str:
     """使用 stockstats 库检索股票的关键技术指标。"""
     try:
-        df = yf.download(symbol, start=start_date, end=end_date, progress=False)
+        df = get_price_history(symbol, start_date, end_date)
         if df.empty:
             return "No data to calculate indicators."
         stock_df = stockstats_wrap(df)
@@ -48,6 +280,7 @@ def get_technical_indicators(
 
 
 @tool
+@_instrumented
 def get_finnhub_news(ticker: str, start_date: str, end_date: str) -> str:
     """从 Finnhub 获取指定日期范围内的公司新闻。"""
     try:
@@ -66,6 +299,7 @@ tavily_tool = TavilySearchResults(max_results=3)
 
 
 @tool
+@_instrumented
 def get_social_media_sentiment(ticker: str, trade_date: str) -> str:
     """对股票相关的社交媒体情绪进行实时网络搜索。"""
     query = f"social media sentiment and discussions for {ticker} stock around {trade_date}"
@@ -73,6 +307,7 @@ def get_social_media_sentiment(ticker: str, trade_date: str) -> str:
 
 
 @tool
+@_instrumented
 def get_fundamental_analysis(ticker: str, trade_date: str) -> str:
     """对股票的最新基本面分析进行实时网络搜索。"""
     query = f"fundamental analysis and key financial metrics for {ticker} stock published around {trade_date}"
@@ -80,15 +315,36 @@ def get_fundamental_analysis(ticker: str, trade_date: str) -> str:
 
 
 @tool
+@_instrumented
 def get_macroeconomic_news(trade_date: str) -> str:
     """对与股市相关的宏观经济新闻进行实时网络搜索。"""
     query = f"macroeconomic news and market trends affecting the stock market on {trade_date}"
     return tavily_tool.invoke({"query": query})
 
 
+@lru_cache(maxsize=1024)
+def _lookup_sector(symbol: str):
+    # 查询失败时抛出异常，lru_cache 不缓存异常，下次调用会重新查询
+    return yf.Ticker(symbol).info.get("sector") or None
+
+
+def get_sector(symbol: str):
+    """查询股票所属行业（用于记忆元数据过滤），失败时返回 None。成功的结果按代码缓存，失败不缓存。"""
+    try:
+        return _lookup_sector(symbol.upper())
+    except Exception:
+        return None
+
+
+# 缓存命中统计（/metrics）
+get_sector.cache_info = _lookup_sector.cache_info
+
+
 # --- Toolkit Class ---
 class Toolkit:
-    def __init__(self):
+    def __init__(self, results: ToolResultRegistry = None):
+        # 本任务的行情登记表（后处理各阶段共用）
+        self.results = results or ToolResultRegistry()
         self.get_yfinance_data = get_yfinance_data
         self.get_technical_indicators = get_technical_indicators
         self.get_finnhub_news = get_finnhub_news
@@ -0,0 +1,367 @@
+# backend/tracing.py
+# 本地执行追踪：不依赖 LangSmith / OpenTelemetry SDK，导出格式兼容 OTLP/JSON（可导入 Jaeger、otel-desktop-viewer 等）。
+# - 每个分析任务是一条 trace：根 span "analysis"，其下为图节点、LLM 调用、工具调用，以及后台评估的各阶段
+# - 当前 span 保存在 contextvars 中；LangGraph 在线程池中执行节点时会复制上下文，节点内的 LLM / 工具 span 自动挂在节点下；
+#   后处理阶段在独立线程池执行，显式传入父 span
+# - 一条 trace 的 span 全部结束后写入 trace_dir/{task_id}.json；超时阶段的线程在导出后才返回时会重新导出
+# - critical_path() 计算关键路径，render_flamegraph() 生成按时间轴排布的火焰图（SVG），见 /trace/{task_id}/flame
+#   与 benchmarks/trace_report.py
+
+import contextvars
+import html
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from .config_user import get_user_config
+
+SERVICE_NAME = "multi-agent-trading-system"
+# OTLP 的 SpanKind / StatusCode 取值
+KIND_INTERNAL, KIND_CLIENT = 1, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _plain_value(value: dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    for key in ("doubleValue", "boolValue", "stringValue"):
+        if key in value:
+            return value[key]
+    return None
+
+
+class Span:
+    """一段计时区间；end() 可重复调用，只有第一次生效"""
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.status = STATUS_OK
+        self.message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        trace._started(self)
+
+    def set_attribute(self, key: str, value) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error) -> None:
+        """标记为失败；error 为异常或说明文字（如工具返回的 "Error ..." 字符串）。"""
+        self.status = STATUS_ERROR
+        message = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        self.message = message[:500]
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace._finished(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status, "message": self.message} if self.message else {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """一个任务的全部 span；未结束的 span 数归零时交给导出器"""
+
+    def __init__(self, task_id: str, exporter):
+        self.trace_id = os.urandom(16).hex()
+        self.task_id = task_id
+        self.exporter = exporter
+        self.spans: List[Span] = []
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def _started(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+            self._open += 1
+
+    def _finished(self, span: Span) -> None:
+        with self._lock:
+            self._open -= 1
+            done = self._open == 0
+        if done and self.exporter is not None:
+            try:
+                self.exporter.export(self)
+            except Exception as e:
+                print(f"[Tracing] 导出 trace 失败: {e}")
+
+    def to_otlp(self) -> dict:
+        with self._lock:
+            spans = [s.to_otlp() for s in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                {"key": "task.id", "value": {"stringValue": self.task_id}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "backend.tracing"}, "spans": spans}],
+        }]}
+
+
+class JsonFileExporter:
+    """每条 trace 一个 OTLP/JSON 文件；超过 max_files 时删除最旧的文件"""
+
+    def __init__(self, directory: str = "./results/traces", max_files: Optional[int] = 500):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def path(self, task_id: str) -> str:
+        return os.path.join(self.directory, f"{os.path.basename(task_id)}.json")
+
+    def export(self, trace: Trace) -> None:
+        document = trace.to_otlp()
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.path(trace.task_id)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(document, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self._prune()
+
+    def _prune(self) -> None:
+        if not self.max_files:
+            return
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def load(self, task_id: str) -> Optional[dict]:
+        try:
+            with open(self.path(task_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+# 当前上下文中的 span（未开始追踪时为 None，此时所有 span 操作都是空操作）
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def bind_span(span: Optional[Span]):
+    """把 span 设为当前上下文的父 span，返回用于 unbind_span 的令牌。"""
+    return _current_span.set(span)
+
+
+def unbind_span(token) -> None:
+    _current_span.reset(token)
+
+
+@contextmanager
+def use_span(span: Optional[Span]):
+    """在 with 块内把 span 设为当前上下文的父 span（跨线程池时使用）。"""
+    token = bind_span(span)
+    try:
+        yield span
+    finally:
+        unbind_span(token)
+
+
+class Tracer:
+    def __init__(self, exporter: Optional[JsonFileExporter] = None, enabled: bool = True):
+        self.exporter = exporter
+        self.enabled = enabled
+
+    def start_trace(self, task_id: str, name: str = "analysis", **attributes) -> Optional[Span]:
+        """开始一条新 trace，返回根 span（需由调用方 use_span 绑定并在结束时 end）。"""
+        if not self.enabled:
+            return None
+        return Span(Trace(task_id, self.exporter), name, None, KIND_INTERNAL,
+                    {"span.type": "task", "task.id": task_id, **attributes})
+
+    def start_span(self, name: str, parent: Optional[Span] = None, span_type: str = "internal",
+                   kind: int = KIND_INTERNAL, **attributes) -> Optional[Span]:
+        """
+        在 parent（默认当前 span）下开始一个 span；不在任何 trace 中时返回 None。
+        span_type（task / node / llm / tool / stage / phase）记为属性 span.type，火焰图按它着色。
+        """
+        parent = parent or _current_span.get()
+        if parent is None:
+            return None
+        return Span(parent.trace, name, parent.span_id, kind, {"span.type": span_type, **attributes})
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, span_type: str = "internal",
+             kind: int = KIND_INTERNAL, **attributes):
+        span = self.start_span(name, parent, span_type, kind, **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def wrap(self, name: str, fn: Callable, parent: Optional[Span] = None, span_type: str = "internal",
+             **attributes) -> Callable:
+        """包装函数：每次调用在 parent（默认调用时的当前 span）下记录一个 span。"""
+        def traced(*args, **kwargs):
+            with self.span(name, parent, span_type, **attributes):
+                return fn(*args, **kwargs)
+        traced.__name__ = getattr(fn, "__name__", name.replace(" ", "_"))
+        return traced
+
+    def load(self, task_id: str) -> Optional[dict]:
+        return self.exporter.load(task_id) if self.exporter is not None else None
+
+
+# ---------------- 离线分析：关键路径与火焰图 ----------------
+
+def spans_from_otlp(document: dict) -> List[dict]:
+    """OTLP/JSON -> [{"span_id", "parent_id", "name", "start", "end"（秒）, "attributes", "error"}]，按开始时间排序。"""
+    spans = []
+    for resource in document.get("resourceSpans", []):
+        for scope in resource.get("scopeSpans", []):
+            for s in scope.get("spans", []):
+                spans.append({
+                    "span_id": s["spanId"],
+                    "parent_id": s.get("parentSpanId"),
+                    "name": s["name"],
+                    "start": int(s["startTimeUnixNano"]) / 1e9,
+                    "end": int(s["endTimeUnixNano"]) / 1e9,
+                    "attributes": {a["key"]: _plain_value(a["value"]) for a in s.get("attributes", [])},
+                    "error": (s.get("status") or {}).get("message") if (s.get("status") or {}).get("code") == STATUS_ERROR else None,
+                })
+    spans.sort(key=lambda s: (s["start"], -s["end"]))
+    return spans
+
+
+def _tree(spans: List[dict]):
+    ids = {s["span_id"] for s in spans}
+    children = defaultdict(list)
+    roots = []
+    for s in spans:
+        if s["parent_id"] in ids:
+            children[s["parent_id"]].append(s)
+        else:
+            roots.append(s)
+    return roots, children
+
+
+def critical_path(spans: List[dict]) -> List[dict]:
+    """
+    关键路径：从根 span 的结束时刻向前回溯，每一层取在当前时刻之前最后结束的子 span，
+    再从它的开始时刻继续向前找下一个；子 span 内部递归同样处理。返回按开始时间排序的 span。
+    根 span 的结束时刻按整条 trace 最晚的结束时间计（后台评估可能晚于任务完成）。
+    """
+    roots, children = _tree(spans)
+    if not roots:
+        return []
+    root = max(roots, key=lambda s: s["end"] - s["start"])
+    path = []
+
+    def walk(span, until):
+        path.append(span)
+        cursor = until
+        for child in sorted(children[span["span_id"]], key=lambda c: c["end"], reverse=True):
+            if child["end"] <= cursor + 1e-6:
+                walk(child, min(child["end"], cursor))
+                cursor = child["start"]
+
+    walk(root, max(s["end"] for s in spans))
+    path.sort(key=lambda s: (s["start"], -s["end"]))
+    return path
+
+
+_COLORS = {"task": "#9e9e9e", "node": "#f4a259", "llm": "#5b8e7d", "tool": "#8cb369", "stage": "#bc4b51", "phase": "#f4e285"}
+
+
+def render_flamegraph(spans: List[dict], width: int = 1600, row_height: int = 20) -> str:
+    """按时间轴排布的火焰图（SVG）：横轴为时间，纵轴为调用深度，关键路径上的 span 加粗描边；悬停显示详情。"""
+    if not spans:
+        return '<svg xmlns="http://www.w3.org/2000/svg" width="400" height="40"><text x="10" y="25">empty trace</text></svg>'
+    roots, children = _tree(spans)
+    t0 = min(s["start"] for s in spans)
+    total = max(s["end"] for s in spans) - t0 or 1e-9
+    path = critical_path(spans)
+    on_path = {s["span_id"] for s in path}
+    scale = (width - 20) / total
+    rects = []
+    depth_max = 0
+
+    def place(span, depth):
+        nonlocal depth_max
+        depth_max = max(depth_max, depth)
+        x = 10 + (span["start"] - t0) * scale
+        w = max((span["end"] - span["start"]) * scale, 1.0)
+        y = 30 + depth * row_height
+        seconds = span["end"] - span["start"]
+        color = "#e63946" if span["error"] else _COLORS.get(span["attributes"].get("span.type"), "#a8dadc")
+        stroke = ' stroke="#1d3557" stroke-width="2"' if span["span_id"] in on_path else ' stroke="#ffffff" stroke-width="0.5"'
+        details = "\n".join([f"{span['name']}  {seconds:.3f}s  (+{span['start'] - t0:.3f}s)"]
+                            + [f"{k}: {v}" for k, v in span["attributes"].items()]
+                            + ([f"error: {span['error']}"] if span["error"] else []))
+        label = html.escape(span["name"])
+        chars = int(w / 7)
+        text = label if len(span["name"]) <= chars else (html.escape(span["name"][:max(chars - 1, 0)]) + "…" if chars > 2 else "")
+        rects.append(
+            f'<g><title>{html.escape(details)}</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 2}" fill="{color}"{stroke}/>'
+            + (f'<text x="{x + 3:.1f}" y="{y + row_height - 7}">{text}</text>' if text else "")
+            + "</g>")
+        for child in children[span["span_id"]]:
+            place(child, depth + 1)
+
+    for root in roots:
+        place(root, 0)
+    height = 40 + (depth_max + 1) * row_height
+    path_seconds = sum(s["end"] - s["start"] for s in path if not children[s["span_id"]])
+    header = (f"trace {total:.2f}s, {len(spans)} spans; "
+              f"critical path (outlined) leaf time {path_seconds:.2f}s")
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">'
+            f'<text x="10" y="18" font-size="13">{html.escape(header)}</text>'
+            + "".join(rects) + "</svg>")
+
+
+# 全局 tracer
+_config = get_user_config()
+tracer = Tracer(JsonFileExporter(_config.get("trace_dir", "./results/traces"), _config.get("trace_max_files", 500)),
+                enabled=_config.get("tracing_enabled", True))
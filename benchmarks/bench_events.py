@@ -0,0 +1,110 @@
+# 任务事件推送基准测试：同一任务有大量并发观看者（WebSocket 订阅方）时的投递延迟与 CPU 开销。
+# - push：events.stream_events（按任务发布 / 订阅，事件写入即唤醒）
+# - poll：旧实现的等价物，每个连接每 0.5 秒读取一次增量
+# 每种模式先测空闲阶段（观看者已连接、任务无新事件）的 CPU，再由后台线程按固定间隔写入事件，
+# 统计事件写入到观看者收到的延迟（p50/p99）与整个阶段的进程 CPU 时间。
+# 不经过网络，只测服务端的订阅 / 唤醒 / 读取路径。
+#
+# 用法（在项目根目录）：
+#   python -m benchmarks.bench_events --viewers 1000 --events 200
+#   python -m benchmarks.bench_events --modes push --viewers 5000
+
+import argparse
+import asyncio
+import threading
+import time
+
+MODES = ["push", "poll"]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def _viewer_push(task_id, latencies):
+    from backend.events import stream_events
+    async for event in stream_events(task_id, keepalive=15.0):
+        if event is not None and event["type"] == "log":
+            latencies.append(time.time() - event["ts"])
+
+
+async def _viewer_poll(task_id, latencies, interval=0.5):
+    from backend.storage import get_events
+    cursor = 0
+    while True:
+        batch = get_events(task_id, since=cursor)
+        for event in batch["events"]:
+            cursor = event["seq"]
+            if event["type"] == "log":
+                latencies.append(time.time() - event["ts"])
+            if event["type"] == "status":
+                return
+        await asyncio.sleep(interval)
+
+
+async def run_mode(mode, viewers, events, interval, idle):
+    from backend.storage import create_task, append_log, complete_task, finish_postprocess
+
+    task_id = create_task("BENCH", "2024-01-02")
+    latencies = []
+    viewer = _viewer_push if mode == "push" else _viewer_poll
+    tasks = [asyncio.create_task(viewer(task_id, latencies)) for _ in range(viewers)]
+    # 等所有观看者完成首次读取
+    await asyncio.sleep(1.0)
+
+    cpu0 = time.process_time()
+    await asyncio.sleep(idle)
+    idle_cpu = time.process_time() - cpu0
+
+    def _writer():
+        for n in range(events):
+            append_log(task_id, f"Executing node: step {n}")
+            time.sleep(interval)
+        complete_task(task_id, {"final_trade_decision": ""}, "HOLD")
+        finish_postprocess(task_id, "skipped")
+
+    latencies.clear()
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    writer = threading.Thread(target=_writer)
+    writer.start()
+    await asyncio.gather(*tasks)
+    writer.join()
+    elapsed = time.perf_counter() - t0
+    busy_cpu = time.process_time() - cpu0
+    return {
+        "mode": mode,
+        "viewers": viewers,
+        "delivered": len(latencies),
+        "p50_ms": _percentile(latencies, 0.50) * 1000 if latencies else float("nan"),
+        "p99_ms": _percentile(latencies, 0.99) * 1000 if latencies else float("nan"),
+        "idle_cpu_pct": idle_cpu / idle * 100,
+        "busy_cpu_pct": busy_cpu / elapsed * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务事件推送基准")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--viewers", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--events", type=int, default=100, help="写入的日志事件数")
+    parser.add_argument("--interval", type=float, default=0.02, help="事件写入间隔（秒）")
+    parser.add_argument("--idle", type=float, default=3.0, help="空闲阶段时长（秒）")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        for viewers in args.viewers:
+            results.append(asyncio.run(run_mode(mode, viewers, args.events, args.interval, args.idle)))
+
+    header = f"{'mode':<6}{'viewers':>9}{'delivered':>11}{'p50 ms':>9}{'p99 ms':>9}{'idle CPU%':>11}{'busy CPU%':>11}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['mode']:<6}{r['viewers']:>9}{r['delivered']:>11}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['idle_cpu_pct']:>11.1f}{r['busy_cpu_pct']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
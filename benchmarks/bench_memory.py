@@ -0,0 +1,114 @@
+# 记忆向量存储基准测试：ChromaDB vs NumPy 内存映射索引
+# 对比启动耗时（含导入）、写入耗时、查询延迟（p50/p95）与进程峰值 RSS。
+# 每种存储在独立子进程中运行，避免相互影响 RSS 与导入缓存。
+#
+# 用法（在项目根目录）：
+#   python -m benchmarks.bench_memory --rows 5000 --dim 1536 --queries 200
+#   python -m benchmarks.bench_memory --stores numpy numpy-f16
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+STORES = ["chroma", "numpy", "numpy-f16"]
+
+
+def _rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_worker(store_name, rows, dim, queries, batch):
+    import numpy as np
+
+    rss_before = _rss_mb()
+    t0 = time.perf_counter()
+    from backend.memory import ChromaVectorStore, NumpyVectorStore
+    if store_name == "chroma":
+        store = ChromaVectorStore("bench_memory")
+    else:
+        dtype = "float16" if store_name == "numpy-f16" else "float32"
+        store = NumpyVectorStore("bench_memory", dtype=dtype)
+    startup_s = time.perf_counter() - t0
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((rows, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+
+    t0 = time.perf_counter()
+    for start in range(0, rows, batch):
+        chunk = data[start:start + batch]
+        docs = [f"situation {start + i}" for i in range(len(chunk))]
+        metas = [{"recommendation": f"advice {start + i}"} for i in range(len(chunk))]
+        store.add(docs, metas, chunk.tolist())
+    add_s = time.perf_counter() - t0
+
+    # 查询向量取自已有行加噪声，正确答案应为该行本身
+    targets = rng.integers(0, rows, size=queries)
+    latencies = []
+    hits = 0
+    for t in targets:
+        q = data[t] + 0.01 * rng.standard_normal(dim).astype(np.float32)
+        t0 = time.perf_counter()
+        result = store.query(q.tolist(), 3)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += int(result[0]["recommendation"] == f"advice {t}")
+
+    return {
+        "store": store_name,
+        "rows": rows,
+        "dim": dim,
+        "startup_ms": round(startup_s * 1000, 1),
+        "add_s": round(add_s, 3),
+        "query_p50_ms": round(_percentile(latencies, 0.5), 3),
+        "query_p95_ms": round(_percentile(latencies, 0.95), 3),
+        "top1_recall": round(hits / queries, 3),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆向量存储基准测试")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--stores", nargs="+", default=STORES, choices=STORES)
+    parser.add_argument("--worker", choices=STORES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.rows, args.dim, args.queries, args.batch)))
+        return
+
+    results = []
+    for store in args.stores:
+        cmd = [sys.executable, "-m", "benchmarks.bench_memory", "--worker", store,
+               "--rows", str(args.rows), "--dim", str(args.dim),
+               "--queries", str(args.queries), "--batch", str(args.batch)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"[{store}] 运行失败:\n{proc.stderr.strip()}")
+            continue
+        # 子进程的导入可能打印配置信息，结果在最后一行
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        return
+    columns = list(results[0].keys())
+    print(" | ".join(columns))
+    for r in results:
+        print(" | ".join(str(r[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
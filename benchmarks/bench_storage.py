@@ -0,0 +1,158 @@
+# 任务存储并发基准测试：多个后台任务并发写日志，同时有读取方（/status、/events、/tasks、WebSocket）反复读取。
+# 统计写入吞吐、单次 append_log 延迟（p50/p99）、读取次数与读取异常数。
+# memory-global 为对照组：同一个 InMemoryTaskStore 外面包一把全局锁（所有读写串行），
+# 用来确认按任务加锁不会把热点写入路径串行化。
+#
+# 用法（在项目根目录）：
+#   python -m benchmarks.bench_storage --writers 8 --readers 0 8 --lines 5000
+#   python -m benchmarks.bench_storage --stores memory sqlite
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+STORES = ["memory", "memory-global", "sqlite"]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class GlobalLockStore:
+    """对照组：所有操作共用一把锁"""
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if not callable(attr):
+            return attr
+
+        def _wrapped(*args, **kwargs):
+            with self._lock:
+                result = attr(*args, **kwargs)
+                # 生成器（summaries）也需在锁内消费完
+                return list(result) if name == "summaries" else result
+        return _wrapped
+
+    def list(self, *args, **kwargs):
+        with self._lock:
+            return self._store.list(*args, **kwargs)
+
+
+def make_store(name, tmpdir):
+    from backend.storage import InMemoryTaskStore, SqliteTaskStore
+    if name == "memory":
+        return InMemoryTaskStore(log_max_lines=2000, event_max=4000)
+    if name == "memory-global":
+        return GlobalLockStore(InMemoryTaskStore(log_max_lines=2000, event_max=4000))
+    if name == "sqlite":
+        return SqliteTaskStore(os.path.join(tmpdir, f"bench_{time.time_ns()}.db"))
+    raise ValueError(name)
+
+
+def run_case(store_name, writers, readers, lines, tmpdir):
+    store = make_store(store_name, tmpdir)
+    task_ids = [f"task-{i}" for i in range(writers)]
+    for i, tid in enumerate(task_ids):
+        store.create(tid, f"T{i}", "2024-01-02", "任务启动")
+
+    latencies = [[] for _ in range(writers)]
+    reads = [0] * readers
+    errors = []
+    done = threading.Event()
+
+    def _writer(idx):
+        tid = task_ids[idx]
+        lat = latencies[idx]
+        for n in range(lines):
+            t0 = time.perf_counter()
+            store.append_log(tid, f"Executing node: step {n}")
+            lat.append(time.perf_counter() - t0)
+            if n % 50 == 0:
+                store.update_progress(tid, n / lines, f"step {n}")
+            if n % 500 == 0:
+                store.add_report(tid, f"report {n}", "# 报告\n" + "内容 " * 500)
+        store.complete(tid, {"decision": "", "signal": "HOLD"})
+
+    def _reader(idx):
+        rng = random.Random(idx)
+        cursors = {tid: 0 for tid in task_ids}
+        while not done.is_set():
+            tid = rng.choice(task_ids)
+            try:
+                op = rng.random()
+                if op < 0.4:
+                    batch = store.get_events(tid, since=cursors[tid])
+                    cursors[tid] = batch["last_seq"]
+                elif op < 0.8:
+                    store.get(tid)
+                elif op < 0.95:
+                    store.list(limit=50)
+                else:
+                    store.memory_stats()
+            except Exception as e:
+                errors.append(repr(e))
+            reads[idx] += 1
+
+    reader_threads = [threading.Thread(target=_reader, args=(i,), daemon=True) for i in range(readers)]
+    writer_threads = [threading.Thread(target=_writer, args=(i,)) for i in range(writers)]
+    for t in reader_threads:
+        t.start()
+    t0 = time.perf_counter()
+    for t in writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    for t in reader_threads:
+        t.join()
+
+    all_lat = [x for lat in latencies for x in lat]
+    return {
+        "store": store_name,
+        "writers": writers,
+        "readers": readers,
+        "appends_per_s": len(all_lat) / elapsed,
+        "append_p50_us": _percentile(all_lat, 0.50) * 1e6,
+        "append_p99_us": _percentile(all_lat, 0.99) * 1e6,
+        "reads_per_s": sum(reads) / elapsed,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务存储并发基准")
+    parser.add_argument("--stores", nargs="+", default=STORES, choices=STORES)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, nargs="+", default=[0, 8])
+    parser.add_argument("--lines", type=int, default=5000)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for store_name in args.stores:
+            for readers in args.readers:
+                results.append(run_case(store_name, args.writers, readers, args.lines, tmpdir))
+
+    header = f"{'store':<14}{'readers':>8}{'appends/s':>12}{'p50 µs':>10}{'p99 µs':>10}{'reads/s':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['store']:<14}{r['readers']:>8}{r['appends_per_s']:>12.0f}{r['append_p50_us']:>10.1f}"
+              f"{r['append_p99_us']:>10.1f}{r['reads_per_s']:>10.0f}{r['errors']:>8}")
+    for r in results:
+        if r["errors"]:
+            print(f"[{r['store']} readers={r['readers']}] 首个读取异常: {r['first_error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# 规则信号提取的回归校验：用 signal_corpus.jsonl 中的决策文本检查 backend.signals.extract_signal_rules。
+# - 非模糊样本（ambiguous=false）：规则必须以不低于阈值的置信度给出正确信号（命中）
+# - 模糊样本（ambiguous=true）：规则可以交给 LLM（置信度低于阈值），但不能以高置信度给出错误信号
+# 输出命中率（无需调用 LLM 的比例）与失败样本；有失败时以非零状态码退出。
+# 修改 backend/signals.py 的规则后运行；线上遇到规则判错的决策文本时，把它加进语料。
+#
+# 用法（在项目根目录）：
+#   python -m benchmarks.check_signal_rules
+#   python -m benchmarks.check_signal_rules --threshold 0.8 --verbose
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from backend.signals import extract_signal_rules
+
+CORPUS = os.path.join(os.path.dirname(__file__), "signal_corpus.jsonl")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="规则信号提取回归校验")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--threshold", type=float, default=0.75, help="采用规则结果的最低置信度（signal_rule_min_confidence）")
+    parser.add_argument("--verbose", action="store_true", help="打印每个样本的结果")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    hits = 0
+    failures = []
+    by_rule = {}
+    started = time.perf_counter()
+    for i, case in enumerate(cases, 1):
+        signal, confidence, rule = extract_signal_rules(case["text"])
+        confident = signal is not None and confidence >= args.threshold
+        by_rule[rule] = by_rule.get(rule, 0) + 1
+        if confident and signal == case["expected"]:
+            hits += 1
+            verdict = "hit"
+        elif confident:
+            verdict = "WRONG"
+            failures.append((i, case, signal, confidence, rule))
+        elif case.get("ambiguous"):
+            verdict = "llm"
+        else:
+            verdict = "MISS"
+            failures.append((i, case, signal, confidence, rule))
+        if args.verbose:
+            print(f"{i:>3} {verdict:<6}{rule:<16}{str(signal):<6}{confidence:>5.2f}  {case['text'][:50]!r}")
+    elapsed = time.perf_counter() - started
+
+    print(f"样本 {len(cases)}，规则命中 {hits}（{hits / len(cases):.0%}），"
+          f"交给 LLM {len(cases) - hits - len(failures)}，失败 {len(failures)}，"
+          f"平均 {elapsed / len(cases) * 1e6:.0f}µs/条")
+    print("命中规则分布: " + ", ".join(f"{k}={v}" for k, v in sorted(by_rule.items())))
+    for i, case, signal, confidence, rule in failures:
+        print(f"  #{i} 期望 {case['expected']}，规则 {signal}（{confidence:.2f}, {rule}）: {case['text'][:80]!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
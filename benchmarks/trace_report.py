@@ -0,0 +1,86 @@
+# 离线分析任务 trace（backend/tracing.py 导出的 OTLP/JSON 文件）：
+# - 关键路径：从任务结束时刻向前回溯，每层取最后结束的子 span，列出路径上各 span 的起点与耗时
+# - 按名称汇总的总耗时 / 自身耗时（不含子 span），找出最耗时的节点、模型调用与工具
+# - 可选输出火焰图 SVG（与 /trace/{task_id}/flame 相同）
+#
+# 用法（在项目根目录）：
+#   python -m benchmarks.trace_report results/traces/<task_id>.json
+#   python -m benchmarks.trace_report <task_id> --svg flame.svg --top 15
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+from backend.tracing import critical_path, render_flamegraph, spans_from_otlp
+
+
+def _load(arg, trace_dir):
+    path = arg if os.path.exists(arg) else os.path.join(trace_dir, f"{arg}.json")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务 trace 离线分析")
+    parser.add_argument("trace", help="trace 文件路径，或 trace_dir 下的 task_id")
+    parser.add_argument("--trace-dir", default="./results/traces")
+    parser.add_argument("--svg", help="输出火焰图 SVG 到该文件")
+    parser.add_argument("--top", type=int, default=10, help="按自身耗时列出的 span 名称数")
+    args = parser.parse_args()
+
+    try:
+        spans = spans_from_otlp(_load(args.trace, args.trace_dir))
+    except FileNotFoundError as e:
+        print(f"找不到 trace: {e.filename}")
+        sys.exit(1)
+    if not spans:
+        print("trace 为空")
+        sys.exit(1)
+
+    t0 = min(s["start"] for s in spans)
+    total = max(s["end"] for s in spans) - t0
+    print(f"span {len(spans)} 个，总时长 {total:.2f}s")
+
+    print("\n关键路径：")
+    path = critical_path(spans)
+    depth = {}
+    by_id = {s["span_id"]: s for s in spans}
+    for s in path:
+        depth[s["span_id"]] = depth.get(s["parent_id"], -1) + 1 if s["parent_id"] in by_id else 0
+        seconds = s["end"] - s["start"]
+        mark = "  ✗ " + s["error"] if s["error"] else ""
+        print(f"  +{s['start'] - t0:8.2f}s {seconds:8.2f}s  {'  ' * depth[s['span_id']]}{s['name']}{mark}")
+
+    # 自身耗时 = 自身时长 - 子 span 覆盖的时长（子 span 之间可能并发，按区间并集计算）
+    children = defaultdict(list)
+    for s in spans:
+        if s["parent_id"] in by_id:
+            children[s["parent_id"]].append((s["start"], s["end"]))
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for s in spans:
+        covered, cursor = 0.0, s["start"]
+        for start, end in sorted(children[s["span_id"]]):
+            start, end = max(start, cursor), min(end, s["end"])
+            if end > start:
+                covered += end - start
+                cursor = end
+        entry = totals[s["name"]]
+        entry[0] += 1
+        entry[1] += s["end"] - s["start"]
+        entry[2] += max(0.0, s["end"] - s["start"] - covered)
+
+    print(f"\n自身耗时最多的 {args.top} 项：")
+    print(f"  {'名称':<36}{'次数':>6}{'总耗时':>10}{'自身耗时':>10}")
+    for name, (count, seconds, self_seconds) in sorted(totals.items(), key=lambda kv: -kv[1][2])[:args.top]:
+        print(f"  {name[:36]:<36}{count:>6}{seconds:>9.2f}s{self_seconds:>9.2f}s")
+
+    if args.svg:
+        with open(args.svg, "w", encoding="utf-8") as f:
+            f.write(render_flamegraph(spans))
+        print(f"\n火焰图已写入 {args.svg}")
+
+
+if __name__ == "__main__":
+    main()
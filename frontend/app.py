@@ -68,7 +68,7 @@ with home_tab:
     api_base = user_config.get("API_BASE", settings_mod.DEFAULT_CONFIG["API_BASE"]).rstrip("/")
     session = settings_mod.get_smart_session(user_config)
   
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         ticker = st.text_input("股票代码", value="NVDA", help="例如：NVDA, AAPL, 0700.HK")
     with col2:
@@ -76,19 +76,32 @@ with home_tab:
             "交易日期",
             value=datetime.now().date() - timedelta(days=2)
         )
+    with col3:
+        deadline_minutes = st.number_input(
+            "截止时间（分钟）", min_value=0, value=0, step=1,
+            help="0 表示不限；设置后预计赶不上时会减少辩论轮数、跳过风控讨论或改用快速模型，保证按时给出信号"
+        )
     trade_date = trade_date_input.strftime('%Y-%m-%d')
 
     if st.button("🚀 开始深度分析", type="primary", use_container_width=True):
         submit_ph = st.empty()
         submit_ph.info("正在提交分析任务...")
         api_base = user_config["API_BASE"]
-        resp = requests.post(f"{api_base}/start", json={"ticker": ticker, "trade_date": trade_date})
-        if resp.status_code != 200:
+        payload = {"ticker": ticker, "trade_date": trade_date}
+        if deadline_minutes:
+            payload["deadline_seconds"] = deadline_minutes * 60
+        resp = requests.post(f"{api_base}/start", json=payload)
+        if resp.status_code in (429, 503):
+            submit_ph.warning(f"任务队列繁忙，请稍后重试（{resp.json().get('detail', '')}）")
+        elif resp.status_code != 200:
             submit_ph.error("后端服务不可用")
         else:
             task_id = resp.json()["task_id"]
             # persist the success message in a placeholder so it doesn't vanish on reruns
-            submit_ph.success(f"任务提交成功！Task ID: {task_id}")
+            if resp.json().get("deduplicated"):
+                submit_ph.success(f"相同的分析已在进行或刚刚完成，已关联到该任务。Task ID: {task_id}")
+            else:
+                submit_ph.success(f"任务提交成功！Task ID: {task_id}")
             # ---------------- websocket listener ----------------
             q = queue.Queue()
             stop_event = threading.Event()
@@ -122,6 +135,15 @@ with home_tab:
                             if parsed.get("markdown"):
                                 out_q.put(parsed.get("markdown"))
                                 return
+                            # server dropped events we have not seen (in-memory ring buffer overflow)
+                            if parsed.get("type") == "gap":
+                                out_q.put(f"**部分日志已被丢弃（seq {parsed.get('since', 0) + 1} - {parsed.get('first_seq', 0) - 1}），完整日志可在任务结束后下载**")
+                                return
+                            # main analysis finished: background evaluation is shown by the long-poll below
+                            if parsed.get("type") == "status":
+                                out_q.put(message)
+                                ws.close()
+                                return
                             # If final result object included
                             if parsed.get("type") == "final_result" or parsed.get("final"):
                                 out_q.put(parsed)
@@ -196,11 +218,13 @@ with home_tab:
                         except Exception:
                             pass
                         pstatus = item.get("status")
+                        eta = item.get("eta_seconds")
+                        eta_text = f"，预计剩余 {int(eta // 60)} 分 {int(eta % 60)} 秒" if eta else ""
                         try:
                             if pstatus:
-                                status_text.text(f"分析进行中({pstatus})... {int(prog*100)}%")
+                                status_text.text(f"分析进行中({pstatus})... {int(prog*100)}%{eta_text}")
                             else:
-                                status_text.text(f"分析进行中... {int(prog*100)}%")
+                                status_text.text(f"分析进行中... {int(prog*100)}%{eta_text}")
                         except Exception:
                             pass
                         continue
@@ -306,12 +330,6 @@ with home_tab:
                         # fallback: plain markdown
                         reports_placeholder.markdown(combined or "(无日志)", unsafe_allow_html=False)
 
-                # update progress every loop iteration so the progress bar moves
-                try:
-                    progress.progress(min(len(logs) / 25, 0.95))
-                except Exception:
-                    pass
-
             # ws closed; fetch final status by HTTP as fallback
             try:
                 status_resp = requests.get(f"{api_base}/status/{task_id}")
@@ -324,6 +342,52 @@ with home_tab:
                     st.markdown("### 最终决策")
                     st.markdown(result.get("decision", ""))
                     st.download_button("下载日志", "\n\n".join(logs), f"analysis_{ticker}.md")
+
+                    # 多维度评估在任务完成后于后台执行，长轮询后续事件，陆续显示
+                    st.markdown("### 多维度评估")
+                    eval_ph = st.empty()
+                    eval_lines = []
+                    # evaluation logs written before this snapshot follow the "评估已在后台开始" line
+                    task_logs = data.get("logs") or []
+                    started_at = next((i for i, line in enumerate(task_logs) if "多维度评估已在后台开始" in line), None)
+                    if started_at is not None:
+                        eval_lines = list(task_logs[started_at + 1:])
+                        if eval_lines:
+                            eval_ph.markdown("\n\n".join(eval_lines))
+                    since = data.get("last_seq", 0)
+                    outcome = data.get("postprocess")
+                    closed = data.get("closed", False)
+                    deadline = time.time() + 300
+                    backoff = 1.0
+                    if not closed and not eval_lines:
+                        eval_ph.info("评估进行中...")
+                    # long-poll blocks until new events arrive; stop at the postprocess event (evaluation done / skipped)
+                    while not closed and time.time() < deadline:
+                        poll_started = time.time()
+                        poll = requests.get(f"{api_base}/status/{task_id}", params={"since": since, "wait": 30}, timeout=40)
+                        if poll.status_code != 200:
+                            break
+                        batch = poll.json()
+                        since = batch.get("last_seq", since)
+                        events = batch.get("events", [])
+                        for event in events:
+                            if event.get("type") == "log":
+                                eval_lines.append(event["line"])
+                            elif event.get("type") == "postprocess":
+                                outcome = event.get("outcome")
+                        closed = batch.get("closed", False) or batch.get("status") == "not_found"
+                        if eval_lines:
+                            eval_ph.markdown("\n\n".join(eval_lines))
+                        # back off if the server answered immediately without news (e.g. an older backend)
+                        if not events and not closed and time.time() - poll_started < 1:
+                            time.sleep(backoff)
+                            backoff = min(backoff * 2, 30)
+                        elif events:
+                            backoff = 1.0
+                    if outcome == "skipped":
+                        eval_ph.info("本次分析未进行多维度评估（截止时间模式降级 / 超时，或评估启动失败，详见日志）。")
+                    elif not eval_lines and closed:
+                        eval_ph.info("多维度评估已结束，结果见任务日志。")
                 else:
                     st.warning("无法通过 HTTP 获取最终结果，可能已通过 WebSocket 完成。")
             except Exception as e:
@@ -22,6 +22,8 @@ DEFAULT_CONFIG = {
     "max_risk_discuss_rounds": 1,
     "max_recur_limit": 100,
     "online_tools": True,
+    "embedding_backend": "api",
+    "memory_store": "chroma",
     "prompts": {
         "bull": "您是一位多头分析师。您的目标是论证投资该股票的合理性。请重点关注增长潜力、竞争优势以及报告中的积极指标。有效反驳看跌分析师的论点。",
         "bear": "您是一位空头分析师。您的目标是论证投资该股票的不合理性。请重点关注风险、挑战以及负面指标。有效反驳看涨分析师的论点。",
@@ -224,6 +226,14 @@ def render_settings(user_config):
         max_risk = st.slider("风控辩论轮数", 1, 3, user_config.get("max_risk_discuss_rounds", 1))
         max_recur = st.number_input("最大递归限制", 50, 500, user_config.get("max_recur_limit", 100))
         online_tools = st.checkbox("启用在线工具", value=user_config.get("online_tools", True))
+        embedding_options = ["api", "local"]
+        embedding_backend = st.selectbox("记忆嵌入后端", options=embedding_options,
+                                         index=embedding_options.index(user_config.get("embedding_backend", "api")))
+        st.caption("api：使用 LLM 提供商的 embeddings 接口；local：本地哈希向量（纯 CPU，无需联网，适合离线测试）。")
+        memory_store_options = ["chroma", "numpy"]
+        memory_store = st.selectbox("记忆向量存储", options=memory_store_options,
+                                    index=memory_store_options.index(user_config.get("memory_store", "chroma")))
+        st.caption("chroma：ChromaDB 集合；numpy：内存映射矩阵 + 暴力检索，适合几千条以内的记忆，启动更快、内存更小。")
 
     with st.expander("✍️ 自定义提示词"):
         prompts = user_config.get("prompts", {}).copy()
@@ -248,6 +258,8 @@ def render_settings(user_config):
             "max_risk_discuss_rounds": max_risk,
             "max_recur_limit": max_recur,
             "online_tools": online_tools,
+            "embedding_backend": embedding_backend,
+            "memory_store": memory_store,
             "prompts": prompts
         })
 